@@ -0,0 +1,205 @@
+"""Measure AsyncDatabase throughput under many simultaneous readers and writers
+
+Usage: python benchmarks/bench_async.py [--size N] [--clients 8:2,64:16,256:64]
+           [--seconds S] [--readers N] [--data-dir DIR] [--output FILE]
+
+Each readers:writers pair runs for --seconds against `AsyncDatabase` and against
+a plain `Database` called the naive way, on a single executor thread. Readers
+cycle through `get_url`, `get_random_url` and a page of `list_urls`; writers add
+urls, which are removed after each run. Results are written as JSON, and the
+speedup of each pair is printed to stderr.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_database import metadata  # noqa: E402
+from pyjj.aio import READERS, AsyncDatabase  # noqa: E402
+from pyjj.database import Database  # noqa: E402
+from synthetic import generate, tag_names  # noqa: E402
+
+NEW_URLS = "https://benchmark.example.com/"
+
+
+class SerialDatabase:
+    """A `Database` called from asyncio on one executor thread, as it would be
+    without `AsyncDatabase`
+    """
+
+    def __init__(self, division: str, path: str):
+        self.db = Database(division=division, path=path, check_same_thread=False)
+        self.executor = ThreadPoolExecutor(1)
+        self.writes = self.batches = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        return lambda *args, **kwargs: asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(method, *args, **kwargs)
+        )
+
+    async def list_urls(self, *args, **kwargs):
+        for row in await self.__getattr__("list_urls")(*args, **kwargs):
+            yield row
+
+    async def close(self):
+        self.executor.shutdown()
+        self.db.close()
+
+
+def percentile(timings: list, fraction: float) -> float:
+    if not timings:
+        return 0.0
+    timings = sorted(timings)
+    return round(timings[min(int(len(timings) * fraction), len(timings) - 1)], 3)
+
+
+async def run_clients(db, readers: int, writers: int, seconds: float, size: int):
+    """Runs readers and writers until the time is up
+
+    :return: a tuple with lists of read and write latencies in milliseconds
+    """
+    tag = tag_names(100)[0]
+    new_ids = itertools.count()
+    rng = random.Random(0)
+
+    async def read(i: int):
+        if i % 3 == 0:
+            await db.get_url(rng.randint(1, size))
+        elif i % 3 == 1:
+            await db.get_random_url(tag=tag)
+        else:
+            async for _ in db.list_urls(tag=tag, limit=20):
+                pass
+
+    async def write(i: int):
+        url = f"{NEW_URLS}{next(new_ids)}"
+        status, message = await db.add_url(url, tags=["benchmark"])
+        if not status:
+            raise RuntimeError(message)
+
+    deadline = time.perf_counter() + seconds
+
+    async def client(operation, latencies: list):
+        for i in itertools.count():
+            start = time.perf_counter()
+            if start > deadline:
+                break
+            await operation(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    reads, writes = [], []
+    await asyncio.gather(
+        *(client(read, reads) for _ in range(readers)),
+        *(client(write, writes) for _ in range(writers)),
+    )
+    return reads, writes
+
+
+def remove_new_urls(division: str, path: str):
+    db = Database(division=division, path=path)
+    db.connection.execute(
+        f"DELETE FROM pyjj_{division}_urls WHERE url LIKE ?", (f"{NEW_URLS}%",)
+    )
+    db.connection.commit()
+    db.prune_tags()
+    db.close()
+
+
+async def run_pair(path: str, division: str, size: int, pair: str, options):
+    readers, writers = (int(n) for n in pair.split(":"))
+    seconds = options.seconds
+    results = []
+    for mode in ("serial", "async"):
+        if mode == "async":
+            db = AsyncDatabase(division=division, path=path, readers=options.readers)
+            await db.open()
+        else:
+            db = SerialDatabase(division, path)
+        reads, writes = await run_clients(db, readers, writers, seconds, size)
+        await db.close()
+        remove_new_urls(division, path)
+        results.append(
+            {
+                "size": size,
+                "mode": mode,
+                "readers": readers,
+                "writers": writers,
+                "reads_per_s": round(len(reads) / seconds, 1),
+                "writes_per_s": round(len(writes) / seconds, 1),
+                "read_p50_ms": percentile(reads, 0.5),
+                "read_p99_ms": percentile(reads, 0.99),
+                "write_p50_ms": percentile(writes, 0.5),
+                "write_p99_ms": percentile(writes, 0.99),
+                "writes_per_commit": round(db.writes / db.batches, 1)
+                if db.batches
+                else 1.0,
+            }
+        )
+    return results
+
+
+def summarize(results: list) -> None:
+    """Print throughput of each pair and its speedup over serial calls to stderr"""
+    print(
+        f"{'CLIENTS':>9} {'MODE':>6} {'READS/S':>9} {'WRITES/S':>9} "
+        f"{'READ P99':>9} {'WRITE P99':>9} {'BATCH':>6}",
+        file=sys.stderr,
+    )
+    for serial, result in zip(results[::2], results[1::2]):
+        for r in (serial, result):
+            print(
+                f"{r['readers']:>4}:{r['writers']:<4} {r['mode']:>6} "
+                f"{r['reads_per_s']:>9} {r['writes_per_s']:>9} "
+                f"{r['read_p99_ms']:>9} {r['write_p99_ms']:>9} "
+                f"{r['writes_per_commit']:>6}",
+                file=sys.stderr,
+            )
+        total = serial["reads_per_s"] + serial["writes_per_s"]
+        if total:
+            speedup = (result["reads_per_s"] + result["writes_per_s"]) / total
+            print(f"{'':>9} {'':>6} {speedup:.2f}x requests/s", file=sys.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--clients", default="8:2,64:16,256:64")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--readers", type=int, default=READERS)
+    parser.add_argument("--data-dir")
+    parser.add_argument("--output")
+    options = parser.parse_args()
+
+    division = f"async{options.size}"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = options.data_dir or tmp
+        os.makedirs(path, exist_ok=True)
+        generate(path, division, options.size).close()
+        results = []
+        for pair in options.clients.split(","):
+            run = run_pair(path, division, options.size, pair, options)
+            results += asyncio.run(run)
+
+    report = {"meta": metadata(), "results": results}
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+    summarize(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
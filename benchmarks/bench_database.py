@@ -0,0 +1,242 @@
+"""Time Database operations and CLI commands on synthetic divisions
+
+Usage: python benchmarks/bench_database.py [--sizes 10000,100000,1000000]
+           [--runs N] [--data-dir DIR] [--output FILE] [--baseline FILE]
+
+Results are written as JSON, so runs on different commits can be compared with
+--baseline. Divisions are generated in a temporary directory unless --data-dir
+is given, in which case they are reused across runs.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from click.testing import CliRunner  # noqa: E402
+
+from pyjj import pyjj  # noqa: E402
+from synthetic import generate, tag_names  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(func, runs: int, before=None, after=None) -> dict:
+    """Time a function, running `before` and `after` around each run untimed
+
+    :param func: a function to time
+    :param int runs: a number of runs
+    :return: a dict of timings in milliseconds
+    """
+    timings = []
+    for _ in range(runs):
+        if before:
+            before()
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+        if after:
+            after()
+    return {
+        "runs": runs,
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+    }
+
+
+def database_operations(db) -> dict:
+    """Returns operations to time; each is a tuple of (func, before, after)"""
+    # The 100th most frequent tag is on ~0.1% of urls
+    head_tag, tail_tag = tag_names(100)[0], tag_names(100)[-1]
+    new_url = "https://benchmark.example.com/new"
+
+    def remove_new_url():
+        db.connection.execute(
+            f"DELETE FROM pyjj_{db.division}_urls WHERE url=?", (new_url,)
+        )
+        db.connection.commit()
+
+    # Urls added by a run are dated in the future, to be removed after it
+    new_entries = [
+        {
+            "url": f"https://benchmark.example.com/{i}",
+            "tags": [head_tag, f"benchmark{i % 50}"],
+            "created_at": "2099-01-01 00:00:00",
+        }
+        for i in range(1000)
+    ]
+
+    ids = range(1, 101)
+
+    def add_urls():
+        for entry in new_entries[:100]:
+            db.add_url(entry["url"], tags=entry["tags"])
+
+    def remove_new_urls():
+        db.connection.execute(
+            f"DELETE FROM pyjj_{db.division}_urls WHERE created_at>='2099-01-01'"
+            f" OR url LIKE 'https://benchmark.example.com/%'"
+        )
+        db.connection.commit()
+
+    return {
+        "add_url": (lambda: db.add_url(new_url), None, remove_new_url),
+        "add_url_with_tags": (
+            lambda: db.add_url(new_url, tags=[head_tag, tail_tag, "benchmark"]),
+            None,
+            remove_new_url,
+        ),
+        "add_tags": (
+            lambda: db.add_tags(1, ["benchmark", tail_tag]),
+            None,
+            lambda: (db.remove_url_tag(1, "benchmark"), db.remove_url_tag(1, tail_tag)),
+        ),
+        "add_url_x100": (add_urls, None, remove_new_urls),
+        "bulk_add_urls_1000": (
+            lambda: db.bulk_add_urls(new_entries),
+            None,
+            remove_new_urls,
+        ),
+        "list_urls": (lambda: db.list_urls(), None, None),
+        "list_urls_limit_20": (lambda: db.list_urls(limit=20), None, None),
+        "list_urls_head_tag": (lambda: db.list_urls(tag=head_tag), None, None),
+        "list_urls_tail_tag": (lambda: db.list_urls(tag=tail_tag), None, None),
+        "get_random_url": (lambda: db.get_random_url(), None, None),
+        "get_random_url_tail_tag": (lambda: db.get_random_url(tail_tag), None, None),
+        "list_tags": (lambda: db.list_tags(), None, None),
+        "find_urls": (lambda: list(db.find_urls("python12")), None, None),
+        "find_urls_fuzzy": (
+            lambda: list(db.find_urls("pyhton12 exmaple", fuzzy=True)),
+            None,
+            None,
+        ),
+        "suggest_tags": (lambda: db.suggest_tags("pythn"), None, None),
+        "check_tag_x100": (lambda: [db.check_tag(tail_tag) for _ in ids], None, None),
+        "get_url_x100": (lambda: [db.get_url(id) for id in ids], None, None),
+        "remove_url_tag": (
+            lambda: db.remove_url_tag(1, "benchmark"),
+            lambda: db.add_tags(1, ["benchmark"]),
+            None,
+        ),
+    }
+
+
+def cli_commands() -> dict:
+    """Returns CLI commands to time through click's CliRunner"""
+    head_tag = tag_names(1)[0]
+    return {
+        "cli_list_limit_20": ["list", "--limit", "20"],
+        "cli_list_head_tag_limit_20": ["list", "-t", head_tag, "--limit", "20"],
+        "cli_search": ["search", "python", "docs"],
+        "cli_eureka": ["eureka"],
+        "cli_eureka_head_tag": ["eureka", "-t", head_tag],
+        "cli_tags": ["tags"],
+        "cli_find_fuzzy": ["find", "--fuzzy", "pyhton12", "exmaple"],
+    }
+
+
+def run_size(path: str, size: int, runs: int, slow_runs: int) -> list:
+    """Generate a division of the size and time every operation on it"""
+    division = f"bench{size}"
+    start = time.perf_counter()
+    db = generate(path, division, size)
+    results = [
+        {
+            "size": size,
+            "operation": "generate",
+            "runs": 1,
+            "min_ms": round((time.perf_counter() - start) * 1000, 3),
+            "median_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+    ]
+
+    for name, (func, before, after) in database_operations(db).items():
+        # Materializing every url is too slow to repeat as often on big divisions
+        n = slow_runs if name.startswith("list_urls") else runs
+        timings = measure(func, n, before, after)
+        results.append({"size": size, "operation": name, **timings})
+    db.close()
+
+    runner = CliRunner(env={"PYJJ_HOME": path})
+    with open(os.path.join(path, "config.yaml"), "w") as file:
+        file.write(f"division: {division}")
+    for name, args in cli_commands().items():
+
+        def invoke():
+            result = runner.invoke(pyjj, args)
+            if result.exit_code:
+                raise RuntimeError(result.output)
+
+        results.append({"size": size, "operation": name, **measure(invoke, runs)})
+    return results
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ).stdout.decode().strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def compare(results: list, baseline: list) -> None:
+    """Print ratios of median timings against a baseline run to stderr"""
+    previous = {(r["size"], r["operation"]): r["median_ms"] for r in baseline}
+    for result in results:
+        key = (result["size"], result["operation"])
+        if previous.get(key):
+            ratio = result["median_ms"] / previous[key]
+            print(f"{key[0]:>9} {key[1]:28} {ratio:6.2f}x", file=sys.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--slow-runs", type=int, default=3)
+    parser.add_argument("--data-dir")
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    options = parser.parse_args()
+
+    sizes = [int(size) for size in options.sizes.split(",")]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = options.data_dir or tmp
+        os.makedirs(path, exist_ok=True)
+        results = []
+        for size in sizes:
+            results += run_size(path, size, options.runs, options.slow_runs)
+
+    report = {"meta": metadata(), "results": results}
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            compare(results, json.load(file)["results"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
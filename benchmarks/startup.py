@@ -0,0 +1,75 @@
+"""Measure cold start of pyjj commands and fail when they exceed the budget
+
+Usage: python benchmarks/startup.py [--runs N] [--budget MS]
+
+Every command runs in a fresh interpreter against a temporary PYJJ_HOME. The
+budget applies to the median time on top of a bare interpreter start.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Median milliseconds a command may add on top of `python -c pass`
+BUDGET_MS = 120
+
+COMMANDS = [
+    ["--help"],
+    ["use", "default"],
+    ["tags"],
+    ["list", "--limit", "1"],
+    ["eureka"],
+]
+
+
+def run(args: list, env: dict, runs: int) -> float:
+    """Returns a median wall time of a command in milliseconds"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=BUDGET_MS)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        env = {**os.environ, "PYJJ_HOME": home, "PYTHONPATH": ROOT}
+        pyjj = [sys.executable, "-c", "from pyjj import pyjj; pyjj()"]
+        subprocess.run(
+            pyjj + ["add", "example.com"],
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+        baseline = run([sys.executable, "-c", "pass"], env, options.runs)
+        results = []
+        for command in COMMANDS:
+            elapsed = run(pyjj + command, env, options.runs) - baseline
+            results.append(
+                {
+                    "command": " ".join(command),
+                    "median_ms": round(elapsed, 2),
+                    "budget_ms": options.budget,
+                    "ok": elapsed <= options.budget,
+                }
+            )
+
+    print(json.dumps({"baseline_ms": round(baseline, 2), "results": results}, indent=2))
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
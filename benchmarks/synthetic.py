@@ -0,0 +1,66 @@
+"""Generate synthetic divisions for benchmarks
+
+Urls get 1 to 4 tags drawn from a Zipfian distribution, so a few tags are on
+most urls and the long tail is rare, as in real bookmark collections. The same
+seed always generates the same division.
+"""
+import os
+import random
+import sys
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyjj.database import Database  # noqa: E402
+
+WORDS = (
+    "python rust sqlite perf docs blog news video paper guide api design data web "
+    "cli linux math ml db security cloud async testing career music travel food"
+).split()
+
+
+def tag_names(count: int) -> list:
+    """Returns distinct tag names, ordered from the most to the least frequent"""
+    return [
+        WORDS[i % len(WORDS)] + (str(i // len(WORDS)) if i >= len(WORDS) else "")
+        for i in range(count)
+    ]
+
+
+def entries(size: int, tags: int = 1000, exponent: float = 1.1, seed: int = 0):
+    """Yields bookmark entries accepted by `Database.bulk_add_urls`
+
+    :param int size: a number of urls
+    :param int tags: a number of distinct tags
+    :param float exponent: an exponent of the Zipfian tag distribution
+    :param int seed: a random seed
+    """
+    rng = random.Random(seed)
+    names = tag_names(tags)
+    weights = list(accumulate(1 / rank ** exponent for rank in range(1, tags + 1)))
+    hosts = [f"{rng.choice(WORDS)}{i}.example.com" for i in range(max(size // 20, 1))]
+    for i in range(size):
+        url_tags = rng.choices(names, cum_weights=weights, k=rng.randint(1, 4))
+        yield {
+            "url": f"https://{rng.choice(hosts)}/{rng.choice(WORDS)}/{i}",
+            "tags": url_tags,
+            "created_at": f"20{10 + i * 10 // size}-01-01 00:00:00",
+        }
+
+
+def generate(path: str, division: str, size: int, **kwargs) -> Database:
+    """Creates a synthetic division under the path unless it already exists
+
+    :param str path: a directory of database files
+    :param str division: a division name
+    :param int size: a number of urls
+    :return: a database of the division
+    """
+    is_exist = os.path.exists(os.path.join(path, f"{division}_pyjj.db"))
+    db = Database(division=division, path=path)
+    db.setup()
+    if not is_exist:
+        status, report = db.bulk_add_urls(entries(size, **kwargs))
+        if not status:
+            raise RuntimeError(report)
+    return db
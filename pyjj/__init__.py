@@ -1,25 +1,46 @@
+import os
+import sys
+from functools import partial
+
 import click
 
 from .config import PyjjConfig
-from .database import Database as Db
-from .messages import msg, header, content, division
-from .utils import validate_url
+from .messages import msg, header, content, division, set_color
+from .utils import parse_ids, validate_url
 
 
 pass_config = click.make_pass_decorator(PyjjConfig, ensure=True)
 
 
 @click.group(help="A CLI tool for bookmark management")
+@click.option(
+    "--profile", is_flag=True, help="Show time spent on SQL statements on stderr"
+)
+@click.option(
+    "--cprofile",
+    type=click.Path(dir_okay=False),
+    help="Save cProfile stats of the command to a file",
+)
 @pass_config
-def pyjj(config):
-    """A CLI tool for bookmark management
+def pyjj(config, profile: bool, cprofile: str):
+    """A CLI tool for bookmark management. Modules and the database that only
+    some commands need are loaded by those commands to keep startup fast.
 
     :param object config: an object with the current context
+    :param bool profile: whether to summarize statements of the command
+    :param str cprofile: a path of a file to save cProfile stats to
     """
     config.parse()
-    config.db = Db(division=config.division)
-    config.db.setup()
-    click.echo(division(config.division))
+    # Output piped into other tools is left plain, and the banner kept out of it
+    is_tty = sys.stdout.isatty()
+    set_color(is_tty)
+    click.echo(division(config.division), err=not is_tty)
+    # Profiling is set up only when asked, so it costs nothing otherwise
+    trace = os.environ.get("PYJJ_TRACE")
+    if profile or cprofile or trace:
+        from .profiler import profile_command
+
+        profile_command(click.get_current_context(), config, profile, trace, cprofile)
 
 
 @pyjj.command(help="Switch to a different table")
@@ -35,35 +56,296 @@ def use(config, division=str):
     click.echo(f"Switched to {division}")
 
 
+def url_header(title: str, divisions: bool = False) -> str:
+    """Returns a header of url lines
+
+    :param str title: a title of the header
+    :param bool divisions: whether lines start with divisions
+    """
+    columns = f"{'ID':^7} {'URL':60} {'TAGS':20} DATE"
+    return header(title, f"{'DIVISION':15} {columns}" if divisions else columns)
+
+
+def url_line(url: tuple, tags: list, division: str = None) -> str:
+    """Returns a formatted line of a url, followed by its title if it is fetched
+
+    :param tuple url: a url row with an id, a url, a created date and a title
+    :param list tags: tags of the url
+    :param str division: a division of the url, shown first if it is given
+    """
+    line = f"{url[0]:^7} {url[1]:60} {','.join(tags):20} {url[2]}"
+    indent = 8
+    if division is not None:
+        line, indent = f"{division:15} {line}", indent + 16
+    line = content(line)
+    return f"{line}\n{'':{indent}}{url[3]}" if url[3] else line
+
+
+def url_lines(
+    urls, limit: int = None, title: str = "Bookmarks", divisions: bool = False
+):
+    """Yields formatted lines of urls, followed by a hint for the next page
+
+    :param urls: an iterator of tuples with a url row and a list of tags,
+        preceded by a division if `divisions` is given
+    :param int limit: a page size; a hint is shown when the page is full
+    :param str title: a title of the header
+    :param bool divisions: whether urls come from many divisions
+    """
+    yield url_header(title, divisions) + "\n"
+    count, last_id = 0, None
+    for item in urls:
+        division, (url, tags) = (item[0], item[1:]) if divisions else (None, item)
+        count, last_id = count + 1, url[0]
+        yield url_line(url, tags, division) + "\n"
+    if limit and count == limit and not divisions:
+        yield msg(True, f"Next page: --after {last_id}") + "\n"
+
+
+def format_option(func):
+    """Add an option `-f` of the output format, where formats but `table` are for
+    other tools to read"""
+    return click.option(
+        "--format",
+        "-f",
+        "fmt",
+        type=click.Choice(["table", "json", "jsonl", "tsv"]),
+        default="table",
+        help="Output format",
+    )(func)
+
+
+def output_lines(
+    urls, fmt: str, limit: int = None, title: str = "Bookmarks", divisions=False
+):
+    """Returns lines of urls in the output format
+
+    :param urls: an iterator of tuples with a url row and a list of tags,
+        preceded by a division if `divisions` is given
+    :param str fmt: an output format
+    :param int limit: a page size of the table
+    :param str title: a title of the table
+    :param bool divisions: whether urls come from many divisions
+    :return: an iterator of lines
+    """
+    if fmt == "table":
+        return url_lines(urls, limit, title, divisions)
+    from .output import format_urls
+
+    return format_urls(urls, fmt, divisions)
+
+
+def echo_lines(lines) -> None:
+    """Write lines to stdout through its buffer, flushed once at the end
+
+    :param lines: an iterable of lines ending with newlines
+    """
+    from .output import write_lines
+
+    write_lines(sys.stdout, lines)
+
+
+def all_divisions_option(func):
+    """Add an option `-D` to run a command over every division"""
+    return click.option(
+        "--all-divisions",
+        "-D",
+        is_flag=True,
+        help="Include bookmarks of every division",
+    )(func)
+
+
+def filter_tags(filters: dict) -> list:
+    """Returns tags of a tag expression in the options of a command
+
+    :param dict filters: options with `tags`, `any_tags` and `not_tags`
+    :return: a list of tag names
+    """
+    keys = ("tags", "any_tags", "not_tags")
+    return [tag for key in keys for tag in filters.get(key) or ()]
+
+
+def tag_options(func):
+    """Add options of a tag expression: `-t` for all of the tags, `--any` for any
+    of the tags and `--not` for none of the tags; each can be given many times
+    """
+    for option in (
+        click.option("--not", "not_tags", multiple=True, help="Exclude this tag"),
+        click.option("--any", "any_tags", multiple=True, help="Any of these tags"),
+        click.option("--tag", "-t", "tags", multiple=True, help="All of these tags"),
+    ):
+        func = option(func)
+    return func
+
+
+def warn_missing_tags(db, names) -> None:
+    """Show close matches of given tags which don't exist on stderr, as a tag
+    with a typo silently selects nothing
+
+    :param db: a database of the division
+    :param names: tag names given to a command
+    """
+    for name in dict.fromkeys(names):
+        if db.check_tag(name)[0]:
+            continue
+        status, close = db.suggest_tags(name)
+        hint = f" Did you mean: {', '.join(close)}?" if status and close else ""
+        message = f"Given tag does not exist! tag: {name}.{hint}"
+        click.echo(msg(False, message), err=True)
+
+
+@pyjj.command(help="Serve bookmarks to other commands over a local socket")
+@pass_config
+def serve(config):
+    """Run a daemon keeping databases open, which other commands use instead of
+    connecting to databases themselves while it is running
+
+    :param object config: an object with the current context
+    """
+    from .remote import socket_path
+    from .server import serve as run
+
+    path = socket_path()
+    click.echo(msg(True, f"Serving on {path}; press Ctrl+C to stop"))
+    try:
+        run(path, settings=config.connection, tracking_params=config.tracking_params)
+    except Exception as e:
+        click.echo(msg(False, str(e)))
+
+
 @pyjj.command(help="Show a list of bookmarks")
-@click.option("--tag", "-t")
+@tag_options
+@click.option("--limit", "-l", type=int, help="Maximum number of bookmarks")
+@click.option("--after", "-a", type=int, help="Show bookmarks after the given id")
+@click.option("--before", "-b", type=int, help="Show bookmarks before the given id")
+@click.option("--pager", "-p", is_flag=True, help="Show bookmarks through a pager")
+@click.option(
+    "--health",
+    type=click.Choice(["ok", "dead", "unchecked"]),
+    help="Filter bookmarks by their latest check",
+)
+@all_divisions_option
+@format_option
 @pass_config
-def list(config, tag: str):
+def list(
+    config,
+    limit: int,
+    after: int,
+    before: int,
+    pager: bool,
+    all_divisions: bool,
+    fmt: str,
+    **filters,
+):
     """Show a list of bookmarks
 
     :param object config: an object with the current context
-    :param str tag: a tag of urls
+    :param int limit: a maximum number of urls to show
+    :param int after: an id of url; only urls after the id are shown
+    :param int before: an id of url; only urls before the id are shown
+    :param bool pager: whether to show urls through a pager
+    :param bool all_divisions: whether to show urls of every division, ordered by
+        their dates
+    :param str fmt: an output format
+    :param filters: a tag expression of `tags`, `any_tags` and `not_tags`, and
+        `health` of urls
     """
-    status, urls = config.db.list_urls(tag=tag)
-    if not status:
-        click.echo(msg(status, urls))
+    if all_divisions:
+        if after is not None or before is not None:
+            click.echo(msg(False, "Ids only page a single division"))
+            return
+        from .database import list_divisions
+        from .divisions import iter_all_urls
+
+        urls = iter_all_urls(list_divisions(), config.open_db, limit, **filters)
     else:
-        click.echo(header("Bookmarks", f"{'ID':^7} {'URL':60} {'TAGS':20} DATE"))
-        for url, tags in urls:
-            click.echo(content(f"{url[0]:^7} {url[1]:60} {','.join(tags):20} {url[2]}"))
+        warn_missing_tags(config.db, filter_tags(filters))
+        urls = config.db.iter_urls(limit=limit, after=after, before=before, **filters)
+    lines = output_lines(urls, fmt, limit, divisions=all_divisions)
+    try:
+        if pager:
+            click.echo_via_pager(lines)
+        else:
+            echo_lines(lines)
+    except Exception as e:
+        click.echo(msg(False, str(e)))
+    finally:
+        lines.close()
+
+
+@pyjj.command(help="Search bookmarks by url and tags")
+@click.argument("query", nargs=-1, required=True)
+@click.option("--limit", "-l", type=int, default=20, help="Maximum number of results")
+@all_divisions_option
+@format_option
+@pass_config
+def search(config, query: tuple, limit: int, all_divisions: bool, fmt: str):
+    """Search bookmarks by terms in urls and tags, ranked by relevance
+
+    :param object config: an object with the current context
+    :param tuple query: search terms
+    :param int limit: a maximum number of urls to show
+    :param bool all_divisions: whether to search every division
+    :param str fmt: an output format
+    """
+    if all_divisions:
+        from .database import list_divisions
+        from .divisions import search_all_urls
+
+        urls = search_all_urls(list_divisions(), config.open_db, " ".join(query), limit)
+    else:
+        urls = config.db.search_urls(" ".join(query), limit=limit)
+    try:
+        echo_lines(output_lines(urls, fmt, divisions=all_divisions))
+    except Exception as e:
+        click.echo(msg(False, str(e)))
+
+
+@pyjj.command(help="Find bookmarks by parts of their hosts and paths")
+@click.argument("query", nargs=-1, required=True)
+@click.option("--fuzzy", "-z", is_flag=True, help="Rank close matches despite typos")
+@click.option("--limit", "-l", type=int, default=20, help="Maximum number of results")
+@format_option
+@pass_config
+def find(config, query: tuple, fuzzy: bool, limit: int, fmt: str):
+    """Find bookmarks whose hosts and paths contain every given word, newest
+    first. With `--fuzzy`, bookmarks are ranked by how close they are to the
+    words, for urls only half-remembered.
+
+    :param object config: an object with the current context
+    :param tuple query: words of at least 3 characters
+    :param bool fuzzy: whether to rank close matches
+    :param int limit: a maximum number of urls to show
+    :param str fmt: an output format
+    """
+    urls = config.db.find_urls(" ".join(query), limit=limit, fuzzy=fuzzy)
+    try:
+        echo_lines(output_lines(urls, fmt))
+    except Exception as e:
+        click.echo(msg(False, str(e)))
+
+
+@pyjj.command(help="Rebuild the search index")
+@pass_config
+def reindex(config):
+    """Rebuild the search index of the current division
 
-    # TODO: Pagination
+    :param object config: an object with the current context
+    """
+    click.echo(msg(*config.db.rebuild_search_index()))
 
 
 @pyjj.command(help="Add a new bookmark")
 @click.argument("url")
 @click.option("--tags", "-t")
+@click.option("--fetch", "-F", is_flag=True, help="Fetch a title of the page")
 @pass_config
-def add(config, tags: str, url: str):
+def add(config, tags: str, url: str, fetch: bool):
     """Add a new bookmark
 
     :param object config: an object with the current context
     :param str url: an url to add to the database
+    :param bool fetch: whether to fetch a title and a description of the page
     """
     try:
         _url = validate_url(url)
@@ -72,8 +354,286 @@ def add(config, tags: str, url: str):
         else:
             result = config.db.add_url(_url)
         click.echo(msg(*result))
+        if result[0] and fetch:
+            from .enricher import fetch_all
+
+            pages = fetch_all(list(config.db.iter_urls_to_enrich(urls=[_url])), 10.0)
+            config.db.save_metadata(pages)
+            click.echo(content(pages[0][2] or "No title found"))
+    except Exception as e:
+        click.echo(msg(False, str(e)))
+
+
+@pyjj.command(help="Fetch titles and descriptions of bookmarks")
+@tag_options
+@click.option("--concurrency", "-c", type=int, default=8, help="Hosts at once")
+@click.option("--timeout", type=float, default=10.0, help="Seconds to wait")
+@click.option("--max-age", type=float, default=30, help="Days a fetch stays fresh")
+@click.option("--all", "-A", "refetch", is_flag=True, help="Refetch fresh bookmarks")
+@pass_config
+def enrich(
+    config, concurrency: int, timeout: float, max_age: float, refetch: bool, **filters
+):
+    """Fetch titles and descriptions of bookmarks, which are shown by `list` and
+    searched by `search`. Pages fetched before are requested conditionally.
+
+    :param object config: an object with the current context
+    :param int concurrency: a maximum number of hosts fetched at once
+    :param float timeout: seconds to wait for a response
+    :param float max_age: days fetched metadata stays fresh
+    :param bool refetch: whether to fetch fresh bookmarks as well
+    :param filters: a tag expression of `tags`, `any_tags` and `not_tags`
+    """
+    from .enricher import enrich_urls
+
+    titles = 0
+
+    def save(pages):
+        nonlocal titles
+        status, message = config.db.save_metadata(pages)
+        if not status:
+            raise RuntimeError(message)
+        titles += sum(1 for page in pages if page[2])
+
+    rows = config.db.iter_urls_to_enrich(None if refetch else max_age, **filters)
+    try:
+        count = enrich_urls(rows, save, concurrency, timeout)
+    except Exception as e:
+        click.echo(msg(False, str(e)))
+        return
+    click.echo(msg(True, f"Fetched successfully! urls: {count}, titles: {titles}"))
+
+
+@pyjj.command(name="import", help="Import bookmarks from a file")
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "-f", "fmt", type=click.Choice(["html", "csv", "jsonl"]))
+@pass_config
+def import_bookmarks(config, file: str, fmt: str):
+    """Import bookmarks from a Netscape HTML, CSV or JSONL file, which may be
+    gzipped. Duplicate and invalid urls are reported and skipped.
+
+    :param object config: an object with the current context
+    :param str file: a path of the bookmark file
+    :param str fmt: a format of the file; guessed from the extension if not given
+    """
+    from .formats import guess_format, open_text, read_bookmarks
+
+    try:
+        with open_text(file) as f:
+            status, report = config.db.bulk_add_urls(
+                read_bookmarks(f, fmt or guess_format(file))
+            )
+    except Exception as e:
+        status, report = False, str(e)
+    if not status:
+        click.echo(msg(status, report))
+        return
+
+    click.echo(msg(True, f"Imported successfully! urls: {report['added']}"))
+    for title, urls in (
+        ("Duplicates", report["duplicates"]),
+        ("Invalid", [url for url, _ in report["invalid"]]),
+    ):
+        if urls:
+            click.echo(header(f"{title}: {len(urls)}", "URL"))
+            for url in urls[:20]:
+                click.echo(content(url))
+            if len(urls) > 20:
+                click.echo(content(f"... and {len(urls) - 20} more"))
+
+
+@pyjj.command(help="Export bookmarks to a file")
+@click.argument("file", type=click.Path(dir_okay=False, allow_dash=True))
+@click.option("--format", "-f", "fmt", type=click.Choice(["html", "csv", "jsonl"]))
+@click.option("--tag", "-t")
+@click.option("--gzip", "-z", "compress", is_flag=True, help="Compress with gzip")
+@pass_config
+def export(config, file: str, fmt: str, tag: str, compress: bool):
+    """Export bookmarks to a Netscape HTML, CSV or JSONL file. Urls are written
+    as they are fetched, so memory stays flat regardless of the division size.
+
+    :param object config: an object with the current context
+    :param str file: a path of the bookmark file; `-` for stdout
+    :param str fmt: a format of the file; guessed from the extension if not given
+    :param str tag: a tag of urls to export
+    :param bool compress: whether to compress the file with gzip
+    """
+    from .formats import guess_format, open_text, write_bookmarks
+
+    try:
+        if compress and file != "-" and not file.endswith(".gz"):
+            file = f"{file}.gz"
+        fmt = fmt or ("jsonl" if file == "-" else guess_format(file))
+        urls, skipped = config.db.iter_urls(tag=tag), []
+        if file == "-":
+            write_bookmarks(sys.stdout, urls, fmt, skipped)
+        else:
+            with open_text(file, "w") as f:
+                count = write_bookmarks(f, urls, fmt, skipped)
+            message = f"Exported successfully! urls: {count}, file: {file}"
+            click.echo(msg(True, message))
+    except Exception as e:
+        click.echo(msg(False, str(e)))
+        return
+    for url, tag in skipped:
+        message = f"Tag with a comma can't be written to {fmt}! url: {url}, tag: {tag}"
+        click.echo(msg(False, message), err=True)
+
+
+@pyjj.group(help="Sync bookmarks with other machines through change files")
+def sync():
+    """Move changes of a division between machines as delta files, which hold
+    only what changed since the last sync"""
+
+
+@sync.command(name="export", help="Export changes since a sequence number")
+@click.argument("file", type=click.Path(dir_okay=False, allow_dash=True), default="-")
+@click.option("--since", "-s", type=int, default=0, help="Seq of the last export")
+@pass_config
+def export_changes(config, file: str, since: int):
+    """Export urls and tags changed since a sequence number to a delta file, which
+    may be gzipped. The sequence number to export from next time is shown.
+
+    :param object config: an object with the current context
+    :param str file: a path of the delta file; `-` for stdout
+    :param int since: a sequence number shown by the last export; 0 for all
+    """
+    from .formats import open_text
+    from .sync import write_delta
+
+    try:
+        seq = config.db.last_change()
+        changes = config.db.iter_changes(since, seq)
+        if file == "-":
+            count = write_delta(sys.stdout, config.division, since, seq, changes)
+        else:
+            with open_text(file, "w") as f:
+                count = write_delta(f, config.division, since, seq, changes)
+        message = f"Exported successfully! changes: {count}, next: --since {seq}"
+        click.echo(msg(True, message), err=file == "-")
+    except Exception as e:
+        click.echo(msg(False, str(e)), err=file == "-")
+
+
+@sync.command(name="apply", help="Apply changes exported by another machine")
+@click.argument("file", type=click.Path(dir_okay=False, allow_dash=True))
+@pass_config
+def apply_changes(config, file: str):
+    """Apply a delta file to the current division. Applying the same changes
+    again changes nothing, so deltas may overlap.
+
+    :param object config: an object with the current context
+    :param str file: a path of the delta file; `-` for stdin
+    """
+    from contextlib import nullcontext
+
+    from .formats import open_text
+    from .sync import read_delta
+
+    try:
+        with nullcontext(sys.stdin) if file == "-" else open_text(file) as f:
+            header, changes = read_delta(f)
+            status, report = config.db.apply_changes(changes)
+    except Exception as e:
+        status, report = False, str(e)
+    if not status:
+        click.echo(msg(status, report))
+        return
+    counts = ", ".join(f"{key}: {count}" for key, count in report.items())
+    source = f"{header['division']} up to {header['seq']}"
+    click.echo(msg(True, f"Applied changes of {source}! {counts}"))
+
+
+@pyjj.command(help="Check bookmarks for dead links")
+@tag_options
+@click.option("--concurrency", "-c", type=int, default=20, help="Requests at once")
+@click.option("--interval", "-i", type=float, default=1.0, help="Seconds per host")
+@click.option("--timeout", type=float, default=10.0, help="Seconds to wait")
+@click.option("--max-age", type=float, default=7, help="Days a check stays fresh")
+@click.option("--all", "-A", "recheck", is_flag=True, help="Recheck fresh bookmarks")
+@pass_config
+def check(
+    config,
+    concurrency: int,
+    interval: float,
+    timeout: float,
+    max_age: float,
+    recheck: bool,
+    **filters,
+):
+    """Check bookmarks for dead links concurrently and save the results, which
+    `list --health` filters by. Bookmarks checked within `max_age` are skipped.
+
+    :param object config: an object with the current context
+    :param int concurrency: a maximum number of requests in flight
+    :param float interval: minimum seconds between requests to the same host
+    :param float timeout: seconds to wait for a response
+    :param float max_age: days a check stays fresh
+    :param bool recheck: whether to check fresh bookmarks as well
+    :param filters: a tag expression of `tags`, `any_tags` and `not_tags`
+    """
+    import asyncio
+
+    from .checker import check_urls, is_healthy
+
+    dead = []
+
+    def save(results):
+        status, message = config.db.save_checks(results)
+        if not status:
+            raise RuntimeError(message)
+        dead.extend(result for result in results if not is_healthy(result[1]))
+
+    urls = config.db.iter_urls_to_check(None if recheck else max_age, **filters)
+    try:
+        count = asyncio.run(check_urls(urls, save, concurrency, interval, timeout))
     except Exception as e:
         click.echo(msg(False, str(e)))
+        return
+
+    click.echo(msg(True, f"Checked successfully! urls: {count}, dead: {len(dead)}"))
+    if dead:
+        click.echo(header(f"Dead: {len(dead)}", f"{'ID':^7} {'STATUS':^7} URL"))
+        for url_id, status, url, error, _ in dead[:20]:
+            click.echo(content(f"{url_id:^7} {status or '-':^7} {url} ({error})"))
+        if len(dead) > 20:
+            click.echo(content(f"... and {len(dead) - 20} more"))
+
+
+@pyjj.command(help="Merge duplicate bookmarks")
+@click.option("--dry-run", "-n", is_flag=True, help="Only show duplicates")
+@click.option("--rehash", is_flag=True, help="Rehash urls after config changes")
+@pass_config
+def dedupe(config, dry_run: bool, rehash: bool):
+    """Merge bookmarks of the same canonical url into the oldest one, keeping
+    tags of all of them
+
+    :param object config: an object with the current context
+    :param bool dry_run: whether to only show duplicates
+    :param bool rehash: whether to rehash urls, as `tracking_params` changed
+    """
+    if rehash:
+        click.echo(msg(*config.db.rehash_urls()))
+    status, groups = config.db.find_duplicates()
+    if not status or not groups:
+        click.echo(msg(status, groups or "No duplicate bookmarks"))
+        return
+
+    count = sum(len(duplicates) for _, duplicates in groups)
+    click.echo(header(f"Duplicates: {count}", f"{'ID':^7} URL"))
+    for (id, url), duplicates in groups[:20]:
+        click.echo(content(f"{id:^7} {url}"))
+        for duplicate_id, duplicate_url in duplicates:
+            click.echo(content(f"{duplicate_id:^7}   = {duplicate_url}"))
+    if len(groups) > 20:
+        click.echo(content(f"... and {len(groups) - 20} more"))
+
+    if dry_run:
+        return
+    if click.confirm(f"Wish to merge {count} duplicates into {len(groups)} ?"):
+        click.echo(msg(*config.db.merge_duplicates()))
+    else:
+        click.echo(msg(False, "aborted."))
 
 
 @pyjj.command(help="Edit a bookmark")
@@ -97,60 +657,257 @@ def edit(config, id: int, url: str):
         click.echo(msg(False, str(e)))
 
 
-@pyjj.command(help="Remove a bookmark")
-@click.argument("id")
-@click.option("--tag", "-t")
+def selection_options(func):
+    """Add options selecting bookmarks of a bulk operation, along with ids: a tag
+    expression, a window of created dates, `--dry-run` and `--yes`"""
+    dates = click.DateTime(["%Y-%m-%d", "%Y-%m-%d %H:%M:%S"])
+    for option in (
+        click.option("--yes", "-y", is_flag=True, help="Skip the confirmation"),
+        click.option("--dry-run", "-n", is_flag=True, help="Only count bookmarks"),
+        click.option("--until", type=dates, help="Created before this date"),
+        click.option("--since", type=dates, help="Created at or after this date"),
+        click.option("--not", "not_tags", multiple=True, help="Exclude this tag"),
+        click.option("--any", "any_tags", multiple=True, help="Any of these tags"),
+        click.option("--tagged", "tags", multiple=True, help="All of these tags"),
+    ):
+        func = option(func)
+    return func
+
+
+def run_bulk(
+    operation, description: str, done: str, dry_run: bool, yes: bool, **selection
+) -> str:
+    """Run a bulk operation of the database after a single confirmation with the
+    number of rows it changes, counted by a dry run of the operation
+
+    :param operation: a method of the database taking `dry_run` and a selection
+    :param str description: a description of the operation with a `{}` for the
+        number of rows
+    :param str done: a message of the result with a `{}` for the number of rows
+    :param bool dry_run: whether to stop after counting
+    :param bool yes: whether to skip the confirmation
+    :param selection: ids, a tag expression and dates of bookmarks
+    :return: a message of the result
+    """
+    for key in ("since", "until"):
+        if selection.get(key):
+            selection[key] = selection[key].strftime("%Y-%m-%d %H:%M:%S")
+    status, count = operation(dry_run=True, **selection)
+    if not status or not count:
+        return msg(False, count or "No bookmark to change")
+    if dry_run:
+        return msg(True, f"Dry run: would {description.format(count)}")
+    if not yes and not click.confirm(f"Wish to {description.format(count)} ?"):
+        return msg(False, "aborted.")
+    status, count = operation(**selection)
+    return msg(status, done.format(count) if status else count)
+
+
+def select(ids: tuple, selection: dict) -> dict:
+    """Adds ids and ranges to a selection of a bulk operation
+
+    :param tuple ids: arguments such as `3`, `1-10` or `1,4-6`
+    :param dict selection: a tag expression and dates of bookmarks
+    :exception: click.UsageError when ids are not valid or nothing is selected,
+        which would mean all bookmarks
+    """
+    try:
+        selection["ids"], selection["ranges"] = parse_ids(ids)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="IDS")
+    if not any(selection.values()):
+        raise click.UsageError("Give ids, tags or dates of bookmarks")
+    return selection
+
+
+@pyjj.command(help="Remove bookmarks")
+@click.argument("ids", nargs=-1)
+@click.option("--tag", "-t", help="Remove only this tag from the bookmarks")
+@selection_options
 @pass_config
-def remove(config, id, tag):
-    """Remove a bookmark. When given option `-t`, only the tag
-    associated with the url gets removed.
+def remove(config, ids: tuple, tag: str, dry_run: bool, yes: bool, **selection):
+    """Remove bookmarks selected by ids and ranges such as `1-10`, a tag
+    expression or created dates, at once. When given option `-t`, only the tag
+    associated with the urls gets removed.
 
     :param object config: an object with the current context
-    :param int id: an id of url to delete
-    :param str tag: a tag of url to delete
+    :param tuple ids: ids and ranges of urls to delete
+    :param str tag: a tag of urls to delete
+    :param bool dry_run: whether to only count urls
+    :param bool yes: whether to skip the confirmation
+    :param selection: a tag expression and dates of urls
     """
-    result = config.db.get_url(id)
-    if result[0]:  # Remove url as id exists
-        if tag:
-            result = config.db.remove_url_tag(id, tag)
-        else:
-            is_confirmed = click.confirm(f"Wish to delete {result[1]} ?")
-            if is_confirmed:
-                result = config.db.remove_url(id)
-            else:
-                result = (False, "aborted.")
-    click.echo(msg(*result))
+    selection = select(ids, selection)
+    warn_missing_tags(config.db, ([tag] if tag else []) + filter_tags(selection))
+    if tag:
+        operation = partial(config.db.untag_urls, [tag])
+        description = f"remove {tag} from {{}} bookmarks"
+        done = "Removed successfully! tags: {}"
+    else:
+        operation, description = config.db.remove_urls, "delete {} bookmarks"
+        done = "Removed successfully! urls: {}"
+    click.echo(run_bulk(operation, description, done, dry_run, yes, **selection))
+
+
+@pyjj.group(help="Add, rename and merge tags of many bookmarks")
+def tag():
+    """Bulk operations on tags"""
+
+
+@tag.command(name="add", help="Tag bookmarks")
+@click.argument("names")
+@click.argument("ids", nargs=-1)
+@selection_options
+@pass_config
+def add_tag(config, names: str, ids: tuple, dry_run: bool, yes: bool, **selection):
+    """Attach tags to bookmarks selected by ids and ranges, a tag expression or
+    created dates, at once
+
+    :param object config: an object with the current context
+    :param str names: comma-separated tags to attach
+    :param tuple ids: ids and ranges of urls
+    :param bool dry_run: whether to only count urls
+    :param bool yes: whether to skip the confirmation
+    :param selection: a tag expression and dates of urls
+    """
+    selection = select(ids, selection)
+    warn_missing_tags(config.db, filter_tags(selection))
+    names = [name.strip() for name in names.split(",") if name.strip()]
+    operation = partial(config.db.tag_urls, names)
+    description = f"add {{}} tags of {','.join(names)} to bookmarks"
+    done = "Added successfully! tags: {}"
+    click.echo(run_bulk(operation, description, done, dry_run, yes, **selection))
+
+
+@tag.command(help="Rename a tag, merging it if the new name exists")
+@click.argument("old")
+@click.argument("new")
+@click.option("--dry-run", "-n", is_flag=True, help="Only count bookmarks")
+@click.option("--yes", "-y", is_flag=True, help="Skip the confirmation")
+@pass_config
+def rename(config, old: str, new: str, dry_run: bool, yes: bool):
+    """Rename a tag of every bookmark
+
+    :param object config: an object with the current context
+    :param str old: a tag to rename
+    :param str new: a new name of the tag
+    :param bool dry_run: whether to only count urls
+    :param bool yes: whether to skip the confirmation
+    """
+    warn_missing_tags(config.db, [old])
+    operation = partial(config.db.merge_tags, [old], new)
+    description = f"rename {old} to {new} on {{}} bookmarks"
+    done = "Renamed successfully! urls: {}"
+    click.echo(run_bulk(operation, description, done, dry_run, yes))
+
+
+@tag.command(help="Merge tags into the last one")
+@click.argument("tags", nargs=-1, required=True)
+@click.option("--dry-run", "-n", is_flag=True, help="Only count bookmarks")
+@click.option("--yes", "-y", is_flag=True, help="Skip the confirmation")
+@pass_config
+def merge(config, tags: tuple, dry_run: bool, yes: bool):
+    """Merge tags into the last given one on every bookmark
+
+    :param object config: an object with the current context
+    :param tuple tags: tags to merge, followed by a tag to merge into
+    :param bool dry_run: whether to only count urls
+    :param bool yes: whether to skip the confirmation
+    """
+    if len(tags) < 2:
+        raise click.UsageError("Give tags to merge and a tag to merge into")
+    *sources, target = tags
+    warn_missing_tags(config.db, sources)
+    operation = partial(config.db.merge_tags, sources, target)
+    description = f"merge {','.join(sources)} into {target} on {{}} bookmarks"
+    done = "Merged successfully! urls: {}"
+    click.echo(run_bulk(operation, description, done, dry_run, yes))
 
 
 @pyjj.command(help="Get a random bookmark")
-@click.option("--tag", "-t")
+@tag_options
+@click.option("--n", "-n", "k", type=int, default=1, help="Number of bookmarks")
+@all_divisions_option
+@format_option
 @pass_config
-def eureka(config, tag=None):
+def eureka(config, k=1, all_divisions=False, fmt="table", **filters):
     """Get a random bookmark. When given option `-t`, returns
     a randome bookmark with the given tag.
 
     :param object config: an object with the current context
-    :param str tag: a tag of a random url
+    :param int k: a number of distinct random urls
+    :param bool all_divisions: whether to pick out of every division
+    :param str fmt: an output format
+    :param filters: a tag expression of `tags`, `any_tags` and `not_tags`
     """
-    _, url_tags = config.db.get_random_url(tag)
-    url, tags = url_tags
+    if all_divisions:
+        from .database import list_divisions
+        from .divisions import sample_all_urls
+
+        try:
+            status, urls = True, sample_all_urls(
+                list_divisions(), config.open_db, k, **filters
+            )
+        except Exception as e:
+            status, urls = False, str(e)
+    else:
+        status, urls = config.db.sample_urls(k, **filters)
+        if status and not urls:
+            warn_missing_tags(config.db, filter_tags(filters))
+    if not status or not urls:
+        click.echo(msg(False, urls or "No bookmark to pick from"))
+        return
+
+    echo_lines(output_lines(urls, fmt, title="Eureka!", divisions=all_divisions))
 
-    click.echo(header("Eureka!", f"{'ID':^7} {'URL':60} {'TAGS':20} DATE"))
-    click.echo(content(f"{url[0]:^7} {url[1]:60} {','.join(tags):20} {url[2]}"))
+
+def tag_lines(tags):
+    """Yields formatted lines of tags
+
+    :param tags: an iterable of tag rows with an id, a tag, a created date and a
+        number of urls
+    """
+    yield header("Tags", f"{'ID':^7} {'TAGS':20} {'COUNT':>7}  DATE") + "\n"
+    for tag in tags:
+        yield content(f"{tag[0]:^7} {tag[1]:20} {tag[3]:>7}  {tag[2]}") + "\n"
 
 
 @pyjj.command(help="Show a list of tags")
+@click.option(
+    "--sort",
+    "-s",
+    type=click.Choice(["name", "count", "recent"]),
+    default="name",
+    help="Sort tags by name, number of bookmarks or date",
+)
+@click.option("--min-count", "-m", type=int, default=0, help="Minimum bookmarks")
+@click.option("--prune", is_flag=True, help="Remove tags without bookmarks first")
+@format_option
 @pass_config
-def tags(config):
-    """Show a list of tags.
+def tags(config, sort: str, min_count: int, prune: bool, fmt: str):
+    """Show a list of tags with numbers of their bookmarks.
 
     :param object config: an object with the current context
+    :param str sort: a sort key of tags
+    :param int min_count: a minimum number of bookmarks of a tag
+    :param bool prune: whether to remove tags without bookmarks
+    :param str fmt: an output format
     """
-    status, tags = config.db.list_tags()
-    click.echo(header("Tags", f"{'ID':^7} {'TAGS':20} DATE"))
-    if status:
-        for index, tag in tags:
-            click.echo(content(f"{index:^7} {tag[0]:20} {tag[1]}"))
+    if prune:
+        status, message = config.db.prune_tags()
+        click.echo(msg(status, message), err=fmt != "table")
+        if not status:
+            return
+    status, tags = config.db.list_tags(sort=sort, min_count=min_count)
+    if not status:
+        click.echo(msg(status, tags))
+        return
+    if fmt == "table":
+        echo_lines(tag_lines(tags))
+    else:
+        from .output import format_tags
+
+        echo_lines(format_tags(tags, fmt))
 
 
 if __name__ == "__main__":
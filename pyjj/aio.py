@@ -0,0 +1,392 @@
+import asyncio
+import concurrent.futures
+import queue
+import sqlite3
+import threading
+from functools import partial
+from typing import AsyncIterator, Callable, Iterator, List, Tuple
+
+from .database import Database
+
+# Reader threads, each with a read-only connection
+READERS = 4
+# Requests of each kind queued or running at once; more wait for a free slot
+QUEUE_SIZE = 256
+# Writes committed together in one transaction
+BATCH_REQUESTS = 64
+# Rows of a stream handed to the event loop at once, and batches buffered ahead
+STREAM_BATCH = 256
+STREAM_BUFFER = 4
+
+# Database methods run on the writer thread
+WRITES = {
+    "add_tags",
+    "add_url",
+    "apply_changes",
+    "bulk_add_urls",
+    "edit_url",
+    "merge_duplicates",
+    "merge_tags",
+    "prune_tags",
+    "rebuild_search_index",
+    "rehash_urls",
+    "remove_url",
+    "remove_url_tag",
+    "remove_urls",
+    "save_checks",
+    "save_metadata",
+    "tag_urls",
+    "untag_urls",
+}
+
+# Database methods run on reader threads
+READS = {
+    "check_tag",
+    "count_urls",
+    "find_duplicates",
+    "get_random_url",
+    "get_url",
+    "last_change",
+    "list_tags",
+    "sample_urls",
+    "suggest_tags",
+}
+
+# Database methods returning iterators, which become async iterators
+STREAMED = {"find_urls", "iter_changes", "iter_urls", "search_urls"}
+
+_END = object()
+
+
+class BatchingConnection(sqlite3.Connection):
+    """A connection running many requests in one transaction. While `batching`,
+    commits are left to the batch and a rollback only undoes the request running.
+    """
+
+    batching = False
+
+    def commit(self):
+        if not self.batching:
+            super().commit()
+
+    def rollback(self):
+        if self.batching:
+            self.execute("ROLLBACK TO pyjj_request")
+        else:
+            super().rollback()
+
+
+class _Request:
+    """A call of a worker thread, resolving a future of the event loop"""
+
+    __slots__ = ("call", "loop", "future", "slots")
+
+    def __init__(self, call, loop, slots: asyncio.Semaphore):
+        self.call = call
+        self.loop = loop
+        self.future = loop.create_future()
+        self.slots = slots
+
+    def resolve(self, result):
+        try:
+            self.loop.call_soon_threadsafe(self._resolve, result)
+        except RuntimeError:  # the loop is closed, and nobody waits for it
+            pass
+
+    def _resolve(self, result):
+        self.slots.release()
+        if self.future.cancelled():
+            return
+        if isinstance(result, BaseException):
+            self.future.set_exception(result)
+        else:
+            self.future.set_result(result)
+
+
+class _Stream:
+    """Rows of an iterator run on a reader thread, handed over to the event loop
+    in batches. The thread waits while `STREAM_BUFFER` batches are not taken yet,
+    and stops once the consumer or the database closes.
+    """
+
+    def __init__(self, loop, closing: threading.Event):
+        self.loop = loop
+        self.batches = asyncio.Queue(STREAM_BUFFER)
+        self.stop = threading.Event()
+        self.closing = closing
+
+    def put(self, item) -> bool:
+        future = asyncio.run_coroutine_threadsafe(self.batches.put(item), self.loop)
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                if self.stop.is_set() or self.closing.is_set():
+                    future.cancel()
+                    return False
+
+    def produce(self, rows: Callable[[], Iterator]):
+        if self.stop.is_set():
+            return
+        batch = []
+        try:
+            for row in rows():
+                batch.append(row)
+                if len(batch) == STREAM_BATCH:
+                    if not self.put(batch):
+                        return
+                    batch = []
+        except Exception as e:
+            self.put(e)
+            return
+        if not batch or self.put(batch):
+            self.put(_END)
+
+    def done(self, future: asyncio.Future):
+        """Hands over an error of a request which didn't run the iterator"""
+        if not future.cancelled() and future.exception() is not None:
+            self.batches.put_nowait(future.exception())
+
+
+class AsyncDatabase:
+    """An asyncio interface of `Database`. Writes are queued to a single writer
+    thread, which commits the ones waiting together in one transaction, and reads
+    to a pool of threads with read-only connections. Each method of `WRITES` and
+    `READS` is a coroutine returning what the one of `Database` does, and each of
+    `STREAMED` an async iterator. Callers wait for a slot when `queue_size`
+    requests of a kind are already queued.
+    """
+
+    def __init__(
+        self,
+        division="default",
+        path: str = None,
+        settings: dict = None,
+        tracking_params: List[str] = None,
+        readers: int = READERS,
+        queue_size: int = QUEUE_SIZE,
+        batch_size: int = BATCH_REQUESTS,
+    ):
+        """Starts the threads; the database is set up by the writer before any
+        request runs
+
+        :param str division: a name of the sqlite database
+        :param str path: a directory for database files; see `Database`
+        :param dict settings: connection settings overriding `CONNECTION_SETTINGS`
+        :param list tracking_params: patterns of query parameters ignored when
+            urls are compared; see `Database`
+        :param int readers: a number of reader threads
+        :param int queue_size: a maximum number of writes, and of reads, queued
+        :param int batch_size: a maximum number of writes in a transaction
+        """
+        self.division = division
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        # Writes and transactions committed, for the batch size of a workload
+        self.writes = 0
+        self.batches = 0
+        self._options = {
+            "division": division,
+            "path": path,
+            "tracking_params": tracking_params,
+        }
+        self._settings = settings or {}
+        self._requests = {"write": queue.SimpleQueue(), "read": queue.SimpleQueue()}
+        # Semaphores of each kind, created in the loop using them
+        self._slots = {}
+        self._ready = threading.Event()
+        self._closing = threading.Event()
+        self._error = None
+        self._threads = [threading.Thread(target=self._write_loop, daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._read_loop, daemon=True)
+            for _ in range(readers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __getattr__(self, name):
+        if name in STREAMED:
+            return lambda *args, **kwargs: self._stream(name, args, kwargs)
+        if name in WRITES:
+            return lambda *args, **kwargs: self._call("write", name, args, kwargs)
+        if name in READS:
+            return lambda *args, **kwargs: self._call("read", name, args, kwargs)
+        raise AttributeError(f"'AsyncDatabase' object has no attribute '{name}'")
+
+    def list_urls(self, *args, **kwargs) -> AsyncIterator[tuple]:
+        """Yields urls with their tags; it takes arguments of `Database.iter_urls`
+        """
+        return self._stream("iter_urls", args, kwargs)
+
+    async def open(self) -> "AsyncDatabase":
+        """Waits until the database is set up
+
+        :exception: RuntimeError when it can't be opened or upgraded
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self._ready.wait)
+        if self._error:
+            raise RuntimeError(self._error)
+        return self
+
+    async def close(self):
+        """Stops streams, runs the requests queued, and closes the connections"""
+        if self._closing.is_set():
+            return
+        self._closing.set()
+        self._requests["write"].put(None)
+        for _ in self._threads[1:]:
+            self._requests["read"].put(None)
+        loop = asyncio.get_running_loop()
+        for thread in self._threads:
+            await loop.run_in_executor(None, thread.join)
+
+    async def __aenter__(self) -> "AsyncDatabase":
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _submit(self, kind: str, call):
+        if self._closing.is_set():
+            raise RuntimeError("AsyncDatabase is closed")
+        slots = self._slots.get(kind)
+        if slots is None:
+            slots = self._slots[kind] = asyncio.Semaphore(self.queue_size)
+        await slots.acquire()
+        request = _Request(call, asyncio.get_running_loop(), slots)
+        self._requests[kind].put(request)
+        # A request cancelled still runs; its slot is freed when it finishes
+        return await request.future
+
+    async def _call(self, kind: str, method: str, args: tuple, kwargs: dict):
+        return await self._submit(kind, lambda db: getattr(db, method)(*args, **kwargs))
+
+    async def _stream(self, method: str, args: tuple, kwargs: dict):
+        """Runs an iterator on a reader thread until it ends or is closed"""
+        stream = _Stream(asyncio.get_running_loop(), self._closing)
+
+        def produce(db: Database):
+            stream.produce(partial(getattr(db, method), *args, **kwargs))
+
+        produced = asyncio.ensure_future(self._submit("read", produce))
+        produced.add_done_callback(stream.done)
+        try:
+            while True:
+                item = await stream.batches.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                for row in item:
+                    yield row
+        finally:
+            stream.stop.set()
+            await asyncio.wait({produced})
+
+    def _open(self, **kwargs) -> Database:
+        return Database(
+            **self._options,
+            settings={**self._settings, **kwargs.pop("settings", {})},
+            **kwargs,
+        )
+
+    def _open_writer(self):
+        """Opens the connection of writes and sets the database up, before any
+        reader opens theirs
+        """
+        db = None
+        try:
+            db = self._open(factory=BatchingConnection)
+            error = db.setup()  # a tuple with a message when it fails
+            if error:
+                self._error = error[1]
+        except Exception as e:
+            self._error = f"Unexpected error: {str(e)}"
+        self._ready.set()
+        return db
+
+    def _next_batch(self, requests: queue.SimpleQueue) -> Tuple[list, bool]:
+        """Waits for a write, then takes the ones queued behind it
+
+        :return: a tuple with a list of requests and whether it is closing
+        """
+        batch = [requests.get()]
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            try:
+                batch.append(requests.get_nowait())
+            except queue.Empty:
+                break
+        if batch[-1] is None:
+            return batch[:-1], True
+        return batch, False
+
+    def _write_loop(self):
+        db = self._open_writer()
+        closing = False
+        while not closing:
+            batch, closing = self._next_batch(self._requests["write"])
+            if batch:
+                self._write_batch(db, batch)
+        if db is not None:
+            db.close()
+
+    def _write_batch(self, db: Database, batch: List[_Request]):
+        """Runs writes in a transaction, each in a savepoint so that a failing one
+        is undone alone. Their results are handed over once it is committed.
+        """
+        if self._error:
+            results = [RuntimeError(self._error)] * len(batch)
+        else:
+            connection = db.connection
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.batching = True
+                results = [self._write(db, request) for request in batch]
+                connection.batching = False
+                connection.commit()
+            except Exception as e:
+                connection.batching = False
+                if connection.in_transaction:
+                    db._rollback()
+                results = [(False, f"Unexpected error: {str(e)}")] * len(batch)
+            self.writes += len(batch)
+            self.batches += 1
+        for request, result in zip(batch, results):
+            request.resolve(result)
+
+    @staticmethod
+    def _write(db: Database, request: _Request):
+        db.connection.execute("SAVEPOINT pyjj_request")
+        try:
+            result = request.call(db)
+            failed = isinstance(result, tuple) and result[:1] == (False,)
+        except Exception as e:
+            result, failed = e, True
+        if failed:
+            db.connection.execute("ROLLBACK TO pyjj_request")
+            db._tag_ids.clear()
+        db.connection.execute("RELEASE pyjj_request")
+        return result
+
+    def _read_loop(self):
+        self._ready.wait()
+        db, error = None, self._error
+        if not error:
+            try:
+                db = self._open(settings={"query_only": 1})
+            except Exception as e:
+                error = f"Unexpected error: {str(e)}"
+        requests = self._requests["read"]
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            try:
+                result = request.call(db) if db else RuntimeError(error)
+            except Exception as e:
+                result = e
+            request.resolve(result)
+        if db is not None:
+            db.close()
@@ -0,0 +1,190 @@
+import asyncio
+import heapq
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterable, List, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+USER_AGENT = "pyjj-check/0.0.1"
+
+
+def is_healthy(status: int) -> bool:
+    """Returns whether a http status of a check means the link is alive
+
+    :param int status: a http status or None when no response was received
+    :return: bool
+    """
+    return status is not None and 200 <= status < 400
+
+
+def probe(url: str, timeout: float) -> Tuple[int, str, str]:
+    """Requests a url with HEAD, falling back to GET as some servers reject or
+    mishandle HEAD. Only headers are read; the body of a GET is never downloaded.
+
+    :param str url: a url to check
+    :param float timeout: seconds to wait for connecting and every read
+    :return: a tuple with a http status or None, a final url after redirects
+        and an error message or None
+    """
+    for method in ("HEAD", "GET"):
+        request = Request(url, method=method, headers={"User-Agent": USER_AGENT})
+        try:
+            with urlopen(request, timeout=timeout) as response:
+                return response.status, response.geturl(), None
+        except HTTPError as e:
+            result = e.code, e.geturl() or url, str(e.reason)
+        except Exception as e:  # URLError, timeouts and malformed responses
+            return None, url, str(getattr(e, "reason", None) or e)
+    return result
+
+
+class HostQueue:
+    """Urls waiting to be checked, handed out as their host becomes free. A url
+    whose host was requested less than an interval ago is deferred while urls of
+    other hosts go first, so runs of urls on one host don't keep workers asleep.
+    Urls are read ahead from the iterable up to `lookahead` at a time.
+    """
+
+    def __init__(self, urls: Iterable[tuple], interval: float, lookahead: int):
+        """Urls are read from the first `get` on
+
+        :param urls: an iterable of tuples with a url id and a url
+        :param float interval: minimum seconds between requests to the same host
+        :param int lookahead: a maximum number of urls read ahead
+        """
+        self.urls = iter(urls)
+        self.interval = interval
+        self.lookahead = lookahead
+        self.size = 0
+        self.exhausted = False
+        # Urls of every host, and a heap of hosts with urls by when they are free
+        self.pending = {}
+        self.hosts = []
+        self.next_times = {}
+        self.order = itertools.count()
+        self.changed = asyncio.Condition()
+
+    def fill(self) -> bool:
+        """Reads urls ahead until `lookahead` urls wait
+
+        :return: whether a url was read
+        """
+        count = 0
+        while not self.exhausted and self.size < self.lookahead:
+            item = next(self.urls, None)
+            if item is None:
+                self.exhausted = True
+                break
+            host = urlparse(item[1]).hostname
+            if host not in self.pending:
+                self.pending[host] = deque()
+                free_at = self.next_times.get(host, 0)
+                heapq.heappush(self.hosts, (free_at, next(self.order), host))
+            self.pending[host].append(item)
+            self.size += 1
+            count += 1
+        return count > 0
+
+    def pop(self, now: float) -> Tuple[int, str]:
+        """Takes a url of the host free the earliest, and the next slot of the host
+
+        :param float now: a time of the event loop
+        :return: a tuple with a url id and a url
+        """
+        _, _, host = heapq.heappop(self.hosts)
+        urls = self.pending[host]
+        item = urls.popleft()
+        self.size -= 1
+        self.next_times[host] = now + self.interval
+        if urls:
+            heapq.heappush(self.hosts, (now + self.interval, next(self.order), host))
+        else:
+            del self.pending[host]
+        return item
+
+    async def get(self) -> Tuple[int, str]:
+        """Waits until a host with urls is free and takes one of its urls. Urls
+        read while waiting wake the waiters, as their hosts may be free already.
+
+        :return: a tuple with a url id and a url, or None once every url is taken
+        """
+        loop = asyncio.get_running_loop()
+        async with self.changed:
+            while True:
+                if self.fill():
+                    self.changed.notify_all()
+                if not self.hosts:
+                    return None
+                delay = self.hosts[0][0] - loop.time()
+                if delay <= 0:
+                    item = self.pop(loop.time())
+                    if self.fill():
+                        self.changed.notify_all()
+                    return item
+                try:
+                    await asyncio.wait_for(self.changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+
+async def check_urls(
+    urls: Iterable[Tuple[int, str]],
+    save: Callable[[List[tuple]], None],
+    concurrency: int = 20,
+    interval: float = 1.0,
+    timeout: float = 10.0,
+    batch_size: int = 100,
+    lookahead: int = 1000,
+) -> int:
+    """Checks urls concurrently. Urls are pulled from the iterable as workers
+    free up, at most `lookahead` ahead, so they are never all loaded in memory,
+    and results are handed to `save` in batches from the event loop thread.
+
+    :param urls: an iterable of tuples with a url id and a url
+    :param save: a callable taking a list of tuples with a url id, a http
+        status, a final url, an error message and a checked date
+    :param int concurrency: a maximum number of requests in flight
+    :param float interval: minimum seconds between requests to the same host
+    :param float timeout: seconds to wait for a response
+    :param int batch_size: a number of results saved at once
+    :param int lookahead: a maximum number of urls read ahead to find urls of
+        hosts which are free
+    :return: a number of checked urls
+    """
+    loop = asyncio.get_running_loop()
+    queue = HostQueue(urls, interval, lookahead)
+    results, count = [], 0
+
+    async def worker(executor):
+        nonlocal count
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            url_id, url = item
+            status, final_url, error = await loop.run_in_executor(
+                executor, probe, url, timeout
+            )
+            checked_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            results.append((url_id, status, final_url, error, checked_at))
+            count += 1
+            if len(results) >= batch_size:
+                batch = results[:]
+                results.clear()
+                save(batch)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        tasks = [asyncio.ensure_future(worker(executor)) for _ in range(concurrency)]
+        try:
+            # Fails as soon as saving fails, rather than checking the urls left
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+    if results:
+        save(results)
+    return count
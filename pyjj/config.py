@@ -1,6 +1,14 @@
+import json
 import os
 
-from yaml import dump, Dumper, load, Loader
+import click
+
+
+def get_home() -> str:
+    """Returns a directory of config.yaml and databases; `PYJJ_HOME` if it is set,
+    otherwise the package directory
+    """
+    return os.environ.get("PYJJ_HOME") or os.path.dirname(os.path.abspath(__file__))
 
 
 def handle_exception(func):
@@ -18,39 +26,147 @@ def handle_exception(func):
     return wrapper
 
 
+def load_yaml(stream):
+    """Load yaml with the C loader if libyaml is available. yaml is imported here,
+    as most invocations read the cached config and never need it.
+
+    :param stream: a yaml file
+    :return: parsed content
+    """
+    from yaml import load
+
+    try:
+        from yaml import CSafeLoader as Loader
+    except ImportError:  # libyaml is not available
+        from yaml import SafeLoader as Loader
+
+    return load(stream, Loader=Loader)
+
+
 class PyjjConfig:
     """Class that parses and updates configurations from a configuration file: config.yaml
     Possible configurations include,
       - `division`: A space for bookmarks; equivalent to database name.
+      - `connection`: Connection settings of databases such as `journal_mode`,
+        `synchronous`, `busy_timeout`, `cache_size` and `mmap_size`.
+      - `tracking_params`: Query parameters ignored when urls are compared for
+        duplicates; `*` matches any suffix.
     """
 
     def __init__(self):
-        self.path = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), "config.yaml"
-        )
+        self.division = "default"
+        self.connection = {}
+        self.tracking_params = None
+        self.tracer = None
+        self._content = {}
+        self._db = None
+        self.path = os.path.join(get_home(), "config.yaml")
         if not os.path.exists(self.path):  # create a config.yaml file if doesn't exist
             with open(self.path, "w") as file:
                 file.write("division: default")
 
+    @property
+    def cache_path(self) -> str:
+        """A path of the parsed config.yaml cached as json, next to config.yaml"""
+        head, tail = os.path.split(str(self.path))
+        return os.path.join(head, f".{tail}.json")
+
+    @property
+    def db(self):
+        """A database of the current division, opened on first use so that commands
+        without bookmarks don't pay for it. It is a proxy of `pyjj serve` when the
+        daemon is running, unless statements are traced.
+        """
+        if self._db is None and self.tracer is not None:
+            self._db = self.open_db()
+        elif self._db is None:
+            from .remote import connect_database
+
+            self._db = connect_database(self.division, self.open_db)
+        return self._db
+
+    def open_db(self, division: str = None):
+        """Opens a database of a division directly
+
+        :param str division: a division name; the current division if not given
+        :exception: click.ClickException when the database can't be set up
+        """
+        from .database import Database
+
+        db = Database(
+            division=division or self.division,
+            settings=self.connection,
+            tracking_params=self.tracking_params,
+            tracer=self.tracer,
+        )
+        failure = db.setup()  # None unless it fails
+        if failure:
+            db.close()
+            raise click.ClickException(
+                f"Failed to set up division {db.division}: {failure[1]}"
+            )
+        return db
+
     @handle_exception
     def parse(self) -> None:
-        """Parse config.yaml and set configurations to class attributes
+        """Parse config.yaml and set configurations to class attributes. The parsed
+        content is cached as json, so yaml is only loaded when config.yaml changes
         """
+        stat = os.stat(self.path)
+        stamp = [stat.st_mtime_ns, stat.st_size]
         with open(self.path, "r") as file:
             try:
-                yml_content = load(file, Loader=Loader)
+                yml_content = self._load_cache(stamp)
+                is_cached = yml_content is not None
+                if not is_cached:
+                    yml_content = load_yaml(file)
                 for key, val in yml_content.items():
                     setattr(self, key, val)
+                self._content = yml_content
+                if not is_cached:
+                    self._save_cache(stamp, yml_content)
             except Exception as e:
                 print(f"Falied to parse config file: {str(e)}")
 
     @handle_exception
     def update(self, **kwargs) -> None:
-        """Overwrite config.yaml with class attributes
+        """Overwrite config.yaml with class attributes, keeping parsed ones
         """
         try:
-            dump(data=kwargs, stream=open(self.path, "w"), Dumper=Dumper)
+            from yaml import dump, Dumper
+
+            content = {**self._content, **kwargs}
+            with open(self.path, "w") as file:
+                dump(data=content, stream=file, Dumper=Dumper)
+            stat = os.stat(self.path)
+            self._save_cache([stat.st_mtime_ns, stat.st_size], content)
+            self._content = content
             for key, val in kwargs.items():
                 setattr(self, key, val)
         except Exception as e:
             print(f"Falied to serialize config file: {str(e)}")
+
+    def _load_cache(self, stamp: list):
+        """Returns cached content of config.yaml if the cache matches the stamp
+
+        :param list stamp: modification time and size of config.yaml
+        :return: content of config.yaml or None
+        """
+        try:
+            with open(self.cache_path, "r") as file:
+                cache = json.load(file)
+            return cache["content"] if cache["stamp"] == stamp else None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_cache(self, stamp: list, content) -> None:
+        """Cache content of config.yaml if it can be serialized as json
+
+        :param list stamp: modification time and size of config.yaml
+        :param content: content of config.yaml
+        """
+        try:
+            with open(self.cache_path, "w") as file:
+                json.dump({"stamp": stamp, "content": content}, file)
+        except (OSError, TypeError, ValueError):
+            pass
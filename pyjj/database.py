@@ -1,27 +1,235 @@
+import json
 import os
 import sqlite3
-from datetime import datetime
-from random import choice
-from typing import List, Dict, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from random import randint, shuffle
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple
 
+from .config import get_home
+from .migrations import (
+    generate_fuzzy_sqls,
+    generate_rebuild_fuzzy_sqls,
+    generate_rebuild_search_sqls,
+    has_trigram_tokenizer,
+    migrate,
+)
+from .utils import TRACKING_PARAMS, url_hash, validate_url
 
-def generate_create_sqls(tbl_name: str, columns: List[tuple], keys: Dict) -> str:
+# Rows per batch of bulk inserts and updates
+BATCH_SIZE = 500
+
+# Compiled statements kept by a connection; every statement of `STATEMENTS` and
+# the shapes of filtered queries fit, so repeated calls skip compiling them
+CACHED_STATEMENTS = 256
+
+# Statements run on every call of hot paths, formatted once per division. Lists
+# of values are bound as a single json parameter, so the text of a statement
+# never changes and its compiled form is reused.
+STATEMENTS = {
+    "find_url": "SELECT MIN(id) FROM {urls} WHERE url_hash=?",
+    "find_hashes": """SELECT url_hash, id FROM {urls}
+        WHERE url_hash IN (SELECT value FROM json_each(?))""",
+    "insert_url": "INSERT INTO {urls} (url, url_hash) VALUES (?, ?)",
+    "insert_dated_url": """INSERT INTO {urls} (url, url_hash, created_at)
+        VALUES (?, ?, COALESCE(?, datetime('now', 'localtime')))""",
+    "get_url": "SELECT * FROM {urls} WHERE id=?",
+    "remove_url": "DELETE FROM {urls} WHERE id=?",
+    "find_ids": "SELECT id FROM {urls} WHERE id IN (SELECT value FROM json_each(?))",
+    "find_tagged_ids": """SELECT url_id FROM {url_tags}
+        WHERE tag_id=? AND url_id IN (SELECT value FROM json_each(?))""",
+    "insert_tag": "INSERT OR IGNORE INTO {tags} (tag) VALUES (?)",
+    "find_tags": """SELECT tag, id FROM {tags}
+        WHERE tag IN (SELECT value FROM json_each(?))""",
+    "insert_url_tag": """INSERT OR IGNORE INTO {url_tags} (url_id, tag_id)
+        VALUES (?, ?)""",
+    "remove_url_tag": "DELETE FROM {url_tags} WHERE url_id=? AND tag_id=?",
+    "insert_synced_url": """INSERT INTO {urls}
+        (url, url_hash, created_at, title, description)
+        VALUES (?, ?, COALESCE(?, datetime('now', 'localtime')), ?, ?)""",
+    "update_synced_url": """UPDATE {urls} SET title=COALESCE(?1, title),
+        description=COALESCE(?2, description) WHERE id=?3
+        AND (title IS NOT COALESCE(?1, title)
+        OR description IS NOT COALESCE(?2, description))""",
+    "remove_synced_url": "DELETE FROM {urls} WHERE url_hash=?",
+}
+
+# Default connection settings applied as PRAGMAs; overridden by `connection` in
+# config.yaml. WAL lets readers run alongside a writer and busy_timeout makes
+# concurrent writers wait for the lock instead of failing.
+CONNECTION_SETTINGS = {
+    "busy_timeout": 5000,  # first, so the settings below wait for locks too
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -16000,
+    "mmap_size": 268435456,
+}
+
+# bm25 weights of url, title, description and tags in the search index
+SEARCH_WEIGHTS = "1.0, 1.5, 0.5, 2.0"
+
+# Fuzzy lookups rank FUZZY_CANDIDATES per result, selected by bm25 over the
+# rarest trigrams of the query. Trigrams are taken from the rarest up to
+# FUZZY_POSTINGS rows, so the cost of a lookup doesn't grow with the number of
+# urls. Tags are suggested only if they are at least FUZZY_THRESHOLD similar.
+FUZZY_THRESHOLD = 0.3
+FUZZY_CANDIDATES = 10
+FUZZY_POSTINGS = 50000
+
+# Tags of a url are joined by `GROUP_CONCAT` with the unit separator, which can't
+# be typed into a tag, so tags may contain commas
+TAG_SEPARATOR = "\x1f"
+
+# Tag names whose ids are cached by a connection
+TAG_CACHE_SIZE = 1024
+
+# Orders of tags by their sort keys, for `tags --sort`
+TAG_ORDERS = {
+    "name": "tag",
+    "count": "usage_count DESC, tag",
+    "recent": "created_at DESC, id DESC",
+}
+
+# Conditions on the latest check of a url by its health, for `list --health`
+HEALTH = {
+    "ok": "A.id IN (SELECT url_id FROM {checks} WHERE status BETWEEN 200 AND 399)",
+    "dead": "A.id IN (SELECT url_id FROM {checks} WHERE status IS NULL "
+    "OR status NOT BETWEEN 200 AND 399)",
+    "unchecked": "A.id NOT IN (SELECT url_id FROM {checks})",
+}
+
+
+def pragma_value(value) -> str:
+    """Validate a PRAGMA value, which cannot be bound as a parameter
+
+    :param value: an integer or a keyword such as `wal`
+    :exception: ValueError when the value is neither
+    :return: the value as a string
+    """
+    if isinstance(value, int) or str(value).isalnum():
+        return str(value)
+    raise ValueError(f"Invalid connection setting: {value}")
+
+
+def match_query(query: str) -> str:
+    """Convert user input into a FTS5 query matching every term as a prefix
+
+    :param str query: space-separated search terms
+    :return: a FTS5 query
     """
-    tbl_name: string a table name after pyjj_{tbl_name}
-    columns: list of tuples (column_name, data_type, options)
-    keys: dict of keys key: (columns, options)
+    terms = query.replace('"', '""').split()
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def division_statements(division: str) -> dict:
+    """Returns `STATEMENTS` on tables of a division
+
+    :param str division: a division name
+    :return: a dict of statement names to sql strings
     """
-    assert tbl_name
-    column_stmt = ",".join(f"{key} {val} {opt}" for key, val, opt in columns)
-    key_stmt = (
-        ","
-        + ",".join(
-            f"{key} ({','.join(value[0])}) {value[1]}" for key, value in keys.items()
-        )
-        if keys
-        else ""
+    tables = {name: f"pyjj_{division}_{name}" for name in ("urls", "tags", "url_tags")}
+    return {name: sql.format(**tables) for name, sql in STATEMENTS.items()}
+
+
+def json_list(values: Iterable) -> str:
+    """Returns values as a json array, bound as a single parameter of `json_each`
+
+    :param values: json-serializable values
+    :return: a json string
+    """
+    return json.dumps(list(values))
+
+
+def phrase(text: str) -> str:
+    """Quote a text as a FTS5 phrase, which the trigram tokenizer matches as a
+    substring
+
+    :param str text: a text of at least 3 characters
+    :return: a FTS5 phrase
+    """
+    text = text.replace('"', '""')
+    return f'"{text}"'
+
+
+def like_pattern(word: str) -> str:
+    """Returns a LIKE pattern matching text containing the word, escaped by `\\`"""
+    for char in ("\\", "%", "_"):
+        word = word.replace(char, "\\" + char)
+    return f"%{word}%"
+
+
+def trigrams(text: str) -> set:
+    """Returns trigrams of every word of a text in lower case, as indexed by the
+    trigram tokenizer
+
+    :param str text: a text
+    :return: a set of trigrams
+    """
+    words = text.lower().split()
+    return {word[i:i + 3] for word in words for i in range(len(word) - 2)}
+
+
+def similarity(query: set, text: str, partial: bool = False) -> float:
+    """Returns a trigram similarity of a text to a query, between 0 and 1
+
+    :param set query: trigrams of the query
+    :param str text: a text to compare
+    :param bool partial: whether to return the share of trigrams of the query the
+        text has, so that the rest of a long text doesn't count
+    :return: shared trigrams over trigrams of both, or of the query if `partial`
+    """
+    text = trigrams(text)
+    if not query or not text:
+        return 0.0
+    shared = len(query & text)
+    return shared / (len(query) if partial else len(query | text))
+
+
+def split_tags(tags: str) -> List[str]:
+    """Split tags aggregated by `GROUP_CONCAT` into a list
+
+    :param str tags: tags separated by `TAG_SEPARATOR` or None when a url has no tag
+    :return: a list of tags
+    """
+    return tags.split(TAG_SEPARATOR) if tags else []
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """Split an iterable into lists of the given size
+
+    :param iterable: an iterable to split
+    :param int size: a maximum size of each list
+    :return: an iterator of lists
+    """
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def database_dir(path: str = None) -> str:
+    """Returns a directory of database files
+
+    :param str path: a directory given by the caller
+    :return: the path, or `.db` under `PYJJ_HOME` or the package directory
+    """
+    return path or os.path.join(get_home(), ".db")
+
+
+def list_divisions(path: str = None) -> List[str]:
+    """Returns names of divisions which have a database file
+
+    :param str path: a directory of database files; see `database_dir`
+    :return: a sorted list of division names
+    """
+    _path, suffix = database_dir(path), "_pyjj.db"
+    if not os.path.isdir(_path):
+        return []
+    return sorted(
+        name[: -len(suffix)] for name in os.listdir(_path) if name.endswith(suffix)
     )
-    return f"CREATE TABLE IF NOT EXISTS pyjj_{tbl_name} ({column_stmt} {key_stmt});"
 
 
 def handle_exception(func):
@@ -40,20 +248,60 @@ def handle_exception(func):
 
 
 class Database:
-    def __init__(self, division="default"):
+    def __init__(
+        self,
+        division="default",
+        path: str = None,
+        settings: dict = None,
+        tracking_params: List[str] = None,
+        check_same_thread: bool = True,
+        tracer=None,
+        factory=None,
+    ):
         """Creates a sqlite database with the given division name
 
         :param str division: a name of the sqlite database
+        :param str path: a directory for database files; defaults to `.db` under
+            `PYJJ_HOME` or the package directory
+        :param dict settings: connection settings overriding `CONNECTION_SETTINGS`
+        :param list tracking_params: patterns of query parameters ignored when
+            urls are compared; defaults to `TRACKING_PARAMS`
+        :param bool check_same_thread: whether only the creating thread may use the
+            connection; callers sharing it must serialize access themselves
+        :param tracer: a `pyjj.profiler.Tracer` recording statements of the
+            connection; it is a plain connection without one
+        :param factory: a `sqlite3.Connection` subclass of the connection, unless
+            it is traced
         """
         self._cursor = None
+        # An LRU cache of tag names to ids, valid while `_data_version` holds
+        self._tag_ids = OrderedDict()
+        self._data_version = None
+        self._fuzzy_index = None
         self.division = division
+        self.statements = division_statements(division)
+        self.tracking_params = (
+            TRACKING_PARAMS if tracking_params is None else tuple(tracking_params)
+        )
 
         # Create database directory and file if not exist
-        _path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".db")
+        _path = database_dir(path)
         os.makedirs(_path, exist_ok=True)
+        if tracer is not None:
+            factory = tracer.factory(division)
+        # Writes take the lock when their transaction begins, so a writer waits
+        # on busy_timeout rather than failing when upgrading a read to a write
         self.connection = sqlite3.connect(
-            os.path.join(_path, f"{self.division}_pyjj.db")
+            os.path.join(_path, f"{self.division}_pyjj.db"),
+            isolation_level="IMMEDIATE",
+            check_same_thread=check_same_thread,
+            cached_statements=CACHED_STATEMENTS,
+            **({} if factory is None else {"factory": factory}),
         )
+        for name, value in {**CONNECTION_SETTINGS, **(settings or {})}.items():
+            self.connection.execute(f"PRAGMA {name}={pragma_value(value)}")
+        # Let ON DELETE CASCADE of url_tags run
+        self.connection.execute("PRAGMA foreign_keys=ON")
 
     @handle_exception
     def add_url(self, url: str, tags: list = None) -> Tuple[bool, str]:
@@ -62,9 +310,11 @@ class Database:
         :param str url: a url to insert
         :param list tags: a list of tags to be attached to the url
         """
-        self.cursor.execute(
-            f"INSERT INTO pyjj_{self.division}_urls (url) VALUES ('{url}')"
-        )
+        hash = url_hash(url, self.tracking_params)
+        existing_id = self.find_url(hash)
+        if existing_id:
+            return False, f"Given url already exists! id: {existing_id}"
+        self.cursor.execute(self.statements["insert_url"], (url, hash))
         self.connection.commit()
         url_id = self.cursor.lastrowid
         if tags:
@@ -72,39 +322,614 @@ class Database:
 
         return True, f"Added successfully! id: {url_id}"
 
+    def find_url(self, hash: int) -> int:
+        """Returns an id of a url by a hash of its canonical form, looked up by the
+        url_hash index instead of comparing url text
+
+        :param int hash: a hash returned by `utils.url_hash`
+        :return: an id of the url or None if it doesn't exist
+        """
+        self.cursor.execute(self.statements["find_url"], (hash,))
+        return self.cursor.fetchone()[0]
+
+    @handle_exception
+    def bulk_add_urls(
+        self, entries: Iterable[dict], batch_size: int = BATCH_SIZE
+    ) -> Tuple[bool, dict]:
+        """Inserts urls with tags in a single transaction. Entries are consumed in
+        batches, so the input is never fully loaded in memory. Invalid and
+        duplicate urls are reported instead of aborting the import.
+
+        :param entries: an iterable of dicts with `url`, `tags` and `created_at`
+        :param int batch_size: a number of entries inserted at once
+        :return: a tuple with a status and a report of added, duplicate and
+            invalid urls
+        """
+        report = {"added": 0, "duplicates": [], "invalid": []}
+        try:
+            for batch in batched(entries, batch_size):
+                report["added"] += self._insert_url_batch(batch, report)
+            self.connection.commit()
+        except Exception:
+            self._rollback()
+            raise
+        return True, report
+
+    def _insert_url_batch(self, batch: List[dict], report: dict) -> int:
+        """Validates and inserts a batch of url entries without committing
+
+        :param list batch: a list of dicts with `url`, `tags` and `created_at`
+        :param dict report: a report to append duplicate and invalid urls to
+        :return: a number of inserted urls
+        """
+        entries = {}  # url hashes to urls and entries
+        for entry in batch:
+            try:
+                url = validate_url(entry["url"])
+            except ValueError as e:
+                report["invalid"].append((entry["url"], str(e)))
+                continue
+            hash = url_hash(url, self.tracking_params)
+            if hash in entries:
+                report["duplicates"].append(url)
+            else:
+                entries[hash] = url, entry
+
+        if not entries:
+            return 0
+        self.cursor.execute(self.statements["find_hashes"], (json_list(entries),))
+        for hash in dict(self.cursor.fetchall()):
+            report["duplicates"].append(entries.pop(hash)[0])
+
+        if not entries:
+            return 0
+        self.cursor.executemany(
+            self.statements["insert_dated_url"],
+            (
+                (url, hash, entry.get("created_at"))
+                for hash, (url, entry) in entries.items()
+            ),
+        )
+        self.cursor.execute(self.statements["find_hashes"], (json_list(entries),))
+        url_ids = dict(self.cursor.fetchall())
+
+        tag_ids = self._resolve_tag_ids(
+            {tag for _, entry in entries.values() for tag in entry["tags"]}, create=True
+        )
+        self.cursor.executemany(
+            self.statements["insert_url_tag"],
+            (
+                (url_ids[hash], tag_ids[tag])
+                for hash, (_, entry) in entries.items()
+                for tag in dict.fromkeys(entry["tags"])
+            ),
+        )
+        return len(entries)
+
+    def _resolve_tag_ids(self, tags: Iterable[str], create: bool = False) -> dict:
+        """Returns ids of tags out of the cache, looking the others up in a single
+        statement. Missing tags are created at once if `create` is given, without
+        committing, and looked up in another.
+
+        :param tags: tag names
+        :param bool create: whether to create missing tags
+        :return: a dict of tag names to ids of existing or created tags
+        """
+        # Tags removed by another connection change the data version
+        self.cursor.execute("PRAGMA data_version")
+        data_version = self.cursor.fetchone()[0]
+        if data_version != self._data_version:
+            self._tag_ids.clear()
+            self._data_version = data_version
+
+        tag_ids, missing = {}, []
+        for tag in dict.fromkeys(tags):  # created in the given order
+            if tag in self._tag_ids:
+                self._tag_ids.move_to_end(tag)
+                tag_ids[tag] = self._tag_ids[tag]
+            else:
+                missing.append(tag)
+        if missing:
+            found = self._find_tag_ids(missing)
+            # Only tags that are really missing are inserted, since an insert
+            # ignored on the AUTOINCREMENT table still uses an id up
+            created = [tag for tag in missing if tag not in found] if create else []
+            if created:
+                self.cursor.executemany(
+                    self.statements["insert_tag"], ((tag,) for tag in created)
+                )
+                found.update(self._find_tag_ids(created))
+            tag_ids.update(found)
+            self._tag_ids.update(found)
+        while len(self._tag_ids) > TAG_CACHE_SIZE:
+            self._tag_ids.popitem(last=False)
+        return tag_ids
+
+    def _find_tag_ids(self, tags: List[str]) -> dict:
+        self.cursor.execute(self.statements["find_tags"], (json_list(tags),))
+        return dict(self.cursor.fetchall())
+
+    def _rollback(self):
+        """Rolls back the transaction, along with tags cached while it ran"""
+        self.connection.rollback()
+        self._tag_ids.clear()
+
     @handle_exception
-    def list_urls(self, tag: str = None) -> Tuple[bool, list]:
+    def list_urls(
+        self,
+        tag: str = None,
+        limit: int = None,
+        after: int = None,
+        before: int = None,
+        **filters,
+    ) -> Tuple[bool, list]:
         """Returns a list of urls filtered by a tag if it is given.
 
         :param str tag: a tag attached to urls; it is used to filter urls
+        :param int limit: a maximum number of urls
+        :param int after: only urls with a greater id than this are returned
+        :param int before: only urls with a smaller id than this are returned
+        :param filters: tag expressions `tags`, `any_tags` and `not_tags`; see
+            `iter_urls`
         :return: a tuple with a status of select query and a list of urls
         """
-        sql = f"SELECT * FROM pyjj_{self.division}_urls"
+        urls = self.iter_urls(tag, limit=limit, after=after, before=before, **filters)
+        return True, list(urls)
+
+    def iter_urls(
+        self,
+        tag: str = None,
+        limit: int = None,
+        after: int = None,
+        before: int = None,
+        batch_size: int = 1000,
+        tags: List[str] = None,
+        any_tags: List[str] = None,
+        not_tags: List[str] = None,
+        health: str = None,
+        order_by: str = "id",
+    ) -> Iterator[tuple]:
+        """Yields urls with their tags ordered by id. Urls are paginated by keyset
+        (`after`/`before` an id) and streamed from the cursor in batches. A url row
+        holds an id, a url, a created date and a title.
+
+        :param str tag: a tag attached to urls; it is used to filter urls
+        :param int limit: a maximum number of urls
+        :param int after: only urls with a greater id than this are yielded
+        :param int before: only urls with a smaller id than this are yielded
+        :param int batch_size: a number of rows fetched from the cursor at once
+        :param list tags: tags that every url has, along with `tag`
+        :param list any_tags: tags of which every url has at least one
+        :param list not_tags: tags that no url has
+        :param str health: one of `HEALTH`; filters urls by their latest check
+        :param str order_by: `id`, or `created_at` to order urls by their dates
+        :return: an iterator of tuples with a url row and a list of tags
+        """
+        filters = self._tag_conditions(
+            ([tag] if tag else []) + list(tags or []), any_tags, not_tags
+        )
+        if filters is None:
+            # If no url can match the given tags, yield nothing
+            return
+        conditions, params = filters
+
+        if health:
+            conditions.append(
+                HEALTH[health].format(checks=f"pyjj_{self.division}_checks")
+            )
+
+        if after is not None:
+            conditions.append("A.id>?")
+            params.append(after)
+        if before is not None:
+            conditions.append("A.id<?")
+            params.append(before)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        page = "LIMIT ?" if limit is not None else ""
+        if limit is not None:
+            params.append(limit)
+        if before is not None and after is None and limit is not None:
+            # A page right before the given id; select it backwards then re-order
+            where = f"""WHERE A.id IN (SELECT A.id FROM pyjj_{self.division}_urls
+                AS A {where} ORDER BY A.id DESC {page})"""
+            page = ""
+
+        cursor = self.connection.cursor()
+        order = "A.created_at, A.id" if order_by == "created_at" else "A.id"
+        cursor.execute(self._select_urls_sql(where, page, order), params)
+        try:
+            rows = cursor.fetchmany(batch_size)
+            while rows:
+                for row in rows:
+                    yield row[:4], split_tags(row[4])
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            cursor.close()
+
+    def _tag_conditions(
+        self,
+        tags: List[str] = None,
+        any_tags: List[str] = None,
+        not_tags: List[str] = None,
+    ) -> Tuple[List[str], list]:
+        """Compiles a tag expression into set-based conditions on urls aliased `A`
+
+        :param list tags: tags that every url has
+        :param list any_tags: tags of which every url has at least one
+        :param list not_tags: tags that no url has
+        :return: a tuple with a list of conditions and their parameters, or None
+            if no url can match
+        """
+        tags, any_tags, not_tags = (
+            set(names or []) for names in (tags, any_tags, not_tags)
+        )
+        tag_ids = self._resolve_tag_ids(tags | any_tags | not_tags)
+        url_tags = f"SELECT url_id FROM pyjj_{self.division}_url_tags WHERE tag_id"
+        in_ids = "IN (SELECT value FROM json_each(?))"
+        conditions, params = [], []
 
-        if tag:
-            is_tag_exist, tag_id = self.check_tag(tag)
-            if is_tag_exist:
-                # Get urls with the given tag
-                sql = f"""SELECT A.* FROM pyjj_{self.division}_urls AS A
-                        INNER JOIN pyjj_{self.division}_url_tags AS B ON A.id=B.url_id
-                        WHERE B.tag_id={tag_id}"""
+        if tags:
+            if not tags <= tag_ids.keys():
+                return None
+            if len(tags) == 1:
+                conditions.append(f"A.id IN ({url_tags}=?)")
+                params.append(tag_ids[tags.pop()])
             else:
-                # If the given tag doesn't exist, return empty list
-                return True, []
+                # Urls with as many of the tags as given have all of them
+                conditions.append(
+                    f"A.id IN ({url_tags} {in_ids} GROUP BY url_id "
+                    "HAVING COUNT(*)=?)"
+                )
+                params += [json_list(tag_ids[tag] for tag in tags), len(tags)]
+        if any_tags:
+            ids = [tag_ids[tag] for tag in any_tags if tag in tag_ids]
+            if not ids:
+                return None
+            conditions.append(f"A.id IN ({url_tags} {in_ids})")
+            params.append(json_list(ids))
+        ids = [tag_ids[tag] for tag in not_tags if tag in tag_ids]
+        if ids:
+            conditions.append(f"A.id NOT IN ({url_tags} {in_ids})")
+            params.append(json_list(ids))
+        return conditions, params
+
+    def _select_urls_sql(
+        self, where: str = "", page: str = "", order: str = "A.id"
+    ) -> str:
+        """Returns a select query of urls ordered by id, aggregating tags of every
+        url in the same query to avoid a query per url
+
+        :param str where: a where clause on urls aliased `A`
+        :param str page: a limit clause
+        :param str order: columns to order urls by
+        :return: a sql string
+        """
+        return f"""SELECT A.id, A.url, A.created_at, A.title,
+                GROUP_CONCAT(C.tag, '{TAG_SEPARATOR}')
+            FROM pyjj_{self.division}_urls AS A
+            LEFT JOIN pyjj_{self.division}_url_tags AS B ON A.id=B.url_id
+            LEFT JOIN pyjj_{self.division}_tags AS C ON B.tag_id=C.id
+            {where} GROUP BY A.id ORDER BY {order} {page}"""
+
+    def iter_urls_to_check(
+        self, max_age: float = None, batch_size: int = 1000, **filters
+    ) -> Iterator[tuple]:
+        """Yields ids and urls without a check newer than the given age. Every batch
+        is fetched in full before it is yielded, so checks can be saved meanwhile.
+
+        :param float max_age: days a check stays fresh; every url if not given
+        :param int batch_size: a number of urls selected at once
+        :param filters: tag expressions `tags`, `any_tags` and `not_tags`
+        :return: an iterator of tuples with an id and a url
+        """
+        filters = self._tag_conditions(**filters)
+        if filters is None:
+            return
+        conditions, params = filters
+        if max_age is not None:
+            since = datetime.now() - timedelta(days=max_age)
+            conditions.append(
+                f"""A.id NOT IN (SELECT url_id FROM pyjj_{self.division}_checks
+                WHERE checked_at>=?)"""
+            )
+            params.append(since.strftime("%Y-%m-%d %H:%M:%S"))
+        yield from self._iter_batches("A.id, A.url", conditions, params, batch_size)
+
+    def iter_urls_to_enrich(
+        self,
+        max_age: float = None,
+        urls: List[str] = None,
+        batch_size: int = 1000,
+        **filters,
+    ) -> Iterator[tuple]:
+        """Yields ids and urls with validators of their last fetch, for urls not
+        fetched within the given age. Batches are fetched in full like
+        `iter_urls_to_check`.
 
-        self.cursor.execute(sql)
-        url_rows = self.cursor.fetchall()
-        tags = []
+        :param float max_age: days fetched metadata stays fresh; every url if not
+            given
+        :param list urls: only these urls are yielded if given
+        :param int batch_size: a number of urls selected at once
+        :param filters: tag expressions `tags`, `any_tags` and `not_tags`
+        :return: an iterator of tuples with an id, a url, an etag and a last
+            modified date
+        """
+        filters = self._tag_conditions(**filters)
+        if filters is None:
+            return
+        conditions, params = filters
+        if max_age is not None:
+            since = datetime.now() - timedelta(days=max_age)
+            conditions.append("(A.fetched_at IS NULL OR A.fetched_at<?)")
+            params.append(since.strftime("%Y-%m-%d %H:%M:%S"))
+        if urls:
+            conditions.append("A.url IN (SELECT value FROM json_each(?))")
+            params.append(json_list(urls))
+        yield from self._iter_batches(
+            "A.id, A.url, A.etag, A.last_modified", conditions, params, batch_size
+        )
+
+    def _iter_batches(
+        self, columns: str, conditions: List[str], params: list, batch_size: int
+    ) -> Iterator[tuple]:
+        """Yields rows of urls aliased `A` ordered by id, selected by keyset in
+        batches fetched in full, so the connection can write between batches
 
-        for url in url_rows:
+        :param str columns: columns to select
+        :param list conditions: conditions on urls
+        :param list params: parameters of the conditions
+        :param int batch_size: a number of rows selected at once
+        :return: an iterator of rows
+        """
+        where = " AND ".join(conditions + ["A.id>?"])
+        last_id = 0
+        while True:
             self.cursor.execute(
-                f"""SELECT B.tag FROM pyjj_{self.division}_url_tags AS A
-                INNER JOIN pyjj_{self.division}_tags AS B ON A.tag_id=B.id
-                WHERE url_id={url[0]}"""
+                f"""SELECT {columns} FROM pyjj_{self.division}_urls AS A
+                WHERE {where} ORDER BY A.id LIMIT ?""",
+                (*params, last_id, batch_size),
             )
-            url_tags = [t[0] for t in self.cursor.fetchall()]
-            tags.append(url_tags)
-        return True, list(zip(url_rows, tags))
+            rows = self.cursor.fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    @handle_exception
+    def save_metadata(self, pages: Iterable[tuple]) -> Tuple[bool, str]:
+        """Saves fetched page metadata of urls. Only the fetched date is updated for
+        pages not modified since their last fetch or failed to fetch.
+
+        :param pages: tuples with a url id, a http status or None, a title, a
+            description, an etag, a last modified date and a fetched date
+        :return: a tuple with a status of update query and a message
+        """
+        fetched, unchanged = [], []
+        for url_id, status, *metadata, fetched_at in pages:
+            if status is not None and 200 <= status < 300:
+                fetched.append((*metadata, fetched_at, url_id))
+            else:
+                unchanged.append((fetched_at, url_id))
+        self.cursor.executemany(
+            f"""UPDATE pyjj_{self.division}_urls SET title=?, description=?, etag=?,
+            last_modified=?, fetched_at=? WHERE id=?""",
+            fetched,
+        )
+        self.cursor.executemany(
+            f"UPDATE pyjj_{self.division}_urls SET fetched_at=? WHERE id=?", unchanged
+        )
+        self.connection.commit()
+        return True, f"Saved successfully! pages: {len(fetched)}"
+
+    @handle_exception
+    def save_checks(self, checks: Iterable[tuple]) -> Tuple[bool, str]:
+        """Saves results of link checks, replacing previous ones of the urls
+
+        :param checks: tuples with a url id, a http status or None, a final url
+            after redirects, an error message or None and a checked date
+        :return: a tuple with a status of insert query and a message
+        """
+        self.cursor.executemany(
+            f"""INSERT OR REPLACE INTO pyjj_{self.division}_checks
+            (url_id, status, final_url, error, checked_at) VALUES (?, ?, ?, ?, ?)""",
+            checks,
+        )
+        self.connection.commit()
+        return True, f"Saved successfully! checks: {self.cursor.rowcount}"
+
+    def search_urls(
+        self, query: str, limit: int = None, with_score: bool = False
+    ) -> Iterator[tuple]:
+        """Yields urls with their tags matching the query over url text, titles,
+        descriptions and tags, ranked by bm25 with tag matches weighted higher
+
+        :param str query: space-separated search terms
+        :param int limit: a maximum number of urls
+        :param bool with_score: whether to yield bm25 scores as well, which are
+            lower for better matches
+        :return: an iterator of tuples with a url row and a list of tags, and a
+            score if `with_score` is given
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(
+            f"""SELECT A.id, A.url, A.created_at, A.title,
+                GROUP_CONCAT(C.tag, '{TAG_SEPARATOR}'), MIN(S.score)
+            FROM (SELECT rowid, bm25(pyjj_{self.division}_search, {SEARCH_WEIGHTS})
+                AS score
+                FROM pyjj_{self.division}_search WHERE pyjj_{self.division}_search
+                MATCH ? ORDER BY score LIMIT ?) AS S
+            INNER JOIN pyjj_{self.division}_urls AS A ON A.id=S.rowid
+            LEFT JOIN pyjj_{self.division}_url_tags AS B ON A.id=B.url_id
+            LEFT JOIN pyjj_{self.division}_tags AS C ON B.tag_id=C.id
+            GROUP BY A.id ORDER BY MIN(S.score), A.id""",
+            (match_query(query), -1 if limit is None else limit),
+        )
+        try:
+            for row in cursor:
+                yield (row[:4], split_tags(row[4])) + ((row[5],) if with_score else ())
+        finally:
+            cursor.close()
+
+    def find_urls(
+        self, query: str, limit: int = 20, fuzzy: bool = False
+    ) -> Iterator[tuple]:
+        """Yields urls whose hosts and paths contain every word of the query, newest
+        first, looked up by a trigram index rather than scanning urls. A fuzzy
+        lookup yields urls sharing trigrams with the query instead, ranked by the
+        share of trigrams of the query they have, so typos still match.
+
+        :param str query: space-separated words of at least 3 characters
+        :param int limit: a maximum number of urls
+        :param bool fuzzy: whether to rank close matches
+        :exception: ValueError when a word is shorter than a trigram
+        :return: an iterator of tuples with a url row and a list of tags
+        """
+        words = query.split()
+        if not words or any(len(word) < 3 for word in words):
+            raise ValueError("Give words of at least 3 characters")
+        if not self.fuzzy_index:
+            ids = self._like_url_ids(words, limit)
+        elif fuzzy:
+            ranked = self._rank_fuzzy("urls", query, limit, partial=True)
+            ids = [id for id, _, _ in ranked]
+        else:
+            fuzzy_urls = f"pyjj_{self.division}_fuzzy_urls"
+            self.cursor.execute(
+                f"""SELECT rowid FROM {fuzzy_urls} WHERE {fuzzy_urls} MATCH ?
+                ORDER BY rowid DESC LIMIT ?""",
+                (" AND ".join(map(phrase, words)), -1 if limit is None else limit),
+            )
+            ids = [row[0] for row in self.cursor.fetchall()]
+        if not ids:
+            return
+        self.cursor.execute(
+            self._select_urls_sql("WHERE A.id IN (SELECT value FROM json_each(?))"),
+            (json_list(ids),),
+        )
+        urls = dict((row[0], (row[:4], split_tags(row[4]))) for row in self.cursor)
+        yield from (urls[id] for id in ids if id in urls)
+
+    @handle_exception
+    def suggest_tags(self, tag: str, limit: int = 3) -> Tuple[bool, list]:
+        """Returns tags close to a tag, e.g. one with a typo, most similar first
+
+        :param str tag: a tag name
+        :param int limit: a maximum number of tags
+        :return: a tuple with a status of select query and a list of tags
+        """
+        if not self.fuzzy_index:  # every tag is ranked instead
+            self.cursor.execute(f"SELECT id, tag FROM pyjj_{self.division}_tags")
+            tags = self._rank(trigrams(tag), self.cursor.fetchall(), FUZZY_THRESHOLD)
+        else:
+            tags = self._rank_fuzzy("tags", tag, limit, threshold=FUZZY_THRESHOLD)
+        return True, [name for _, name, _ in tags[:limit]]
+
+    @property
+    def fuzzy_index(self) -> bool:
+        """Whether the division has trigram indexes, which are missing on SQLite
+        without the trigram tokenizer
+        """
+        if self._fuzzy_index is None:
+            self.cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE name=?",
+                (f"pyjj_{self.division}_fuzzy_urls",),
+            )
+            self._fuzzy_index = self.cursor.fetchone() is not None
+        return self._fuzzy_index
+
+    def _like_url_ids(self, words: List[str], limit: int = None) -> List[int]:
+        """Returns ids of urls containing every word, newest first, by scanning
+        urls; `find_urls` falls back to it without trigram indexes
+
+        :param list words: words of a query
+        :param int limit: a maximum number of urls
+        :return: a list of ids
+        """
+        likes = " AND ".join(["url LIKE ? ESCAPE '\\'"] * len(words))
+        patterns = [like_pattern(word) for word in words]
+        self.cursor.execute(
+            f"""SELECT id FROM pyjj_{self.division}_urls WHERE {likes}
+            ORDER BY id DESC LIMIT ?""",
+            (*patterns, -1 if limit is None else limit),
+        )
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def _rank_fuzzy(
+        self,
+        name: str,
+        query: str,
+        limit: int = 20,
+        partial: bool = False,
+        threshold: float = 0.0,
+    ) -> List[tuple]:
+        """Returns urls or tags similar to a query, most similar first. Candidates
+        sharing the rarest trigrams of the query are selected by bm25 out of the
+        trigram index, then ranked by their similarity.
+
+        :param str name: `urls` or `tags`
+        :param str query: a text to look up
+        :param int limit: a maximum number of results
+        :param bool partial: whether to rank by the share of trigrams of the query
+            only; see `similarity`
+        :param float threshold: a minimum similarity of results
+        :return: a list of tuples with an id, an indexed text and a similarity
+        """
+        query_trigrams = trigrams(query)
+        fuzzy = f"pyjj_{self.division}_fuzzy_{name}"
+        self.cursor.execute(
+            f"""SELECT term, doc FROM {fuzzy}_vocab
+            WHERE term IN (SELECT value FROM json_each(?)) ORDER BY doc""",
+            (json_list(query_trigrams),),
+        )
+        terms, postings = [], 0
+        for term, doc in self.cursor.fetchall():
+            if terms and postings + doc > FUZZY_POSTINGS:
+                break
+            terms.append(phrase(term))
+            postings += doc
+        if not terms:  # no trigram of the query is indexed
+            return []
+
+        self.cursor.execute(
+            f"""SELECT rowid, text FROM {fuzzy} WHERE {fuzzy} MATCH ?
+            ORDER BY rank LIMIT ?""",
+            (" OR ".join(terms), limit * FUZZY_CANDIDATES),
+        )
+        candidates = self.cursor.fetchall()
+        return self._rank(query_trigrams, candidates, threshold, partial)[:limit]
+
+    @staticmethod
+    def _rank(
+        query: set, candidates: List[tuple], threshold: float, partial: bool = False
+    ) -> List[tuple]:
+        """Ranks ids and texts by their similarity to trigrams of a query
+
+        :return: a list of tuples with an id, a text and a similarity, at least
+            `threshold`, most similar first
+        """
+        ranked = [
+            (id, text, similarity(query, text, partial)) for id, text in candidates
+        ]
+        ranked.sort(key=lambda row: (-row[2], len(row[1]), row[0]))
+        return [row for row in ranked if row[2] >= threshold]
+
+    @handle_exception
+    def rebuild_search_index(self) -> Tuple[bool, str]:
+        """Rebuild the search index and the trigram indexes from urls and tags
+
+        :return: a tuple with a status of the rebuild and a message
+        """
+        sqls = []
+        if has_trigram_tokenizer():
+            # Created here if the migration skipped them on an older SQLite
+            sqls = generate_fuzzy_sqls(self.division)
+            sqls += generate_rebuild_fuzzy_sqls(self.division)
+        for sql in sqls + generate_rebuild_search_sqls(self.division):
+            self.cursor.execute(sql)
+        self.connection.commit()
+        self._fuzzy_index = None
+        return True, f"Rebuilt search index! urls: {self.cursor.rowcount}"
 
     @handle_exception
     def edit_url(self, id: int, url: str) -> Tuple[bool, str]:
@@ -114,11 +939,16 @@ class Database:
         :param str url: a new url to update
         :return: a tuple with a status of update query and a message
         """
+        hash = url_hash(url, self.tracking_params)
+        existing_id = self.find_url(hash)
+        if existing_id and str(existing_id) != str(id):
+            return False, f"Given url already exists! id: {existing_id}"
         now = datetime.now()
         edited_time = now.strftime("%Y-%m-%d %H:%M:%S")
         self.cursor.execute(
-            f"UPDATE pyjj_{self.division}_urls SET url='{url}', "
-            f"created_at='{edited_time}' WHERE id={id}"
+            f"""UPDATE pyjj_{self.division}_urls SET url=?, created_at=?, url_hash=?
+            WHERE id=?""",
+            (url, edited_time, hash, id),
         )
         self.connection.commit()
         return True, f"Edited successfully! id: {id}"
@@ -130,7 +960,7 @@ class Database:
         :param int id: an id of the url
         :return: a tuple with a status of select query and a result
         """
-        self.cursor.execute(f"SELECT * FROM pyjj_{self.division}_urls WHERE id={id}")
+        self.cursor.execute(self.statements["get_url"], (id,))
         result = self.cursor.fetchone()
         if result:
             return True, result
@@ -144,45 +974,317 @@ class Database:
         :param int id: an id of the url
         :return: a tuple with a status of delete query and a message
         """
-        self.cursor.execute(f"DELETE FROM pyjj_{self.division}_urls WHERE id={id}")
+        self.cursor.execute(self.statements["remove_url"], (id,))
         self.connection.commit()
         return True, f"Removed successfully! id: {id}"
 
+    def _selected_sql(
+        self,
+        ids: List[int] = None,
+        ranges: List[Tuple[int, int]] = None,
+        since: str = None,
+        until: str = None,
+        tags: List[str] = None,
+        any_tags: List[str] = None,
+        not_tags: List[str] = None,
+    ) -> Tuple[str, list]:
+        """Returns a select query of ids of urls matching every given condition,
+        for bulk operations to run as a single statement
+
+        :param list ids: ids of urls
+        :param list ranges: tuples with the first and the last id of urls; urls of
+            `ids` or of any of `ranges` are selected
+        :param str since: only urls created at or after this date are selected
+        :param str until: only urls created before this date are selected
+        :param list tags: tags that every url has
+        :param list any_tags: tags of which every url has at least one
+        :param list not_tags: tags that no url has
+        :exception: ValueError when no condition is given, which would select all
+        :return: a tuple with a sql string and its parameters, or None if no url
+            can match
+        """
+        filters = self._tag_conditions(tags, any_tags, not_tags)
+        if filters is None:
+            return None
+        conditions, params = filters
+        if ids or ranges:
+            # Ids as a single json parameter, so there is no limit on their number
+            terms = ["A.id IN (SELECT value FROM json_each(?))"] if ids else []
+            params += [json_list(ids)] if ids else []
+            terms += ["A.id BETWEEN ? AND ?"] * len(ranges or [])
+            params += [id for id_range in ranges or [] for id in id_range]
+            conditions.append(f"({' OR '.join(terms)})")
+        if since:
+            conditions.append("A.created_at>=?")
+            params.append(since)
+        if until:
+            conditions.append("A.created_at<?")
+            params.append(until)
+        if not conditions:
+            raise ValueError("Give ids, tags or dates of bookmarks")
+        where = " AND ".join(conditions)
+        return f"SELECT A.id FROM pyjj_{self.division}_urls AS A WHERE {where}", params
+
+    def _run_bulk(self, statements: List[tuple], dry_run: bool = False) -> int:
+        """Runs statements in a single transaction, which is rolled back on a dry
+        run so that counts are exactly the ones of a real run
+
+        :param list statements: tuples with a sql string and its parameters
+        :param bool dry_run: whether to roll the changes back
+        :return: a number of rows changed by the last statement
+        """
+        try:
+            for sql, params in statements:
+                self.cursor.execute(sql, params)
+            count = self.cursor.rowcount
+            if dry_run:
+                self._rollback()
+            else:
+                self.connection.commit()
+        except Exception:
+            self._rollback()
+            raise
+        return count
+
     @handle_exception
-    def list_tags(self) -> Tuple[bool, list]:
-        """Returns a list of tags
+    def remove_urls(self, dry_run: bool = False, **selection) -> Tuple[bool, int]:
+        """Remove urls matching a selection at once, along with their tags
 
-        :return: a tuple with a status of select query and a list of tags
+        :param bool dry_run: whether to count urls without removing them
+        :param selection: conditions on urls; see `_selected_sql`
+        :return: a tuple with a status of delete query and a number of urls
         """
-        self.cursor.execute(f"SELECT tag, created_at FROM pyjj_{self.division}_tags")
-        tags = self.cursor.fetchall()
-        return bool(tags), list(zip(range(1, len(tags) + 1), tags))
+        selected = self._selected_sql(**selection)
+        if selected is None:
+            return True, 0
+        sql = f"DELETE FROM pyjj_{self.division}_urls WHERE id IN ({selected[0]})"
+        return True, self._run_bulk([(sql, selected[1])], dry_run)
 
     @handle_exception
-    def add_tags(self, url_id: int, tags: list) -> Tuple[bool, str]:
-        """Attach tags to a url
+    def tag_urls(
+        self, names: List[str], dry_run: bool = False, **selection
+    ) -> Tuple[bool, int]:
+        """Attach tags to urls matching a selection at once
 
-        :param int url_id: an id of the url
-        :param list tags: a list of tags(tag name)
-        :return: a tuple with a status of insert query and a message
+        :param list names: tags to attach; missing ones are created
+        :param bool dry_run: whether to count new pairs without attaching them
+        :param selection: conditions on urls; see `_selected_sql`
+        :return: a tuple with a status of insert query and a number of url and tag
+            pairs attached
         """
-        for tag in tags:
-            is_exists, tag_id = self.check_tag(tag)
+        selected = self._selected_sql(**selection)
+        if selected is None:
+            return True, 0
+        names = sorted(set(names))
+        statements = [(self.statements["insert_tag"], (name,)) for name in names]
+        statements.append(
+            (
+                f"""INSERT OR IGNORE INTO pyjj_{self.division}_url_tags (url_id, tag_id)
+                SELECT S.id, T.id FROM ({selected[0]}) AS S
+                CROSS JOIN pyjj_{self.division}_tags AS T
+                WHERE T.tag IN (SELECT value FROM json_each(?))""",
+                selected[1] + [json_list(names)],
+            )
+        )
+        return True, self._run_bulk(statements, dry_run)
 
-            if not is_exists:
-                # Insert to tag table
-                self.cursor.execute(
-                    f"INSERT INTO pyjj_{self.division}_tags (tag) VALUES ('{tag}')"
-                )
-                tag_id = self.cursor.lastrowid
+    @handle_exception
+    def untag_urls(
+        self, names: List[str], dry_run: bool = False, **selection
+    ) -> Tuple[bool, int]:
+        """Detach tags from urls matching a selection at once
+
+        :param list names: tags to detach
+        :param bool dry_run: whether to count pairs without detaching them
+        :param selection: conditions on urls; see `_selected_sql`
+        :return: a tuple with a status of delete query and a number of url and tag
+            pairs detached
+        """
+        selected = self._selected_sql(**selection)
+        tag_ids = list(self._resolve_tag_ids(names).values())
+        if selected is None or not tag_ids:
+            return True, 0
+        sql = f"""DELETE FROM pyjj_{self.division}_url_tags
+            WHERE tag_id IN (SELECT value FROM json_each(?))
+            AND url_id IN ({selected[0]})"""
+        return True, self._run_bulk(
+            [(sql, [json_list(tag_ids)] + selected[1])], dry_run
+        )
 
-            # Insert to url-tag table
+    @handle_exception
+    def merge_tags(
+        self, sources: List[str], target: str, dry_run: bool = False
+    ) -> Tuple[bool, int]:
+        """Merge tags into a target tag at once: urls of the sources get the target,
+        then the sources are removed. A single source is renamed unless the target
+        exists already.
+
+        :param list sources: tags to merge
+        :param str target: a tag to merge into
+        :param bool dry_run: whether to count urls without merging
+        :return: a tuple with a status of the merge and a number of urls of the
+            sources
+        """
+        tag_ids = self._resolve_tag_ids(set(sources) | {target})
+        source_ids = [tag_ids[tag] for tag in set(sources) - {target} if tag in tag_ids]
+        if not source_ids:
+            return False, f"Given tags do not exist! tags: {', '.join(sources)}"
+        tags, url_tags = f"pyjj_{self.division}_tags", f"pyjj_{self.division}_url_tags"
+        in_ids = "IN (SELECT value FROM json_each(?))"
+        sources_json = json_list(source_ids)
+        count_sql = (
+            f"SELECT COUNT(DISTINCT url_id) FROM {url_tags} WHERE tag_id {in_ids}"
+        )
+        if target not in tag_ids and len(source_ids) == 1:
+            sql = f"UPDATE {tags} SET tag=? WHERE id=?"
+            statements = [(sql, (target, *source_ids))]
+        else:
+            statements = [
+                (self.statements["insert_tag"], (target,)),
+                (
+                    f"""INSERT OR IGNORE INTO {url_tags} (url_id, tag_id)
+                    SELECT url_id, (SELECT id FROM {tags} WHERE tag=?)
+                    FROM {url_tags} WHERE tag_id {in_ids}""",
+                    (target, sources_json),
+                ),
+                (f"DELETE FROM {tags} WHERE id {in_ids}", (sources_json,)),
+            ]
+        self.cursor.execute(count_sql, (sources_json,))
+        count = self.cursor.fetchone()[0]
+        self._run_bulk(statements, dry_run)
+        self._tag_ids.clear()  # ids of the sources are gone
+        return True, count
+
+    def _duplicates_sql(self) -> str:
+        """Returns a select query of ids and urls of urls sharing a canonical url
+        with another, along with the smallest id among them, which is kept
+        """
+        return f"""SELECT A.id, A.url, K.keep_id FROM pyjj_{self.division}_urls AS A
+            INNER JOIN (SELECT url_hash, MIN(id) AS keep_id
+                FROM pyjj_{self.division}_urls GROUP BY url_hash HAVING COUNT(*)>1)
+            AS K ON A.url_hash=K.url_hash"""
+
+    @handle_exception
+    def find_duplicates(self) -> Tuple[bool, list]:
+        """Returns groups of urls with the same canonical url
+
+        :return: a tuple with a status of select query and a list of tuples with
+            a kept url and a list of its duplicates, as tuples of an id and a url
+        """
+        self.cursor.execute(f"{self._duplicates_sql()} ORDER BY K.keep_id, A.id")
+        groups = []
+        for id, url, keep_id in self.cursor.fetchall():
+            if id == keep_id:
+                groups.append(((id, url), []))
+            else:
+                groups[-1][1].append((id, url))
+        return True, groups
+
+    @handle_exception
+    def merge_duplicates(self) -> Tuple[bool, str]:
+        """Merges urls with the same canonical url into the oldest one in a single
+        transaction; tags of the duplicates are attached to it before they are
+        removed
+
+        :return: a tuple with a status of the merge and a message
+        """
+        duplicates = "temp.pyjj_duplicates"
+        try:
+            self.cursor.execute(
+                """CREATE TEMP TABLE IF NOT EXISTS pyjj_duplicates
+                (id INTEGER PRIMARY KEY, keep_id INTEGER NOT NULL)"""
+            )
+            self.cursor.execute(f"DELETE FROM {duplicates}")
             self.cursor.execute(
-                f"INSERT INTO pyjj_{self.division}_url_tags (url_id, tag_id)"
-                f" VALUES ('{url_id}', '{tag_id}')"
+                f"""INSERT INTO {duplicates} (id, keep_id)
+                SELECT id, keep_id FROM ({self._duplicates_sql()}) WHERE id<>keep_id"""
             )
+            self.cursor.execute(
+                f"""INSERT OR IGNORE INTO pyjj_{self.division}_url_tags
+                (url_id, tag_id) SELECT D.keep_id, B.tag_id
+                FROM pyjj_{self.division}_url_tags AS B
+                INNER JOIN {duplicates} AS D ON B.url_id=D.id"""
+            )
+            self.cursor.execute(
+                f"""DELETE FROM pyjj_{self.division}_urls
+                WHERE id IN (SELECT id FROM {duplicates})"""
+            )
+            count = self.cursor.rowcount
+            self.cursor.execute(f"DELETE FROM {duplicates}")
+            self.connection.commit()
+        except Exception:
+            self._rollback()
+            raise
+        return True, f"Merged successfully! duplicates: {count}"
+
+    @handle_exception
+    def rehash_urls(self, batch_size: int = BATCH_SIZE) -> Tuple[bool, str]:
+        """Recomputes hashes of canonical urls, after tracking parameters change
+
+        :param int batch_size: a number of urls updated at once
+        :return: a tuple with a status of update query and a message
+        """
+        count = 0
+        rows = self._iter_batches("A.id, A.url", [], [], batch_size)
+        for batch in batched(rows, batch_size):
+            self.cursor.executemany(
+                f"UPDATE pyjj_{self.division}_urls SET url_hash=? WHERE id=?",
+                [(url_hash(url, self.tracking_params), id) for id, url in batch],
+            )
+            count += len(batch)
+        self.connection.commit()
+        return True, f"Rehashed successfully! urls: {count}"
+
+    @handle_exception
+    def list_tags(self, sort: str = "name", min_count: int = 0) -> Tuple[bool, list]:
+        """Returns a list of tags with numbers of their urls, which are kept by
+        triggers so that no url_tags are counted here
+
+        :param str sort: a key of `TAG_ORDERS`
+        :param int min_count: a minimum number of urls of a tag
+        :return: a tuple with a status of select query and a list of tuples with an
+            id, a tag, a created date and a number of urls
+        """
+        self.cursor.execute(
+            f"""SELECT id, tag, created_at, usage_count FROM pyjj_{self.division}_tags
+            WHERE usage_count >= ? ORDER BY {TAG_ORDERS[sort]}""",
+            (min_count or 0,),
+        )
+        return True, self.cursor.fetchall()
+
+    @handle_exception
+    def prune_tags(self) -> Tuple[bool, str]:
+        """Remove tags which no url has
 
+        :return: a tuple with a status of delete query and a message
+        """
+        self.cursor.execute(
+            f"DELETE FROM pyjj_{self.division}_tags WHERE usage_count=0"
+        )
+        count = self.cursor.rowcount
         self.connection.commit()
+        self._tag_ids.clear()
+        return True, f"Pruned successfully! tags: {count}"
+
+    @handle_exception
+    def add_tags(self, url_id: int, tags: list) -> Tuple[bool, str]:
+        """Attach tags to a url
+
+        :param int url_id: an id of the url
+        :param list tags: a list of tags(tag name)
+        :return: a tuple with a status of insert query and a message
+        """
+        try:
+            # Tags are resolved or created at once, mostly out of the cache
+            tag_ids = self._resolve_tag_ids(tags, create=True)
+            self.cursor.executemany(
+                self.statements["insert_url_tag"],
+                ((url_id, tag_ids[tag]) for tag in dict.fromkeys(tags)),
+            )
+            self.connection.commit()
+        except Exception:
+            self._rollback()
+            raise
         return True, f"Added successfully! tags: {tags}"
 
     @handle_exception
@@ -192,12 +1294,9 @@ class Database:
         :param str tag: a tag name
         :return: a tuple with a status of select query and a tag id
         """
-        self.cursor.execute(
-            f"SELECT id FROM pyjj_{self.division}_tags WHERE tag='{tag}'"
-        )
-        row = self.cursor.fetchone()
-        if row:
-            return True, row[0]
+        tag_id = self._resolve_tag_ids([tag]).get(tag)
+        if tag_id is not None:
+            return True, tag_id
         else:
             return False, -1
 
@@ -211,25 +1310,285 @@ class Database:
         """
         is_exist, tag_id = self.check_tag(tag)
         if is_exist:
-            self.cursor.execute(
-                f"DELETE FROM pyjj_{self.division}_url_tags WHERE "
-                f"url_id={url_id} AND tag_id={tag_id}"
-            )
+            self.cursor.execute(self.statements["remove_url_tag"], (url_id, tag_id))
             self.connection.commit()
             return True, f"Removed successfully! id: {tag_id}"
         else:
             return False, f"Given tag does not exist for {url_id}! tag: {tag}"
 
     @handle_exception
-    def get_random_url(self, tag: str = None) -> Tuple[bool, tuple]:
+    def count_urls(
+        self,
+        tag: str = None,
+        tags: List[str] = None,
+        any_tags: List[str] = None,
+        not_tags: List[str] = None,
+    ) -> Tuple[bool, int]:
+        """Returns a number of urls filtered by a tag expression
+
+        :param str tag: a tag name
+        :param list tags: tags that every url has, along with `tag`
+        :param list any_tags: tags of which every url has at least one
+        :param list not_tags: tags that no url has
+        :return: a tuple with a status of select query and the number
+        """
+        tags = ([tag] if tag else []) + list(tags or [])
+        filters = self._tag_conditions(tags, any_tags, not_tags)
+        if filters is None:
+            return True, 0
+        where = f"WHERE {' AND '.join(filters[0])}" if filters[0] else ""
+        self.cursor.execute(
+            f"SELECT COUNT(*) FROM pyjj_{self.division}_urls AS A {where}", filters[1]
+        )
+        return True, self.cursor.fetchone()[0]
+
+    @handle_exception
+    def get_random_url(self, tag: str = None, **filters) -> Tuple[bool, tuple]:
         """Returns a randomly selected url from urls filtered by a tag if it is given
 
         :param str tag: a tag name
+        :param filters: tag expressions `tags`, `any_tags` and `not_tags`
         :return: a tuple with a status of select query and the url
         """
-        is_urls_exist, urls = self.list_urls(tag)
-        url = choice(urls) if urls else ()
-        return is_urls_exist, url
+        status, urls = self.sample_urls(1, tag, **filters)
+        if status and not urls:
+            return False, "No bookmark to pick from"
+        return status, (urls[0] if status else urls)
+
+    @handle_exception
+    def sample_urls(
+        self,
+        k: int,
+        tag: str = None,
+        tags: List[str] = None,
+        any_tags: List[str] = None,
+        not_tags: List[str] = None,
+    ) -> Tuple[bool, list]:
+        """Returns k distinct urls picked uniformly at random, filtered by a tag if
+        it is given. Random ids are probed by a few indexed queries, and urls of tag
+        expressions are sampled by a single query rather than a query per pick. Only
+        tags of the picked urls are fetched.
+
+        :param int k: a number of urls to pick
+        :param str tag: a tag name
+        :param list tags: tags that every url has, along with `tag`
+        :param list any_tags: tags of which every url has at least one
+        :param list not_tags: tags that no url has
+        :return: a tuple with a status of select query and a list of urls
+        """
+        tags = ([tag] if tag else []) + list(tags or [])
+        filters = self._tag_conditions(tags, any_tags, not_tags)
+        if filters is None:
+            ids = []
+        elif not filters[0]:
+            ids = self._sample_ids(k)
+        elif len(set(tags)) == 1 and not any_tags and not not_tags:
+            ids = self._sample_ids(k, filters[1][0])
+        else:
+            where = " AND ".join(filters[0])
+            ids = self._sample_rows(
+                f"""SELECT A.id FROM pyjj_{self.division}_urls AS A WHERE {where}
+                ORDER BY random() LIMIT ?""",
+                k,
+                tuple(filters[1]),
+            )
+
+        if not ids:
+            return True, []
+        self.cursor.execute(
+            self._select_urls_sql("WHERE A.id IN (SELECT value FROM json_each(?))"),
+            (json_list(ids),),
+        )
+        urls = dict((row[0], (row[:4], split_tags(row[4]))) for row in self.cursor)
+        return True, [urls[id] for id in ids if id in urls]
+
+    def _sample_ids(self, k: int, tag_id: int = None, rounds: int = 4) -> List[int]:
+        """Picks k distinct url ids uniformly at random, of urls with a tag if it is
+        given. Random ids up to the max id are probed first, which fills k ids in a
+        few indexed queries unless gaps left by deletions or a rare tag keep them
+        from it; then every id is sampled in a single query.
+
+        :param int k: a number of ids to pick
+        :param int tag_id: an id of a tag of the urls
+        :param int rounds: a number of probing rounds before falling back
+        :return: a list of ids
+        """
+        urls, url_tags = f"pyjj_{self.division}_urls", f"pyjj_{self.division}_url_tags"
+        self.cursor.execute(f"SELECT MAX(id) FROM {urls}")
+        max_id = self.cursor.fetchone()[0]
+        if not max_id:
+            return []
+        if tag_id is None:
+            probe, params = self.statements["find_ids"], ()
+        else:
+            probe, params = self.statements["find_tagged_ids"], (tag_id,)
+
+        ids = {}  # keeps the order of picks
+        for _ in range(rounds):
+            candidates = [randint(1, max_id) for _ in range(2 * (k - len(ids)))]
+            candidates = [id for id in dict.fromkeys(candidates) if id not in ids]
+            self.cursor.execute(probe, (*params, json_list(candidates)))
+            found = set(row[0] for row in self.cursor)
+            ids.update((id, None) for id in candidates if id in found)
+            if len(ids) >= k:
+                return list(ids)[:k]
+
+        if tag_id is None:
+            sql = f"SELECT id FROM {urls} ORDER BY random() LIMIT ?"
+            return self._sample_rows(sql, k)
+        # Rowids of pairs are sorted from the index on tag ids alone, so only the
+        # picked pairs are looked up
+        return self._sample_rows(
+            f"""SELECT url_id FROM {url_tags} WHERE rowid IN (SELECT rowid
+            FROM {url_tags} WHERE tag_id=? ORDER BY random() LIMIT ?)""",
+            k,
+            (tag_id,),
+        )
+
+    def _sample_rows(self, sql: str, k: int, params: tuple = ()) -> List[int]:
+        """Picks k distinct ids of a query at random in a single pass. The ids are
+        ordered by random keys in SQLite, which keeps only the first k of them.
+
+        :param str sql: a query selecting ids at random, limited by its last
+            parameter
+        :param int k: a number of ids to pick
+        :param tuple params: parameters of the query, preceding k
+        :return: a list of ids
+        """
+        self.cursor.execute(sql, (*params, k))
+        ids = [row[0] for row in self.cursor]
+        shuffle(ids)
+        return ids
+
+    def last_change(self) -> int:
+        """Returns a sequence number of the latest change of the division
+
+        :return: the sequence number, or 0 if nothing has changed
+        """
+        self.cursor.execute(
+            f"SELECT COALESCE(MAX(seq), 0) FROM pyjj_{self.division}_changes"
+        )
+        return self.cursor.fetchone()[0]
+
+    def iter_changes(
+        self, since: int = 0, until: int = None, batch_size: int = 1000
+    ) -> Iterator[dict]:
+        """Yields changes of urls and their tags logged after a sequence number,
+        for `apply_changes` of another database. Every url or url/tag pair changed
+        any number of times is yielded once with its current state, urls first, so
+        the cost follows the number of changes rather than of urls.
+
+        :param int since: a sequence number of the last sync; 0 for everything
+        :param int until: a sequence number of the last change to export
+        :param int batch_size: a number of rows fetched from the cursor at once
+        :return: an iterator of dicts with a `url`, and `created_at`, `title` and
+            `description` of a url or a `tag` of a pair, or `deleted`
+        """
+        division = self.division
+        cursor = self.connection.cursor()
+        cursor.execute(
+            f"""SELECT C.url, C.tag, A.id, A.created_at, A.title, A.description,
+                B.url_id
+            FROM (SELECT url, tag, MAX(seq) AS seq FROM pyjj_{division}_changes
+                WHERE seq>? AND seq<=? GROUP BY url, tag) AS C
+            LEFT JOIN pyjj_{division}_urls AS A ON A.url=C.url
+            LEFT JOIN pyjj_{division}_tags AS T ON T.tag=C.tag
+            LEFT JOIN pyjj_{division}_url_tags AS B
+                ON B.url_id=A.id AND B.tag_id=T.id
+            ORDER BY C.tag IS NOT NULL, C.seq""",
+            (since, self.last_change() if until is None else until),
+        )
+        try:
+            rows = cursor.fetchmany(batch_size)
+            while rows:
+                for row in rows:
+                    change = self._exported_change(row)
+                    if change:
+                        yield change
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            cursor.close()
+
+    def _exported_change(self, row: tuple) -> dict:
+        """Returns a change of `iter_changes` out of a logged url or pair and its
+        current state
+
+        :param tuple row: a logged url and tag, followed by an id, a created date,
+            a title and a description of the url, and an id of the url if it has
+            the tag; the tag is None for the url itself, and the id if it is gone
+        :return: a dict of the change, or None if there is nothing to export
+        """
+        url, tag, url_id, *values, paired = row
+        if tag is not None:
+            if url_id is None:  # removed along with the url
+                return None
+            change = {"url": url, "tag": tag}
+            return change if paired is not None else {**change, "deleted": True}
+        if url_id is not None:
+            fields = zip(("created_at", "title", "description"), values)
+            return {"url": url, **{key: value for key, value in fields if value}}
+        if self.find_url(url_hash(url, self.tracking_params)):
+            return None  # merged into a duplicate rather than removed
+        return {"url": url, "deleted": True}
+
+    @handle_exception
+    def apply_changes(self, changes: Iterable[dict]) -> Tuple[bool, dict]:
+        """Applies changes yielded by `iter_changes` of another database in a single
+        transaction. Urls are matched by their canonical urls and tags by names,
+        and only what differs is written, so applying changes twice is the same as
+        once and nothing is logged back when they are exported again.
+
+        :param changes: an iterable of dicts yielded by `iter_changes`
+        :return: a tuple with a status and numbers of added, updated and removed
+            urls, and of tagged and untagged pairs
+        """
+        report = dict.fromkeys(("added", "updated", "removed", "tagged", "untagged"), 0)
+        try:
+            for change in changes:
+                key = self._apply_change(change)
+                if key:
+                    report[key] += self.cursor.rowcount
+            self.connection.commit()
+        except Exception:
+            self._rollback()
+            raise
+        return True, report
+
+    def _apply_change(self, change: dict) -> str:
+        """Applies a change of a url or a url/tag pair without committing
+
+        :param dict change: a dict yielded by `iter_changes`
+        :return: a key of the report of `apply_changes` counting the rows of the
+            last statement, or None if nothing ran
+        """
+        hash = url_hash(change["url"], self.tracking_params)
+        url_id, tag = self.find_url(hash), change.get("tag")
+        if tag is None and change.get("deleted"):
+            if url_id is None:
+                return None
+            self.cursor.execute(self.statements["remove_synced_url"], (hash,))
+            return "removed"
+        if tag is None:
+            values = (change.get("title"), change.get("description"))
+            if url_id is None:
+                self.cursor.execute(
+                    self.statements["insert_synced_url"],
+                    (change["url"], hash, change.get("created_at"), *values),
+                )
+                return "added"
+            self.cursor.execute(self.statements["update_synced_url"], (*values, url_id))
+            return "updated"
+        if url_id is None:  # removed here meanwhile
+            return None
+        if change.get("deleted"):
+            tag_id = self._resolve_tag_ids([tag]).get(tag)
+            if tag_id is None:
+                return None
+            self.cursor.execute(self.statements["remove_url_tag"], (url_id, tag_id))
+            return "untagged"
+        tag_id = self._resolve_tag_ids([tag], create=True)[tag]
+        self.cursor.execute(self.statements["insert_url_tag"], (url_id, tag_id))
+        return "tagged"
 
     @property
     def cursor(self):
@@ -243,48 +1602,7 @@ class Database:
 
     @handle_exception
     def setup(self):
-        """Initialize tables in a database"""
-        default_table_urls = {
-            "tbl_name": f"{self.division}_urls",
-            "columns": [
-                ("id", "INTEGER", "PRIMARY KEY AUTOINCREMENT"),
-                ("url", "TEXT", "UNIQUE NOT NULL"),
-                ("created_at", "DATE", "DEFAULT(datetime('now', 'localtime'))"),
-            ],
-            "keys": {},
-        }
-        default_table_tags = {
-            "tbl_name": f"{self.division}_tags",
-            "columns": [
-                ("id", "INTEGER", "PRIMARY KEY AUTOINCREMENT"),
-                ("tag", "TEXT", "UNIQUE NOT NULL"),
-                ("created_at", "DATE", "DEFAULT(datetime('now', 'localtime'))"),
-            ],
-            "keys": {},
-        }
-        default_table_url_tags = {
-            "tbl_name": f"{self.division}_url_tags",
-            "columns": [
-                ("url_id", "INTEGER", "NOT NULL"),
-                ("tag_id", "INTEGER", "NOT NULL"),
-            ],
-            "keys": {
-                f"FOREIGN KEY (url_id) REFERENCES pyjj_{self.division}_urls": (
-                    ["id"],
-                    "ON DELETE CASCADE",
-                ),
-                f"FOREIGN KEY (tag_id) REFERENCES pyjj_{self.division}_tags": (
-                    ["id"],
-                    "ON DELETE CASCADE",
-                ),
-            },
-        }
-
-        for sql in (
-            generate_create_sqls(**default_table_urls),
-            generate_create_sqls(**default_table_tags),
-            generate_create_sqls(**default_table_url_tags),
-        ):
-            self.cursor.execute(sql)
-
-        self.connection.commit()
+        """Initialize tables in a database, or upgrade them to the latest schema.
+        Nothing runs but a version check when the schema is already current.
+        """
+        migrate(self.connection, self.division)
@@ -0,0 +1,176 @@
+import heapq
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from random import sample
+from typing import Callable, Iterator, List
+
+# Rows buffered per division ahead of the merge
+QUEUE_SIZE = 256
+
+_DONE = object()
+
+
+def _put(items: queue.Queue, stop: threading.Event, item) -> bool:
+    """Puts an item into a queue unless the merge stops while it is full"""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce(
+    division: str,
+    open_db: Callable,
+    query: Callable,
+    items: queue.Queue,
+    stop: threading.Event,
+):
+    """Puts results of a division into a queue, followed by an exception if the
+    query fails, and `_DONE`"""
+    db = None
+    try:
+        db = open_db(division)
+        for item in query(db):
+            if not _put(items, stop, (division, *item)):
+                return
+    except Exception as e:
+        _put(items, stop, e)
+    finally:
+        if db is not None:
+            db.close()
+        _put(items, stop, _DONE)
+
+
+def _consume(items: queue.Queue) -> Iterator[tuple]:
+    """Yields results out of a queue until `_DONE`"""
+    while True:
+        item = items.get()
+        if item is _DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def merge(
+    divisions: List[str], open_db: Callable, query: Callable, key: Callable
+) -> Iterator[tuple]:
+    """Runs a query on every division at once and merges the results as they
+    arrive. Every division is read by a thread with its own connection into a
+    bounded queue, and the queues are merged by a heap, so memory doesn't grow
+    with the number of results. Threads stop when the merge is closed early.
+
+    :param list divisions: division names
+    :param open_db: a callable opening a `Database` of a division
+    :param query: a callable taking a `Database` and returning an iterator of
+        tuples ordered by `key`
+    :param key: a callable returning a sort key of a tuple prefixed by a division
+    :return: an iterator of tuples of a division followed by a result
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(QUEUE_SIZE) for _ in divisions]
+
+    # A thread per division, as the heap waits for the first row of every one
+    with ThreadPoolExecutor(max_workers=max(len(divisions), 1)) as executor:
+        for division, items in zip(divisions, queues):
+            executor.submit(_produce, division, open_db, query, items, stop)
+        try:
+            yield from heapq.merge(*map(_consume, queues), key=key)
+        finally:
+            stop.set()
+
+
+def iter_all_urls(
+    divisions: List[str], open_db: Callable, limit: int = None, **filters
+) -> Iterator[tuple]:
+    """Yields urls of every division ordered by their created dates
+
+    :param list divisions: division names
+    :param open_db: a callable opening a `Database` of a division
+    :param int limit: a maximum number of urls
+    :param filters: filters of `Database.iter_urls`
+    :return: an iterator of tuples with a division, a url row and a list of tags
+    """
+    urls = merge(
+        divisions,
+        open_db,
+        lambda db: db.iter_urls(limit=limit, order_by="created_at", **filters),
+        lambda item: item[1][2] or "",
+    )
+    try:
+        for count, item in enumerate(urls, 1):
+            yield item
+            if count == limit:
+                return
+    finally:
+        urls.close()
+
+
+def search_all_urls(
+    divisions: List[str], open_db: Callable, query: str, limit: int = None
+) -> Iterator[tuple]:
+    """Yields urls of every division matching the query, ranked by bm25 scores of
+    their own divisions
+
+    :param list divisions: division names
+    :param open_db: a callable opening a `Database` of a division
+    :param str query: space-separated search terms
+    :param int limit: a maximum number of urls
+    :return: an iterator of tuples with a division, a url row and a list of tags
+    """
+    urls = merge(
+        divisions,
+        open_db,
+        lambda db: db.search_urls(query, limit=limit, with_score=True),
+        lambda item: item[3],
+    )
+    try:
+        for count, (division, url, tags, _) in enumerate(urls, 1):
+            yield division, url, tags
+            if count == limit:
+                return
+    finally:
+        urls.close()
+
+
+def sample_all_urls(
+    divisions: List[str], open_db: Callable, k: int, **filters
+) -> List[tuple]:
+    """Picks k distinct urls uniformly at random out of every division: picks are
+    spread over divisions in proportion to their numbers of urls, then sampled
+    within each division
+
+    :param list divisions: division names
+    :param open_db: a callable opening a `Database` of a division
+    :param int k: a number of urls to pick
+    :param filters: a tag expression of `Database.sample_urls`
+    :return: a list of tuples with a division, a url row and a list of tags
+    """
+    dbs = {division: open_db(division) for division in divisions}
+    try:
+        counts = []
+        for division, db in dbs.items():
+            status, count = db.count_urls(**filters)
+            if not status:
+                raise RuntimeError(count)
+            counts.append((division, count))
+
+        total = sum(count for _, count in counts)
+        picks, start = sample(range(total), min(k, total)), 0
+        urls = []
+        for division, count in counts:
+            n = sum(1 for pick in picks if start <= pick < start + count)
+            start += count
+            if n:
+                status, sampled = dbs[division].sample_urls(n, **filters)
+                if not status:
+                    raise RuntimeError(sampled)
+                urls += [(division, url, tags) for url, tags in sampled]
+        return sample(urls, len(urls))
+    finally:
+        for db in dbs.values():
+            db.close()
@@ -0,0 +1,254 @@
+import codecs
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, List, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from .checker import USER_AGENT
+from .database import batched
+
+# Bytes of a page read at most to find the end of its head
+HEAD_LIMIT = 65536
+CHUNK_SIZE = 8192
+MAX_REDIRECTS = 5
+MAX_LENGTH = 500
+
+
+class HeadParser(HTMLParser):
+    """Collects a title and a description out of a html head, until the body
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.done = False
+        self.meta = {}
+        self._title = None
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and self._title is None:
+            self._title, self._in_title = [], True
+        elif tag == "meta":
+            attrs = dict(attrs)
+            name = (attrs.get("name") or attrs.get("property") or "").lower()
+            if name in ("description", "og:description", "og:title"):
+                self.meta.setdefault(name, attrs.get("content"))
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._title.append(data)
+
+    @property
+    def title(self) -> str:
+        return clean("".join(self._title) if self._title else self.meta.get("og:title"))
+
+    @property
+    def description(self) -> str:
+        return clean(self.meta.get("description") or self.meta.get("og:description"))
+
+
+def clean(text: str) -> str:
+    """Collapse whitespaces of a text and cut it to `MAX_LENGTH`
+
+    :param str text: a text or None
+    :return: a cleaned text or None if it is empty
+    """
+    return " ".join((text or "").split())[:MAX_LENGTH] or None
+
+
+def parse_head(response: http.client.HTTPResponse) -> Tuple[str, str]:
+    """Stream-parse a html response until the end of its head, so the rest of
+    the page is never read
+
+    :param response: a response with a html body
+    :return: a tuple with a title and a description
+    """
+    charset = response.headers.get_content_charset() or "utf-8"
+    try:
+        decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser, size = HeadParser(), 0
+    while not parser.done and size < HEAD_LIMIT:
+        chunk = response.read1(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        parser.feed(decoder.decode(chunk))
+    return parser.title, parser.description
+
+
+class Session:
+    """Reuses a keep-alive connection per host for requests of a worker
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.connections = {}
+
+    def get(self, url: str, headers: Dict) -> http.client.HTTPResponse:
+        """Sends a GET request over the connection to the host of a url, opening
+        it again if the server has closed it since the last request
+
+        :param str url: a url to request
+        :param dict headers: request headers
+        :exception: ValueError when the scheme is not http or https
+        :return: a response of which only headers are read
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported scheme: {parts.scheme}")
+        key = (parts.scheme, parts.netloc)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        while True:
+            connection = self.connections.get(key)
+            reused = connection is not None
+            if not reused:
+                connection_class = (
+                    http.client.HTTPSConnection
+                    if parts.scheme == "https"
+                    else http.client.HTTPConnection
+                )
+                connection = connection_class(parts.netloc, timeout=self.timeout)
+                self.connections[key] = connection
+            try:
+                connection.request("GET", path, headers=headers)
+                return connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                self.discard(url)
+                if not reused:
+                    raise
+
+    def release(self, url: str, response: http.client.HTTPResponse):
+        """Finishes a response, keeping its connection for the next request only
+        if the rest of the body is short enough to read it out
+
+        :param str url: a requested url
+        :param response: a response of the url
+        """
+        if response.will_close or response.length is None:
+            self.discard(url)
+        elif response.length <= HEAD_LIMIT:
+            response.read()
+        else:
+            self.discard(url)
+
+    def discard(self, url: str):
+        parts = urlsplit(url)
+        connection = self.connections.pop((parts.scheme, parts.netloc), None)
+        if connection:
+            connection.close()
+
+    def close(self):
+        for connection in self.connections.values():
+            connection.close()
+        self.connections.clear()
+
+
+def fetch(session: Session, url: str, etag: str, last_modified: str) -> tuple:
+    """Fetch a title and a description of a page, sending validators of the last
+    fetch so an unmodified page is not sent again
+
+    :param session: a session of the worker
+    :param str url: a url of the page
+    :param str etag: an etag of the last fetch or None
+    :param str last_modified: a last modified date of the last fetch or None
+    :return: a tuple with a http status or None, a title, a description, an etag
+        and a last modified date
+    """
+    headers = {"User-Agent": USER_AGENT, "Accept": "text/html"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            response = session.get(url, headers)
+            location = response.getheader("Location")
+            if response.status not in (301, 302, 303, 307, 308) or not location:
+                break
+            session.release(url, response)
+            url = urljoin(url, location)
+
+        title = description = None
+        if response.status == 200 and response.getheader(
+            "Content-Type", ""
+        ).startswith("text/html"):
+            title, description = parse_head(response)
+        session.release(url, response)
+        return (
+            response.status,
+            title,
+            description,
+            response.getheader("ETag"),
+            response.getheader("Last-Modified"),
+        )
+    except Exception:  # connection errors, timeouts and malformed responses
+        session.discard(url)
+        return None, None, None, etag, last_modified
+
+
+def fetch_all(rows: List[tuple], timeout: float) -> List[tuple]:
+    """Fetch pages of urls in order over connections reused per host
+
+    :param list rows: tuples with a url id, a url, an etag and a last modified
+    :param float timeout: seconds to wait for connecting and every read
+    :return: a list of tuples with a url id, a http status, a title, a
+        description, an etag, a last modified date and a fetched date
+    """
+    session = Session(timeout)
+    try:
+        return [
+            (
+                url_id,
+                *fetch(session, url, etag, last_modified),
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            )
+            for url_id, url, etag, last_modified in rows
+        ]
+    finally:
+        session.close()
+
+
+def enrich_urls(
+    rows: Iterable[tuple],
+    save: Callable[[List[tuple]], None],
+    concurrency: int = 8,
+    timeout: float = 10.0,
+    batch_size: int = 200,
+) -> int:
+    """Fetch page metadata of urls in a thread pool. Urls are taken in batches,
+    grouped by host so each host is fetched in turn over one connection, and the
+    results of every batch are handed to `save` at once.
+
+    :param rows: an iterable of tuples with a url id, a url, an etag and a last
+        modified date
+    :param save: a callable taking a list of results of `fetch_all`
+    :param int concurrency: a maximum number of hosts fetched at once
+    :param float timeout: seconds to wait for a response
+    :param int batch_size: a number of urls fetched and saved at once
+    :return: a number of fetched urls
+    """
+    count = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for batch in batched(rows, batch_size):
+            hosts = {}
+            for row in batch:
+                hosts.setdefault(urlsplit(row[1]).netloc.lower(), []).append(row)
+            futures = [
+                executor.submit(fetch_all, group, timeout) for group in hosts.values()
+            ]
+            results = [result for future in futures for result in future.result()]
+            save(results)
+            count += len(results)
+    return count
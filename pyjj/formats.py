@@ -0,0 +1,249 @@
+import csv
+import gzip
+import json
+import os
+from datetime import datetime
+from html import escape
+from html.parser import HTMLParser
+from typing import IO, Dict, Iterable, Iterator, List
+
+FORMATS = ("html", "csv", "jsonl")
+
+EXTENSIONS = {".html": "html", ".htm": "html", ".csv": "csv", ".jsonl": "jsonl"}
+
+
+def guess_format(path: str) -> str:
+    """Guess a bookmark file format from its extension, ignoring `.gz`
+
+    :param str path: a path of the bookmark file
+    :exception: ValueError when the format cannot be guessed
+    :return: one of `FORMATS`
+    """
+    root, ext = os.path.splitext(path.lower())
+    if ext == ".gz":
+        root, ext = os.path.splitext(root)
+    if ext not in EXTENSIONS:
+        raise ValueError(f"Unknown bookmark format: {path}")
+    return EXTENSIONS[ext]
+
+
+def open_text(path: str, mode: str = "r") -> IO:
+    """Open a text file, which is transparently (de)compressed if it ends with `.gz`
+
+    :param str path: a path of the file
+    :param str mode: `r` or `w`
+    :return: a file object in text mode
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, f"{mode}t", encoding="utf8", newline="")
+    return open(path, mode, encoding="utf8", newline="")
+
+
+def parse_tags(tags) -> List[str]:
+    """Normalize tags given as a comma-separated string, a json array or a list
+
+    :param tags: a comma-separated string, a json array of tags as csv exports
+        hold them, a list of tags or None
+    :return: a list of non-empty tags
+    """
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        try:
+            # A json array keeps tags with commas, which a comma split breaks up
+            loaded = json.loads(tags) if tags.lstrip().startswith("[") else None
+        except ValueError:
+            loaded = None
+        tags = loaded if isinstance(loaded, list) else tags.split(",")
+    return [tag.strip() for tag in tags if isinstance(tag, str) and tag.strip()]
+
+
+def from_timestamp(timestamp: str) -> str:
+    """Convert a unix timestamp used by browsers to a database date string
+
+    :param str timestamp: seconds since epoch
+    :return: a date string or None if the timestamp is not valid
+    """
+    try:
+        return datetime.fromtimestamp(int(timestamp)).strftime("%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def to_timestamp(date: str) -> str:
+    """Convert a database date string to a unix timestamp used by browsers
+
+    :param str date: a date string
+    :return: seconds since epoch or an empty string if the date is not valid
+    """
+    try:
+        return str(int(datetime.strptime(date, "%Y-%m-%d %H:%M:%S").timestamp()))
+    except (TypeError, ValueError):
+        return ""
+
+
+def bookmark(url: str, tags=None, created_at: str = None) -> Dict:
+    """Returns a bookmark entry shared by readers and writers
+
+    :param str url: a url
+    :param tags: tags in any form `parse_tags` takes
+    :param str created_at: a date string
+    :return: a dict with `url`, `tags` and `created_at`
+    """
+    return {
+        "url": (url or "").strip(),
+        "tags": parse_tags(tags),
+        "created_at": created_at,
+    }
+
+
+class NetscapeParser(HTMLParser):
+    """Incremental parser of the Netscape bookmark file format exported by browsers
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        attrs = dict(attrs)
+        if attrs.get("href"):
+            self.entries.append(
+                bookmark(
+                    attrs["href"],
+                    attrs.get("tags"),
+                    from_timestamp(attrs.get("add_date")),
+                )
+            )
+
+
+def read_html(file: IO, chunk_size: int = 65536) -> Iterator[Dict]:
+    """Read a Netscape bookmark file exported by browsers, chunk by chunk
+
+    :param file: a file object in text mode
+    :param int chunk_size: a number of characters parsed at once
+    :return: an iterator of bookmark entries
+    """
+    parser = NetscapeParser()
+    for chunk in iter(lambda: file.read(chunk_size), ""):
+        parser.feed(chunk)
+        yield from parser.entries
+        parser.entries.clear()
+    parser.close()
+    yield from parser.entries
+
+
+def read_csv(file: IO) -> Iterator[Dict]:
+    """Read a csv file with a header of `url`, `tags` and `created_at`
+
+    :param file: a file object in text mode
+    :return: an iterator of bookmark entries
+    """
+    for row in csv.DictReader(file):
+        yield bookmark(row.get("url"), row.get("tags"), row.get("created_at") or None)
+
+
+def read_jsonl(file: IO) -> Iterator[Dict]:
+    """Read a file of json objects with `url`, `tags` and `created_at`, one per line
+
+    :param file: a file object in text mode
+    :return: an iterator of bookmark entries
+    """
+    for line in file:
+        if line.strip():
+            row = json.loads(line)
+            yield bookmark(row.get("url"), row.get("tags"), row.get("created_at"))
+
+
+READERS = {"html": read_html, "csv": read_csv, "jsonl": read_jsonl}
+
+
+def read_bookmarks(file: IO, fmt: str) -> Iterator[Dict]:
+    """Stream bookmark entries out of a file without loading it in memory
+
+    :param file: a file object in text mode
+    :param str fmt: one of `FORMATS`
+    :return: an iterator of bookmark entries
+    """
+    return READERS[fmt](file)
+
+
+def write_html(file: IO, urls: Iterable[tuple], skipped: list = None) -> int:
+    """Write urls as a Netscape bookmark file, which browsers import. Tags are
+    comma-separated in the file, so tags with a comma are left out.
+
+    :param file: a file object in text mode
+    :param urls: an iterable of tuples with a url row and a list of tags
+    :param list skipped: a list collecting tuples of a url and a tag left out
+    :return: a number of written urls
+    """
+    file.write(
+        "<!DOCTYPE NETSCAPE-Bookmark-file-1>\n"
+        '<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">\n'
+        "<TITLE>Bookmarks</TITLE>\n<H1>Bookmarks</H1>\n<DL><p>\n"
+    )
+    count = 0
+    for count, (url, tags) in enumerate(urls, 1):
+        href = escape(url[1])
+        if any("," in tag for tag in tags):
+            if skipped is not None:
+                skipped.extend((url[1], tag) for tag in tags if "," in tag)
+            tags = [tag for tag in tags if "," not in tag]
+        file.write(
+            f'    <DT><A HREF="{href}" ADD_DATE="{to_timestamp(url[2])}" '
+            f'TAGS="{escape(",".join(tags))}">{href}</A>\n'
+        )
+    file.write("</DL><p>\n")
+    return count
+
+
+def write_csv(file: IO, urls: Iterable[tuple]) -> int:
+    """Write urls as csv rows of a url, a json array of tags and a created date
+
+    :param file: a file object in text mode
+    :param urls: an iterable of tuples with a url row and a list of tags
+    :return: a number of written urls
+    """
+    writer = csv.writer(file)
+    writer.writerow(("url", "tags", "created_at"))
+    count = 0
+    for count, (url, tags) in enumerate(urls, 1):
+        writer.writerow((url[1], json.dumps(tags), url[2]))
+    return count
+
+
+def write_jsonl(file: IO, urls: Iterable[tuple]) -> int:
+    """Write urls as json objects with a url, a list of tags and a created date,
+    one per line
+
+    :param file: a file object in text mode
+    :param urls: an iterable of tuples with a url row and a list of tags
+    :return: a number of written urls
+    """
+    count = 0
+    for count, (url, tags) in enumerate(urls, 1):
+        file.write(json.dumps({"url": url[1], "tags": tags, "created_at": url[2]}))
+        file.write("\n")
+    return count
+
+
+WRITERS = {"html": write_html, "csv": write_csv, "jsonl": write_jsonl}
+
+
+def write_bookmarks(
+    file: IO, urls: Iterable[tuple], fmt: str, skipped: list = None
+) -> int:
+    """Stream urls into a file as they are read, in a format `read_bookmarks` reads
+
+    :param file: a file object in text mode
+    :param urls: an iterable of tuples with a url row and a list of tags
+    :param str fmt: one of `FORMATS`
+    :param list skipped: a list collecting tuples of a url and a tag which the
+        format can't hold, and which are left out
+    :return: a number of written urls
+    """
+    if fmt == "html":
+        return write_html(file, urls, skipped)
+    return WRITERS[fmt](file, urls)
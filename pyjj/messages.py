@@ -8,6 +8,18 @@ class Colors:
     ORANGE = "\u001b[38;5;208m"
 
 
+COLORS = {name: getattr(Colors, name) for name in ("RED", "GREEN", "YELLOW", "ORANGE")}
+
+
+def set_color(enabled: bool) -> None:
+    """Turn colors of messages on or off, e.g. off when stdout is not a terminal
+
+    :param bool enabled: whether messages are colorized
+    """
+    for name, code in COLORS.items():
+        setattr(Colors, name, code if enabled else "")
+
+
 def msg(status: bool, message: str) -> str:
     """Return a colorize string depends on the status
 
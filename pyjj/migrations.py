@@ -0,0 +1,463 @@
+import sqlite3
+from typing import Dict, List
+
+from .utils import url_hash
+
+
+def generate_create_sqls(tbl_name: str, columns: List[tuple], keys: Dict) -> str:
+    """
+    tbl_name: string a table name after pyjj_{tbl_name}
+    columns: list of tuples (column_name, data_type, options)
+    keys: dict of keys key: (columns, options)
+    """
+    assert tbl_name
+    column_stmt = ",".join(f"{key} {val} {opt}" for key, val, opt in columns)
+    key_stmt = (
+        ","
+        + ",".join(
+            f"{key} ({','.join(value[0])}) {value[1]}" for key, value in keys.items()
+        )
+        if keys
+        else ""
+    )
+    return f"CREATE TABLE IF NOT EXISTS pyjj_{tbl_name} ({column_stmt} {key_stmt});"
+
+
+# Columns of urls in the search index, followed by tags
+SEARCH_COLUMNS = ("url", "title", "description")
+
+SEARCH_TRIGGERS = (
+    "url_insert",
+    "url_update",
+    "url_delete",
+    "tag_insert",
+    "tag_delete",
+    "tag_rename",
+)
+
+
+def generate_search_sqls(division: str, columns=SEARCH_COLUMNS) -> List[str]:
+    """
+    division: string a division name
+    columns: tuple of url columns indexed along with tags
+    Returns sqls creating a FTS5 index pyjj_{division}_search over urls and tags,
+    kept in sync with urls, tags and url_tags by triggers.
+    """
+    assert division
+    urls, tags, url_tags, search = (
+        f"pyjj_{division}_{name}" for name in ("urls", "tags", "url_tags", "search")
+    )
+    url_tags_of = (
+        f"(SELECT GROUP_CONCAT(C.tag, ' ') FROM {url_tags} AS B "
+        f"INNER JOIN {tags} AS C ON B.tag_id=C.id WHERE B.url_id={{}})"
+    )
+    names = ", ".join(columns)
+    values = ", ".join(f"new.{column}" for column in columns)
+    updates = ", ".join(f"{column}=new.{column}" for column in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {search} USING fts5({names}, tags);",
+        f"""CREATE TRIGGER IF NOT EXISTS {search}_url_insert AFTER INSERT ON {urls}
+        BEGIN INSERT INTO {search} (rowid, {names}, tags)
+        VALUES (new.id, {values}, ''); END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {search}_url_update
+        AFTER UPDATE OF {names} ON {urls}
+        BEGIN UPDATE {search} SET {updates} WHERE rowid=new.id; END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {search}_url_delete AFTER DELETE ON {urls}
+        BEGIN DELETE FROM {search} WHERE rowid=old.id; END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {search}_tag_insert AFTER INSERT ON {url_tags}
+        BEGIN UPDATE {search} SET tags={url_tags_of.format("new.url_id")}
+        WHERE rowid=new.url_id; END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {search}_tag_delete AFTER DELETE ON {url_tags}
+        BEGIN UPDATE {search} SET tags={url_tags_of.format("old.url_id")}
+        WHERE rowid=old.url_id; END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {search}_tag_rename
+        AFTER UPDATE OF tag ON {tags}
+        BEGIN UPDATE {search} SET tags={url_tags_of.format(f"{search}.rowid")}
+        WHERE rowid IN (SELECT url_id FROM {url_tags} WHERE tag_id=new.id); END;""",
+    ]
+
+
+def generate_drop_search_sqls(division: str) -> List[str]:
+    """
+    division: string a division name
+    Returns sqls dropping pyjj_{division}_search and its triggers.
+    """
+    assert division
+    return [
+        f"DROP TRIGGER IF EXISTS pyjj_{division}_search_{name};"
+        for name in SEARCH_TRIGGERS
+    ] + [f"DROP TABLE IF EXISTS pyjj_{division}_search;"]
+
+
+def generate_rebuild_search_sqls(division: str, columns=SEARCH_COLUMNS) -> List[str]:
+    """
+    division: string a division name
+    columns: tuple of url columns indexed along with tags
+    Returns sqls refilling pyjj_{division}_search from urls and tags.
+    """
+    assert division
+    names = ", ".join(columns)
+    values = ", ".join(f"A.{column}" for column in columns)
+    return [
+        f"DELETE FROM pyjj_{division}_search;",
+        f"""INSERT INTO pyjj_{division}_search (rowid, {names}, tags)
+        SELECT A.id, {values}, COALESCE(GROUP_CONCAT(C.tag, ' '), '')
+        FROM pyjj_{division}_urls AS A
+        LEFT JOIN pyjj_{division}_url_tags AS B ON A.id=B.url_id
+        LEFT JOIN pyjj_{division}_tags AS C ON B.tag_id=C.id
+        GROUP BY A.id;""",
+    ]
+
+
+# SQLite version adding the FTS5 trigram tokenizer
+TRIGRAM_SQLITE = (3, 34, 0)
+
+# Trigram indexes of fuzzy lookups, by the table and the column they index
+FUZZY_INDEXES = {"urls": "url", "tags": "tag"}
+
+
+def fuzzy_text_sql(column: str) -> str:
+    """
+    column: string a column of urls
+    Returns a sql expression of the host and the path of urls in the column, which
+    are what is remembered of a url: the scheme, the query and the fragment are cut.
+    """
+    rest = (
+        f"substr({column}, instr({column}, '://') + "
+        f"CASE WHEN instr({column}, '://') THEN 3 ELSE 1 END)"
+    )
+    for separator in ("?", "#"):
+        rest = (
+            f"CASE WHEN instr({rest}, '{separator}') "
+            f"THEN substr({rest}, 1, instr({rest}, '{separator}') - 1) ELSE {rest} END"
+        )
+    return rest
+
+
+def generate_fuzzy_sqls(division: str) -> List[str]:
+    """
+    division: string a division name
+    Returns sqls creating FTS5 trigram indexes pyjj_{division}_fuzzy_urls over
+    hosts and paths of urls and pyjj_{division}_fuzzy_tags over tag names, with
+    fts5vocab tables counting urls or tags of every trigram, kept in sync by
+    triggers.
+    """
+    assert division
+    sqls = []
+    for name, column in FUZZY_INDEXES.items():
+        table, fuzzy = f"pyjj_{division}_{name}", f"pyjj_{division}_fuzzy_{name}"
+        new = fuzzy_text_sql(f"new.{column}") if name == "urls" else f"new.{column}"
+        sqls += [
+            f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fuzzy}
+            USING fts5(text, tokenize='trigram');""",
+            f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fuzzy}_vocab
+            USING fts5vocab({fuzzy}, row);""",
+            f"""CREATE TRIGGER IF NOT EXISTS {fuzzy}_insert AFTER INSERT ON {table}
+            BEGIN INSERT INTO {fuzzy} (rowid, text) VALUES (new.id, {new}); END;""",
+            f"""CREATE TRIGGER IF NOT EXISTS {fuzzy}_update
+            AFTER UPDATE OF {column} ON {table}
+            BEGIN UPDATE {fuzzy} SET text={new} WHERE rowid=new.id; END;""",
+            f"""CREATE TRIGGER IF NOT EXISTS {fuzzy}_delete AFTER DELETE ON {table}
+            BEGIN DELETE FROM {fuzzy} WHERE rowid=old.id; END;""",
+        ]
+    return sqls
+
+
+def generate_rebuild_fuzzy_sqls(division: str) -> List[str]:
+    """
+    division: string a division name
+    Returns sqls refilling the trigram indexes of a division from urls and tags.
+    """
+    assert division
+    sqls = []
+    for name, column in FUZZY_INDEXES.items():
+        text = fuzzy_text_sql(column) if name == "urls" else column
+        sqls += [
+            f"DELETE FROM pyjj_{division}_fuzzy_{name};",
+            f"""INSERT INTO pyjj_{division}_fuzzy_{name} (rowid, text)
+            SELECT id, {text} FROM pyjj_{division}_{name};""",
+        ]
+    return sqls
+
+
+def create_tables(cursor: sqlite3.Cursor, division: str) -> None:
+    """Version 1: urls, tags and the url_tags join table"""
+    default_table_urls = {
+        "tbl_name": f"{division}_urls",
+        "columns": [
+            ("id", "INTEGER", "PRIMARY KEY AUTOINCREMENT"),
+            ("url", "TEXT", "UNIQUE NOT NULL"),
+            ("created_at", "DATE", "DEFAULT(datetime('now', 'localtime'))"),
+        ],
+        "keys": {},
+    }
+    default_table_tags = {
+        "tbl_name": f"{division}_tags",
+        "columns": [
+            ("id", "INTEGER", "PRIMARY KEY AUTOINCREMENT"),
+            ("tag", "TEXT", "UNIQUE NOT NULL"),
+            ("created_at", "DATE", "DEFAULT(datetime('now', 'localtime'))"),
+        ],
+        "keys": {},
+    }
+    default_table_url_tags = {
+        "tbl_name": f"{division}_url_tags",
+        "columns": [
+            ("url_id", "INTEGER", "NOT NULL"),
+            ("tag_id", "INTEGER", "NOT NULL"),
+        ],
+        "keys": {
+            f"FOREIGN KEY (url_id) REFERENCES pyjj_{division}_urls": (
+                ["id"],
+                "ON DELETE CASCADE",
+            ),
+            f"FOREIGN KEY (tag_id) REFERENCES pyjj_{division}_tags": (
+                ["id"],
+                "ON DELETE CASCADE",
+            ),
+        },
+    }
+    for sql in (
+        generate_create_sqls(**default_table_urls),
+        generate_create_sqls(**default_table_tags),
+        generate_create_sqls(**default_table_url_tags),
+    ):
+        cursor.execute(sql)
+
+
+def create_search_index(cursor: sqlite3.Cursor, division: str) -> None:
+    """Version 2: FTS5 index over urls and tags"""
+    # Triggers look tags of a url up, which would scan url_tags without it
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS pyjj_{division}_url_tags_url_id "
+        f"ON pyjj_{division}_url_tags (url_id);"
+    )
+    columns = ("url",)  # columns of page metadata are indexed from version 5
+    sqls = generate_search_sqls(division, columns)
+    for sql in sqls + generate_rebuild_search_sqls(division, columns):
+        cursor.execute(sql)
+
+
+def index_url_tags(cursor: sqlite3.Cursor, division: str) -> None:
+    """Version 3: unique url/tag pairs and indexes for tag filters and dates"""
+    urls, url_tags = f"pyjj_{division}_urls", f"pyjj_{division}_url_tags"
+    for sql in (
+        # Drop orphans left while foreign keys were not enforced and duplicate pairs
+        f"DELETE FROM {url_tags} WHERE url_id NOT IN (SELECT id FROM {urls});",
+        f"""DELETE FROM {url_tags} WHERE rowid NOT IN
+        (SELECT MIN(rowid) FROM {url_tags} GROUP BY url_id, tag_id);""",
+        # Covers lookups by url_id as well
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {url_tags}_pair ON {url_tags} "
+        "(url_id, tag_id);",
+        f"DROP INDEX IF EXISTS {url_tags}_url_id;",
+        f"CREATE INDEX IF NOT EXISTS {url_tags}_tag_id ON {url_tags} (tag_id);",
+        f"CREATE INDEX IF NOT EXISTS {urls}_created_at ON {urls} (created_at);",
+    ):
+        cursor.execute(sql)
+
+
+def create_checks(cursor: sqlite3.Cursor, division: str) -> None:
+    """Version 4: results of the latest link check of every url"""
+    default_table_checks = {
+        "tbl_name": f"{division}_checks",
+        "columns": [
+            ("url_id", "INTEGER", "PRIMARY KEY"),
+            ("status", "INTEGER", ""),
+            ("final_url", "TEXT", ""),
+            ("error", "TEXT", ""),
+            ("checked_at", "DATE", "NOT NULL"),
+        ],
+        "keys": {
+            f"FOREIGN KEY (url_id) REFERENCES pyjj_{division}_urls": (
+                ["id"],
+                "ON DELETE CASCADE",
+            ),
+        },
+    }
+    cursor.execute(generate_create_sqls(**default_table_checks))
+
+
+def add_metadata(cursor: sqlite3.Cursor, division: str) -> None:
+    """Version 5: page metadata of urls, indexed for search"""
+    for column in ("title", "description", "etag", "last_modified", "fetched_at"):
+        cursor.execute(
+            f"ALTER TABLE pyjj_{division}_urls ADD COLUMN {column} "
+            f"{'DATE' if column == 'fetched_at' else 'TEXT'}"
+        )
+    for sql in (
+        generate_drop_search_sqls(division)
+        + generate_search_sqls(division)
+        + generate_rebuild_search_sqls(division)
+    ):
+        cursor.execute(sql)
+
+
+def hash_urls(cursor: sqlite3.Cursor, division: str) -> None:
+    """Version 6: indexed hashes of canonical urls for duplicate lookups"""
+    urls = f"pyjj_{division}_urls"
+    cursor.execute(f"ALTER TABLE {urls} ADD COLUMN url_hash INTEGER")
+    # Hashed with the default tracking parameters; see `Database.rehash_urls`
+    cursor.connection.create_function("pyjj_url_hash", 1, url_hash)
+    cursor.execute(f"UPDATE {urls} SET url_hash=pyjj_url_hash(url)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {urls}_url_hash ON {urls} (url_hash)")
+
+
+def count_tags(cursor: sqlite3.Cursor, division: str) -> None:
+    """Version 7: numbers of urls of every tag, kept up to date by triggers"""
+    tags, url_tags = f"pyjj_{division}_tags", f"pyjj_{division}_url_tags"
+    increment, decrement = (
+        f"UPDATE {tags} SET usage_count=usage_count{change} WHERE id={{}}.tag_id;"
+        for change in ("+1", "-1")
+    )
+    for sql in (
+        f"ALTER TABLE {tags} ADD COLUMN usage_count INTEGER NOT NULL DEFAULT 0",
+        f"""UPDATE {tags} SET usage_count=
+        (SELECT COUNT(*) FROM {url_tags} WHERE tag_id={tags}.id);""",
+        f"CREATE INDEX IF NOT EXISTS {tags}_usage_count ON {tags} (usage_count);",
+        # Deletes cascaded from urls and tags fire these as well
+        f"""CREATE TRIGGER IF NOT EXISTS {tags}_count_insert AFTER INSERT ON {url_tags}
+        BEGIN {increment.format("new")} END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {tags}_count_delete AFTER DELETE ON {url_tags}
+        BEGIN {decrement.format("old")} END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {tags}_count_update
+        AFTER UPDATE OF tag_id ON {url_tags}
+        BEGIN {decrement.format("old")} {increment.format("new")} END;""",
+    ):
+        cursor.execute(sql)
+
+
+def has_trigram_tokenizer() -> bool:
+    """Whether SQLite has the FTS5 trigram tokenizer, which fuzzy indexes need"""
+    return sqlite3.sqlite_version_info >= TRIGRAM_SQLITE
+
+
+def create_fuzzy_index(cursor: sqlite3.Cursor, division: str) -> None:
+    """Version 8: trigram indexes of urls and tags for fuzzy lookups. It is skipped
+    on SQLite without the trigram tokenizer, where lookups scan urls and tags
+    instead; `Database.rebuild_search_index` creates them once it is upgraded.
+    """
+    if not has_trigram_tokenizer():
+        return
+    sqls = generate_fuzzy_sqls(division) + generate_rebuild_fuzzy_sqls(division)
+    for sql in sqls:
+        cursor.execute(sql)
+
+
+def generate_change_log_sqls(division: str) -> List[str]:
+    """
+    division: string a division name
+    Returns sqls creating pyjj_{division}_changes, a log of urls and url/tag pairs
+    that changed, by url text and tag name as ids differ between machines. Only
+    keys are logged; their current state is read when changes are exported.
+    """
+    assert division
+    urls, tags, url_tags, changes = (
+        f"pyjj_{division}_{name}" for name in ("urls", "tags", "url_tags", "changes")
+    )
+    pairs_of_tag = (
+        f"INSERT INTO {changes} (url, tag) SELECT A.url, {{}} FROM {url_tags} AS B "
+        f"INNER JOIN {urls} AS A ON A.id=B.url_id WHERE B.tag_id={{}};"
+    )
+    pair = (
+        f"INSERT INTO {changes} (url, tag) SELECT A.url, T.tag FROM {urls} AS A, "
+        f"{tags} AS T WHERE A.id={{0}}.url_id AND T.id={{0}}.tag_id;"
+    )
+    return [
+        f"""CREATE TABLE IF NOT EXISTS {changes} (seq INTEGER PRIMARY KEY
+        AUTOINCREMENT, url TEXT NOT NULL, tag TEXT);""",
+        f"""CREATE TRIGGER IF NOT EXISTS {changes}_url_insert AFTER INSERT ON {urls}
+        BEGIN INSERT INTO {changes} (url) VALUES (new.url); END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {changes}_url_update
+        AFTER UPDATE OF url, created_at, title, description ON {urls}
+        BEGIN INSERT INTO {changes} (url) VALUES (new.url); END;""",
+        # Tags of an edited url are logged under its new url
+        f"""CREATE TRIGGER IF NOT EXISTS {changes}_url_rename AFTER UPDATE OF url
+        ON {urls} WHEN old.url IS NOT new.url
+        BEGIN INSERT INTO {changes} (url) VALUES (old.url);
+        INSERT INTO {changes} (url, tag) SELECT new.url, T.tag FROM {url_tags} AS B
+        INNER JOIN {tags} AS T ON T.id=B.tag_id WHERE B.url_id=new.id; END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {changes}_url_delete AFTER DELETE ON {urls}
+        BEGIN INSERT INTO {changes} (url) VALUES (old.url); END;""",
+        # Pairs deleted by cascades are gone with their urls or logged below
+        f"""CREATE TRIGGER IF NOT EXISTS {changes}_tag_insert
+        AFTER INSERT ON {url_tags} BEGIN {pair.format("new")} END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {changes}_tag_delete
+        AFTER DELETE ON {url_tags} BEGIN {pair.format("old")} END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {changes}_tag_update AFTER UPDATE ON {url_tags}
+        BEGIN {pair.format("old")} {pair.format("new")} END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {changes}_tag_remove BEFORE DELETE ON {tags}
+        BEGIN {pairs_of_tag.format("old.tag", "old.id")} END;""",
+        f"""CREATE TRIGGER IF NOT EXISTS {changes}_tag_rename AFTER UPDATE OF tag
+        ON {tags} WHEN old.tag IS NOT new.tag
+        BEGIN {pairs_of_tag.format("old.tag", "new.id")}
+        {pairs_of_tag.format("new.tag", "new.id")} END;""",
+    ]
+
+
+def log_changes(cursor: sqlite3.Cursor, division: str) -> None:
+    """Version 9: a change log of urls and tags for syncing divisions"""
+    urls, tags, url_tags, changes = (
+        f"pyjj_{division}_{name}" for name in ("urls", "tags", "url_tags", "changes")
+    )
+    for sql in generate_change_log_sqls(division) + [
+        # Existing urls and tags are logged once, so a first sync exports them
+        f"INSERT INTO {changes} (url) SELECT url FROM {urls} ORDER BY id;",
+        f"""INSERT INTO {changes} (url, tag) SELECT A.url, T.tag FROM {url_tags} AS B
+        INNER JOIN {urls} AS A ON A.id=B.url_id
+        INNER JOIN {tags} AS T ON T.id=B.tag_id ORDER BY B.url_id;""",
+    ]:
+        cursor.execute(sql)
+
+
+# A migration at index i upgrades a division from version i to i + 1
+MIGRATIONS = [
+    create_tables,
+    create_search_index,
+    index_url_tags,
+    create_checks,
+    add_metadata,
+    hash_urls,
+    count_tags,
+    create_fuzzy_index,
+    log_changes,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(connection: sqlite3.Connection) -> int:
+    """Returns a schema version of the database, stored in `PRAGMA user_version`
+
+    :param connection: a connection to the database
+    :return: the schema version
+    """
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection: sqlite3.Connection, division: str) -> int:
+    """Upgrade a division in place to the latest schema version. Pending
+    migrations run in a single transaction, so a failure leaves it untouched.
+
+    :param connection: a connection to the database
+    :param str division: a division name
+    :return: a number of applied migrations
+    """
+    version = get_version(connection)
+    if version >= SCHEMA_VERSION:
+        return 0
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        # Another process may have migrated while this one waited for the lock
+        version = get_version(connection)
+        for migration in MIGRATIONS[version:]:
+            migration(cursor, division)
+        cursor.execute(f"PRAGMA user_version={max(version, SCHEMA_VERSION)}")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    return SCHEMA_VERSION - version
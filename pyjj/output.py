@@ -0,0 +1,116 @@
+import json
+from itertools import islice
+from typing import IO, Iterable, Iterator, List
+
+# Formats of command output; `table` is for people and the others for tools
+OUTPUT_FORMATS = ("table", "json", "jsonl", "tsv")
+
+URL_FIELDS = ("id", "url", "tags", "created_at", "title")
+
+TAG_FIELDS = ("id", "tag", "created_at", "usage_count")
+
+# Lines joined into a single write
+CHUNK_SIZE = 1024
+
+
+def write_lines(stream: IO, lines: Iterable[str]) -> None:
+    """Write lines in chunks and flush once, instead of a write and a flush per
+    line as `click.echo` does
+
+    :param stream: a file object in text mode
+    :param lines: an iterable of lines ending with newlines
+    """
+    lines = iter(lines)
+    chunk = "".join(islice(lines, CHUNK_SIZE))
+    while chunk:
+        stream.write(chunk)
+        chunk = "".join(islice(lines, CHUNK_SIZE))
+    stream.flush()
+
+
+def tsv_field(value) -> str:
+    """Returns a value as a tsv field; lists are comma-separated, and tabs and
+    newlines are replaced by spaces
+
+    :param value: a value of a record
+    :return: a string
+    """
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        value = ",".join(value)
+    return str(value).replace("\t", " ").replace("\n", " ").replace("\r", " ")
+
+
+def record_lines(records: Iterable[dict], fmt: str, fields: List[str]) -> Iterator[str]:
+    """Yields lines of records in a machine-readable format as they come, so
+    even a json array is never held in memory
+
+    :param records: an iterable of dicts
+    :param str fmt: one of `OUTPUT_FORMATS` but `table`
+    :param list fields: keys of records, in the order of tsv columns
+    :return: an iterator of lines
+    """
+    dumps = json.JSONEncoder(ensure_ascii=False).encode
+    if fmt == "jsonl":
+        for record in records:
+            yield dumps(record) + "\n"
+    elif fmt == "json":
+        yield "["
+        separator = "\n"
+        for record in records:
+            yield separator + dumps(record)
+            separator = ",\n"
+        yield "\n]\n"
+    elif fmt == "tsv":
+        yield "\t".join(fields) + "\n"
+        for record in records:
+            yield "\t".join([tsv_field(record[field]) for field in fields]) + "\n"
+    else:
+        raise ValueError(f"Unknown output format: {fmt}")
+
+
+def url_record(item: tuple, divisions: bool = False) -> dict:
+    """Returns a record of a url
+
+    :param tuple item: a url row and a list of tags, preceded by a division if
+        `divisions` is given
+    :param bool divisions: whether urls come from many divisions
+    :return: a dict of `URL_FIELDS`, and `division` if `divisions` is given
+    """
+    division, (url, tags) = (item[0], item[1:]) if divisions else (None, item)
+    record = {
+        "id": url[0],
+        "url": url[1],
+        "tags": tags,
+        "created_at": url[2],
+        "title": url[3],
+    }
+    return {"division": division, **record} if divisions else record
+
+
+def format_urls(
+    urls: Iterable[tuple], fmt: str, divisions: bool = False
+) -> Iterator[str]:
+    """Yields lines of urls in a machine-readable format
+
+    :param urls: an iterable of tuples with a url row and a list of tags,
+        preceded by a division if `divisions` is given
+    :param str fmt: one of `OUTPUT_FORMATS` but `table`
+    :param bool divisions: whether urls come from many divisions
+    :return: an iterator of lines
+    """
+    fields = ("division", *URL_FIELDS) if divisions else URL_FIELDS
+    records = (url_record(item, divisions) for item in urls)
+    return record_lines(records, fmt, fields)
+
+
+def format_tags(tags: Iterable[tuple], fmt: str) -> Iterator[str]:
+    """Yields lines of tags in a machine-readable format
+
+    :param tags: an iterable of tag rows of `TAG_FIELDS`
+    :param str fmt: one of `OUTPUT_FORMATS` but `table`
+    :return: an iterator of lines
+    """
+    records = (dict(zip(TAG_FIELDS, tag)) for tag in tags)
+    return record_lines(records, fmt, TAG_FIELDS)
@@ -0,0 +1,254 @@
+import cProfile
+import json
+import sqlite3
+import sys
+import threading
+from functools import partial
+from time import perf_counter
+from typing import List
+
+import click
+
+# Statements shown in the summary of `--profile`
+SLOWEST = 10
+
+
+class Statement:
+    """A statement run on a traced connection, with its total time and rows.
+    Rows fetched later are added to the statement that returned them.
+    """
+
+    __slots__ = ("division", "sql", "time", "rows", "error")
+
+    def __init__(self, division: str, sql: str):
+        self.division = division
+        self.sql = " ".join(sql.split())
+        self.time = 0.0
+        self.rows = 0
+        self.error = None
+
+    def as_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class TracingCursor(sqlite3.Cursor):
+    """A cursor recording its statements to the tracer of its connection"""
+
+    _statement = None
+
+    def _run(self, method, sql: str, *args):
+        self._statement = self.connection.tracer.record(self.connection.division, sql)
+        result = self._time(method, sql, *args)
+        if self.rowcount > 0:  # rows changed; -1 for queries
+            self._statement.rows += self.rowcount
+        return result
+
+    def _time(self, method, *args):
+        start = perf_counter()
+        try:
+            return method(*args)
+        except StopIteration:
+            raise
+        except Exception as e:
+            if self._statement is not None:
+                self._statement.error = str(e)
+            raise
+        finally:
+            if self._statement is not None:
+                self._statement.time += perf_counter() - start
+
+    def _fetched(self, rows):
+        if self._statement is not None and rows:
+            self._statement.rows += len(rows) if isinstance(rows, list) else 1
+        return rows
+
+    def execute(self, sql: str, *args):
+        return self._run(super().execute, sql, *args)
+
+    def executemany(self, sql: str, *args):
+        return self._run(super().executemany, sql, *args)
+
+    def executescript(self, sql: str):
+        return self._run(super().executescript, sql)
+
+    def __next__(self):
+        return self._fetched(self._time(super().__next__))
+
+    def fetchone(self):
+        return self._fetched(self._time(super().fetchone))
+
+    def fetchmany(self, *args):
+        return self._fetched(self._time(super().fetchmany, *args))
+
+    def fetchall(self):
+        return self._fetched(self._time(super().fetchall))
+
+
+class TracingConnection(sqlite3.Connection):
+    """A connection whose cursors, commits and rollbacks are recorded"""
+
+    def __init__(self, *args, tracer=None, division: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tracer = tracer
+        self.division = division
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    # The ones of sqlite3.Connection bypass the cursor methods above
+    def execute(self, sql: str, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql: str, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def executescript(self, sql: str):
+        return self.cursor().executescript(sql)
+
+    def commit(self):
+        self._end("COMMIT", super().commit)
+
+    def rollback(self):
+        self._end("ROLLBACK", super().rollback)
+
+    def _end(self, sql: str, method):
+        statement = self.tracer.record(self.division, sql)
+        start = perf_counter()
+        try:
+            method()
+        except Exception as e:
+            statement.error = str(e)
+            raise
+        finally:
+            statement.time += perf_counter() - start
+
+
+class Tracer:
+    """Records every statement run on connections it opens, for a command. It
+    is only created when profiling, so connections are plain otherwise.
+    """
+
+    def __init__(self, command: str = None):
+        """
+        :param str command: a name of the traced command
+        """
+        self.command = command
+        self.statements: List[Statement] = []
+        self.started = perf_counter()
+        self._lock = threading.Lock()  # divisions are read by many threads
+
+    def factory(self, division: str):
+        """Returns a connection factory for `sqlite3.connect`
+
+        :param str division: a division name of the connection
+        """
+        return partial(TracingConnection, tracer=self, division=division)
+
+    def record(self, division: str, sql: str) -> Statement:
+        statement = Statement(division, sql)
+        with self._lock:
+            self.statements.append(statement)
+        return statement
+
+    @property
+    def elapsed(self) -> float:
+        return perf_counter() - self.started
+
+    @property
+    def commits(self) -> int:
+        return sum(1 for statement in self.statements if statement.sql == "COMMIT")
+
+    def slowest(self, n: int = SLOWEST) -> List[dict]:
+        """Returns statements taking the longest in total, grouped by their sql
+
+        :param int n: a maximum number of statements
+        :return: a list of dicts with `sql`, `calls`, `time` and `rows`
+        """
+        grouped = {}
+        for statement in self.statements:
+            group = grouped.setdefault(
+                statement.sql, {"sql": statement.sql, "calls": 0, "time": 0, "rows": 0}
+            )
+            group["calls"] += 1
+            group["time"] += statement.time
+            group["rows"] += statement.rows
+        return sorted(grouped.values(), key=lambda g: g["time"], reverse=True)[:n]
+
+    def summary(self) -> List[str]:
+        """Returns lines summarizing the command and its slowest statements"""
+        sql_time = sum(statement.time for statement in self.statements)
+        errors = sum(1 for statement in self.statements if statement.error)
+        lines = [
+            f"{self.command}: {self.elapsed * 1000:.1f} ms, "
+            f"{len(self.statements)} statements in {sql_time * 1000:.1f} ms, "
+            f"{self.commits} commits, {errors} errors",
+            f"{'CALLS':>6} {'MS':>9} {'ROWS':>7}  SQL",
+        ]
+        for group in self.slowest():
+            sql = group["sql"]
+            sql = sql if len(sql) <= 72 else f"{sql[:69]}..."
+            lines.append(
+                f"{group['calls']:>6} {group['time'] * 1000:>9.2f} "
+                f"{group['rows']:>7}  {sql}"
+            )
+        return lines
+
+    def as_dict(self, args: List[str] = None) -> dict:
+        """Returns a json-serializable trace of the command
+
+        :param list args: command line arguments of the command
+        """
+        return {
+            "command": self.command,
+            "args": args,
+            "time": self.elapsed,
+            "commits": self.commits,
+            "statements": [statement.as_dict() for statement in self.statements],
+        }
+
+    def write(self, path: str, args: List[str] = None):
+        """Appends the trace to a file as a line of json
+
+        :param str path: a path of the file
+        :param list args: command line arguments of the command
+        """
+        with open(path, "a") as file:
+            file.write(json.dumps(self.as_dict(args)) + "\n")
+
+
+def profile_command(
+    ctx: click.Context,
+    config,
+    summary: bool = False,
+    trace: str = None,
+    stats: str = None,
+):
+    """Profiles the command of the context until it finishes: statements of its
+    databases are traced, and the whole command runs under cProfile if `stats`
+    is given. Reports go to stderr and files, so the output stays as it is.
+
+    :param ctx: a context of the `pyjj` group
+    :param object config: an object with the current context
+    :param bool summary: whether to show the slowest statements on stderr
+    :param str trace: a path of a file to append a json trace to
+    :param str stats: a path of a file to save cProfile stats to
+    """
+    tracer = config.tracer = Tracer(ctx.invoked_subcommand)
+    profiler = None
+    if stats:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish():
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(stats)
+        if trace:
+            tracer.write(trace, sys.argv[1:])
+        if summary:
+            for line in tracer.summary():
+                click.echo(line, err=True)
+            if stats:
+                click.echo(f"cProfile stats: python -m pstats {stats}", err=True)
+
+    ctx.call_on_close(finish)
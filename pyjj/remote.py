@@ -0,0 +1,187 @@
+import json
+import os
+import socket
+
+from .config import get_home
+
+# Database methods run by the daemon; the others run on a direct connection
+EXPOSED = {
+    "add_url",
+    "add_tags",
+    "check_tag",
+    "edit_url",
+    "get_random_url",
+    "get_url",
+    "list_tags",
+    "list_urls",
+    "merge_tags",
+    "prune_tags",
+    "remove_url",
+    "remove_url_tag",
+    "remove_urls",
+    "sample_urls",
+    "suggest_tags",
+    "tag_urls",
+    "untag_urls",
+}
+
+# Database methods returning iterators, which are streamed row by row
+STREAMED = {"find_urls", "iter_urls", "search_urls"}
+
+
+def encode(value):
+    """Marks tuples in a result, which json turns into lists, so that `decode`
+    gives back what `Database` returns
+
+    :param value: a result or a row of a `Database` method
+    :return: a json-serializable value
+    """
+    if isinstance(value, tuple):
+        return {"__tuple__": [encode(item) for item in value]}
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    return value
+
+
+def decode(obj: dict):
+    """An `object_hook` of `json.loads` turning tuples marked by `encode` back"""
+    return tuple(obj["__tuple__"]) if "__tuple__" in obj else obj
+
+
+def socket_path() -> str:
+    """Returns a path of the daemon socket, next to config.yaml"""
+    return os.path.join(get_home(), ".pyjj.sock")
+
+
+def connect(path: str):
+    """Connect to a daemon listening on the socket
+
+    :param str path: a path of the socket
+    :return: a connected socket or None if no daemon is running
+    """
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:  # a socket left by a daemon that is gone
+        sock.close()
+        return None
+    return sock
+
+
+class RemoteDatabase:
+    """A proxy of `Database` which runs exposed methods on a daemon over a Unix
+    socket. Every request and response is a line of json: a request holds a
+    `division`, a `method`, `args` and `kwargs`, and a response either a
+    `result` or an `error`. Iterators are streamed as `row` lines ending with
+    `done`. Tuples are marked by `encode`, so results are the same as those of a
+    direct connection. Methods not exposed are run on a direct connection opened
+    on demand.
+    """
+
+    def __init__(self, sock, division: str, fallback, path: str = None):
+        """
+        :param sock: a socket connected to the daemon
+        :param str division: a division name
+        :param fallback: a callable opening a direct `Database`
+        :param str path: a path of the socket, to connect again after a stream is
+            abandoned
+        """
+        self.division = division
+        self._path = path
+        self._file = sock.makefile("rwb")
+        sock.close()  # the file holds the connection
+        self._fallback = fallback
+        self._local = None
+
+    def __getattr__(self, name):
+        if name in STREAMED:
+            return lambda *args, **kwargs: self._stream(name, args, kwargs)
+        if name in EXPOSED:
+            return lambda *args, **kwargs: self._call(name, args, kwargs)
+        if self._local is None:
+            self._local = self._fallback()
+        return getattr(self._local, name)
+
+    def _send(self, method: str, args: tuple, kwargs: dict):
+        if self._file is None:
+            sock = connect(self._path)
+            if sock is None:
+                raise ConnectionError("pyjj daemon is not running")
+            self._file = sock.makefile("rwb")
+            sock.close()
+        request = {
+            "division": self.division,
+            "method": method,
+            "args": args,
+            "kwargs": kwargs,
+        }
+        self._file.write(json.dumps(request).encode("utf8") + b"\n")
+        self._file.flush()
+
+    def _receive(self) -> dict:
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("pyjj daemon closed the connection")
+        response = json.loads(line, object_hook=decode)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def _request(self, method: str, args: tuple, kwargs: dict) -> dict:
+        """Sends a request and returns its first response. The daemon drops idle
+        connections without answering, so it connects again once on a closed one.
+        """
+        for retry in (True, False):
+            try:
+                self._send(method, args, kwargs)
+                return self._receive()
+            except ConnectionError:
+                self._disconnect()
+                if not retry:
+                    raise
+
+    def _call(self, method: str, args: tuple, kwargs: dict):
+        return self._request(method, args, kwargs)["result"]
+
+    def _stream(self, method: str, args: tuple, kwargs: dict):
+        response = self._request(method, args, kwargs)
+        try:
+            while not response.get("done"):
+                yield response["row"]
+                response = self._receive()
+        finally:
+            if not response.get("done"):
+                # Rows left unread would be taken as responses of next requests
+                self._disconnect()
+
+    def _disconnect(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:  # a request left in the buffer can't be flushed
+                pass
+            self._file = None
+
+    def close(self):
+        self._disconnect()
+        if self._local is not None:
+            self._local.close()
+
+
+def connect_database(division: str, fallback):
+    """Returns a proxy of the daemon if it is running, unless `PYJJ_NO_DAEMON` is
+    set, otherwise a direct `Database`
+
+    :param str division: a division name
+    :param fallback: a callable opening a direct `Database`
+    :return: a `RemoteDatabase` or a `Database`
+    """
+    path = socket_path()
+    sock = None if os.environ.get("PYJJ_NO_DAEMON") else connect(path)
+    if sock is None:
+        return fallback()
+    return RemoteDatabase(sock, division, fallback, path)
@@ -0,0 +1,194 @@
+import io
+import json
+import os
+import signal
+import socketserver
+import threading
+from contextlib import closing
+
+from .database import Database
+from .remote import EXPOSED, STREAMED, connect, encode
+
+# Idle connections of streams kept for each division
+IDLE_READERS = 4
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """Answers json requests of a client connection, one per line, until it closes
+    """
+
+    wbufsize = io.DEFAULT_BUFFER_SIZE  # flushed once per response
+    # Idle clients are dropped and reconnect; streams wait for their readers
+    timeout = 10
+
+    def handle(self):
+        try:
+            for line in self.rfile:
+                self.answer(line)
+        except OSError:  # timed out or closed by the client
+            pass
+
+    def answer(self, line: bytes):
+        try:
+            request = json.loads(line)
+            method = request["method"]
+            if method not in EXPOSED and method not in STREAMED:
+                raise ValueError(f"Unknown method: {method}")
+            division = request.get("division") or "default"
+            args, kwargs = request.get("args", ()), request.get("kwargs", {})
+            if method in STREAMED:
+                self.stream(division, method, args, kwargs)
+                return
+            with self.server.lock:
+                database = self.server.database(division)
+                result = getattr(database, method)(*args, **kwargs)
+            self.send({"result": encode(result)})
+        except OSError:
+            raise
+        except Exception as e:
+            self.send({"error": str(e)})
+
+    def stream(self, division: str, method: str, args: tuple, kwargs: dict):
+        """Streams rows of an iterator on a connection of its own, so the lock is
+        not held while they are written and a slow reader holds up no one else
+        """
+        database = self.server.reader(division)
+        try:
+            with closing(getattr(database, method)(*args, **kwargs)) as rows:
+                self.connection.settimeout(None)
+                for row in rows:
+                    self.send({"row": encode(row)}, flush=False)
+            self.send({"done": True})
+        finally:
+            self.connection.settimeout(self.timeout)
+            self.server.release(division, database)
+
+    def send(self, response: dict, flush: bool = True):
+        self.wfile.write(json.dumps(response).encode("utf8") + b"\n")
+        if flush:
+            self.wfile.flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """A daemon keeping a connection to every division it has served open, so
+    clients skip connecting, migrating and warming up caches of databases.
+    Every client has a thread, but requests are answered one at a time. Streams
+    run on a pool of other connections instead, as long as their readers take.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        path: str,
+        db_path: str = None,
+        settings: dict = None,
+        tracking_params: list = None,
+    ):
+        """
+        :param str path: a path of the socket
+        :param str db_path: a directory of database files; see `Database`
+        :param dict settings: connection settings of databases
+        :param list tracking_params: tracking parameters of databases
+        """
+        self.databases = {}
+        self.readers = {}  # idle connections of streams by division
+        self.closed = False
+        self.lock = threading.Lock()
+        self.options = {
+            "path": db_path,
+            "settings": settings,
+            "tracking_params": tracking_params,
+            "check_same_thread": False,  # guarded by the lock or used by a stream
+        }
+        super().__init__(path, Handler)
+        os.chmod(path, 0o600)
+
+    def database(self, division: str) -> Database:
+        """Returns a database of the division, opened on first use
+
+        :param str division: a division name
+        :return: a database
+        """
+        if division not in self.databases:
+            database = Database(division=division, **self.options)
+            failure = database.setup()  # None unless it fails
+            if failure:
+                database.close()
+                raise RuntimeError(failure[1])
+            self.databases[division] = database
+        return self.databases[division]
+
+    def reader(self, division: str) -> Database:
+        """Returns a connection for a stream of the division, idle or new
+
+        :param str division: a division name
+        :return: a database, to be given back by `release`
+        """
+        with self.lock:
+            self.database(division)  # set up before any stream reads it
+            idle = self.readers.setdefault(division, [])
+            if idle:
+                return idle.pop()
+        return Database(division=division, **self.options)
+
+    def release(self, division: str, database: Database):
+        """Keeps a connection of a finished stream for the next one, unless enough
+        are kept or the daemon is stopping
+
+        :param str division: a division name
+        :param database: a database returned by `reader`
+        """
+        with self.lock:
+            idle = self.readers.setdefault(division, [])
+            if not self.closed and len(idle) < IDLE_READERS:
+                idle.append(database)
+                return
+        database.close()
+
+    def serve_forever(self, *args, **kwargs):
+        try:
+            super().serve_forever(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.closed = True
+                for database in self.databases.values():
+                    database.close()
+                for idle in self.readers.values():
+                    for database in idle:
+                        database.close()
+                self.databases.clear()
+                self.readers.clear()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def serve(path: str, **options):
+    """Serve databases on a Unix socket until interrupted or terminated
+
+    :param str path: a path of the socket
+    :param options: options of `Server`
+    :exception: RuntimeError when a daemon is already running on the socket
+    """
+    sock = connect(path)
+    if sock is not None:
+        sock.close()
+        raise RuntimeError(f"pyjj daemon is already running: {path}")
+    if os.path.exists(path):  # left by a daemon that is gone
+        os.unlink(path)
+
+    server = Server(path, **options)
+
+    def terminate(*args):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,43 @@
+import json
+from typing import IO, Iterable, Iterator, Tuple
+
+# A version of delta files, on their first line
+DELTA_VERSION = 1
+
+
+def write_delta(
+    file: IO, division: str, since: int, seq: int, changes: Iterable[dict]
+) -> int:
+    """Stream changes of a division into a delta file: a header line followed by
+    a line of compact json per change
+
+    :param file: a file object in text mode
+    :param str division: a division name of the changes
+    :param int since: a sequence number the changes were logged after
+    :param int seq: a sequence number of the last change, for the next export
+    :param changes: an iterable of dicts yielded by `Database.iter_changes`
+    :return: a number of changes written
+    """
+    header = {"pyjj_delta": DELTA_VERSION, "division": division}
+    file.write(json.dumps({**header, "since": since, "seq": seq}) + "\n")
+    count = 0
+    for change in changes:
+        file.write(json.dumps(change, separators=(",", ":")) + "\n")
+        count += 1
+    return count
+
+
+def read_delta(file: IO) -> Tuple[dict, Iterator[dict]]:
+    """Read a delta file written by `write_delta`; changes are read lazily
+
+    :param file: a file object in text mode
+    :exception: ValueError when the file is not a delta file
+    :return: a tuple with the header and an iterator of changes
+    """
+    try:
+        header = json.loads(file.readline())
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("pyjj_delta") != DELTA_VERSION:
+        raise ValueError("Not a pyjj delta file")
+    return header, (json.loads(line) for line in file if line.strip())
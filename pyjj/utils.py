@@ -1,5 +1,25 @@
 import re
-from urllib.parse import urlparse
+from fnmatch import fnmatchcase
+from hashlib import blake2b
+from urllib.parse import parse_qsl, urlencode, urlparse, urlsplit
+
+# Query parameters dropped from canonical urls; `*` matches any suffix
+TRACKING_PARAMS = (
+    "utm_*",
+    "fbclid",
+    "gclid",
+    "dclid",
+    "msclkid",
+    "yclid",
+    "igshid",
+    "mc_cid",
+    "mc_eid",
+    "_ga",
+    "_hsenc",
+    "_hsmi",
+)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
 
 
 def reformat_url(url: str) -> str:
@@ -33,3 +53,72 @@ def validate_url(url: str):
         return _url
     else:
         raise ValueError(f"Invalid URL: {_url}")
+
+
+def canonicalize_url(url: str, tracking_params=TRACKING_PARAMS) -> str:
+    """Canonicalize url so that variants of the same page compare equal: scheme
+    http/https, `www.`, case of the host, default ports, trailing slashes,
+    fragments, order of query parameters and tracking parameters are ignored
+
+    :param str url: user input url
+    :param tracking_params: patterns of query parameters to drop
+    :return: a canonical form of the url, which is not a valid url itself
+    """
+    url = url.strip()
+    parts = urlsplit(url if re.match(r"[a-zA-Z][\w+.-]*://", url) else f"http://{url}")
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:  # a malformed port is kept as it is
+        port = parts.netloc.rpartition(":")[2]
+    if port and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{port}"
+    userinfo = parts.netloc.rpartition("@")[0]
+    if userinfo:
+        host = f"{userinfo}@{host}"
+    scheme = parts.scheme.lower()
+    prefix = "" if scheme in DEFAULT_PORTS else f"{scheme}://"
+
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not any(fnmatchcase(key.lower(), pattern) for pattern in tracking_params)
+    )
+    query = f"?{urlencode(query)}" if query else ""
+    return f"{prefix}{host}{parts.path.rstrip('/')}{query}"
+
+
+def url_hash(url: str, tracking_params=TRACKING_PARAMS) -> int:
+    """Returns a 64-bit hash of the canonical url, which fits a sqlite integer
+
+    :param str url: user input url
+    :param tracking_params: patterns of query parameters to drop
+    :return: a signed 64-bit integer
+    """
+    digest = blake2b(
+        canonicalize_url(url, tracking_params).encode("utf8"), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def parse_ids(values) -> tuple:
+    """Parse ids given as numbers and ranges, such as `3`, `1-10` or `1,4-6`
+
+    :param values: an iterable of strings of comma-separated ids and ranges
+    :exception: ValueError when a value is neither an id nor a range
+    :return: a tuple with a list of ids and a list of tuples with the first and
+        the last id of ranges
+    """
+    ids, ranges = [], []
+    for value in values:
+        for part in filter(None, value.split(",")):
+            first, dash, last = part.strip().partition("-")
+            if not first.isdigit() or (dash and not last.isdigit()):
+                raise ValueError(f"Invalid id or range: {part}")
+            if dash:
+                ranges.append((int(first), int(last)))
+            else:
+                ids.append(int(first))
+    return ids, ranges
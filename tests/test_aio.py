@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from pyjj.aio import STREAM_BATCH, STREAM_BUFFER, AsyncDatabase
+
+
+def run(tmp_path, test, **kwargs):
+    async def main():
+        async with AsyncDatabase(division="test", path=str(tmp_path), **kwargs) as db:
+            await test(db)
+        return db
+
+    return asyncio.run(main())
+
+
+def test_async_database(tmp_path):
+    async def test(db):
+        # writes queued together are committed in a batch, each answered alone
+        tags = [["a", f"t{i % 2}"] for i in range(50)]
+        adds = [db.add_url(f"http://{i}.com", tags=tags[i]) for i in range(50)]
+        results = await asyncio.gather(*adds, db.add_url("http://0.com"))
+        assert all(status for status, _ in results[:50])
+        assert results[50] == (False, "Given url already exists! id: 1")
+        assert db.batches < db.writes == 51
+
+        # reads see every write answered before them
+        assert await db.count_urls() == (True, 50)
+        assert (await db.get_url(1))[1][1] == "http://0.com"
+        assert (await db.list_tags())[1][0][1:4:2] == ("a", 50)
+        rows = [row async for row in db.list_urls(tag="t1")]
+        assert [url[0] for url, _ in rows] == list(range(2, 51, 2))
+        found = [url[1] async for url, _ in db.find_urls("49.com")]
+        assert found == ["http://49.com"]
+        with pytest.raises(ValueError):
+            [row async for row in db.find_urls("ab")]
+
+    db = run(tmp_path, test)
+    with pytest.raises(RuntimeError):
+        asyncio.run(db.get_url(1))
+
+
+def test_failed_write_is_undone_alone(tmp_path):
+    async def test(db):
+        results = await asyncio.gather(
+            db.add_url("http://a.com", tags=["x"]),
+            db.add_tags(99, ["y"]),  # a url that doesn't exist
+            db.add_url("http://b.com", tags=["y"]),
+        )
+        assert [status for status, _ in results] == [True, False, True]
+        assert [tag for _, tag, *_ in (await db.list_tags())[1]] == ["x", "y"]
+        assert [tags for _, tags in [row async for row in db.list_urls()]] == [
+            ["x"],
+            ["y"],
+        ]
+
+    run(tmp_path, test)
+
+
+def test_backpressure_and_streams_closed_early(tmp_path):
+    urls = STREAM_BATCH * (STREAM_BUFFER + 2)
+
+    async def test(db):
+        entries = [{"url": f"http://{i}.com", "tags": []} for i in range(urls)]
+        assert (await db.bulk_add_urls(entries))[0]
+
+        # more requests than slots wait for them
+        counts = await asyncio.gather(*(db.count_urls() for _ in range(20)))
+        assert counts == [(True, urls)] * 20
+
+        # a stream left unread doesn't hold its reader
+        async for _ in db.list_urls():
+            break
+        assert await asyncio.wait_for(db.get_url(1), 5) == await db.get_url(1)
+
+    run(tmp_path, test, readers=1, queue_size=2)
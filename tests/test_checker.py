@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pyjj.checker import HostQueue, check_urls, probe
+from pyjj.database import Database
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        if self.path == "/no-head":
+            self.send_response(405)
+        elif self.path == "/moved":
+            self.send_response(301)
+            self.send_header("Location", "/ok")
+        elif self.path == "/slow":
+            time.sleep(1)
+            self.send_response(200)
+        else:
+            self.send_response(200 if self.path in ("/ok", "/") else 404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/no-head":
+            self.path = "/ok"
+        self.do_HEAD()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_probe(server):
+    assert probe(f"{server}/ok", 5) == (200, f"{server}/ok", None)
+    assert probe(f"{server}/no-head", 5) == (200, f"{server}/no-head", None)
+    assert probe(f"{server}/moved", 5) == (200, f"{server}/ok", None)
+    assert probe(f"{server}/gone", 5)[0] == 404
+    status, _, error = probe(f"{server}/slow", 0.2)
+    assert status is None and "timed out" in error
+    assert probe("http://127.0.0.1:1/", 5)[0] is None
+
+
+def test_host_queue():
+    async def starts():
+        urls = enumerate(f"http://{host}.com/" for host in "aaab")
+        queue, loop = HostQueue(urls, 0.05, lookahead=10), asyncio.get_running_loop()
+
+        async def start():
+            item = await queue.get()
+            return item and (item[1], loop.time())
+
+        return await asyncio.gather(*(start() for _ in range(5)))
+
+    times = sorted(filter(None, asyncio.run(starts())), key=lambda item: item[1])
+    # b is taken before the second url of a, which waits for its slot
+    assert [url[7] for url, _ in times] == ["a", "b", "a", "a"]
+    assert times[1][1] - times[0][1] < 0.05
+    assert times[3][1] - times[2][1] >= 0.05 and times[2][1] - times[0][1] >= 0.05
+
+
+def test_check_urls(server, tmp_path):
+    db = Database(division="test", path=str(tmp_path))
+    db.setup()
+    for path in ("ok", "no-head", "moved", "gone", "missing"):
+        db.add_url(f"{server}/{path}", tags=["dead"] if "g" in path else [])
+
+    saved = []
+
+    def save(results):
+        saved.append(len(results))
+        assert db.save_checks(results)[0]
+
+    urls = db.iter_urls_to_check(max_age=7, batch_size=2)
+    count = asyncio.run(check_urls(urls, save, concurrency=3, interval=0, batch_size=2))
+    assert count == 5 and saved == [2, 2, 1]
+
+    def ids(health):
+        return [url[0] for url, _ in db.iter_urls(health=health)]
+
+    assert ids("ok") == [1, 2, 3]
+    assert ids("dead") == [4, 5]
+    assert ids("unchecked") == []
+    final_url = db.connection.execute(
+        "SELECT final_url FROM pyjj_test_checks WHERE url_id=3"
+    )
+    assert final_url.fetchone()[0] == f"{server}/ok"
+
+    # fresh checks are skipped, unless every url is asked for
+    assert list(db.iter_urls_to_check(max_age=7)) == []
+    db.add_url(f"{server}/new")
+    assert list(db.iter_urls_to_check(max_age=7)) == [(6, f"{server}/new")]
+    assert ids("unchecked") == [6]
+    assert [id for id, _ in db.iter_urls_to_check(tags=["dead"])] == [4, 5]
+
+    db.remove_url(1)
+    assert ids("ok") == [2, 3]
+    db.close()
+
+
+def test_urls_of_busy_hosts_are_deferred(monkeypatch):
+    starts = {}
+
+    def fake_probe(url, timeout):
+        starts.setdefault(url.split("/")[2], []).append(time.perf_counter())
+        return 200, url, None
+
+    monkeypatch.setattr("pyjj.checker.probe", fake_probe)
+    # a run of urls on one host, as imported bookmarks often are, before others
+    urls = [f"http://same.com/{i}" for i in range(6)]
+    urls += [f"http://{i}.com/" for i in range(6)] + ["http://same.com/last"]
+    begin = time.perf_counter()
+    count = asyncio.run(
+        check_urls(enumerate(urls), lambda _: None, concurrency=3, interval=0.1)
+    )
+    assert count == 13
+
+    # other hosts don't wait behind the busy one, which keeps its interval
+    same = starts.pop("same.com")
+    assert max(max(times) for times in starts.values()) - begin < 0.09
+    assert len(same) == 7
+    assert all(b - a >= 0.09 for a, b in zip(same, same[1:]))
@@ -1,3 +1,8 @@
+import sqlite3
+
+import click
+import pytest
+
 from pyjj.config import PyjjConfig, handle_exception
 
 
@@ -60,3 +65,31 @@ def test_update_config(tmp_path, capsys):
     config.update(name="test_name", environment="test_env")
     captured = capsys.readouterr()
     assert captured.out.startswith("Falied to serialize config file:")
+
+
+def test_update_keeps_parsed_config(tmp_path):
+    config = PyjjConfig()
+    tmp_file = tmp_path / "config.yaml"
+    tmp_file.write_text("division: old\nconnection:\n  busy_timeout: 100\n")
+    config.path = tmp_file
+
+    assert config.connection == {}
+    config.parse()
+    assert config.connection == {"busy_timeout": 100}
+
+    config.update(division="new")
+    config = PyjjConfig()
+    config.path = tmp_file
+    config.parse()
+    assert config.division == "new"
+    assert config.connection == {"busy_timeout": 100}
+
+
+def test_open_db_reports_setup_failures(tmp_path, monkeypatch):
+    def migrate(connection, division):
+        raise sqlite3.OperationalError("no such tokenizer: trigram")
+
+    monkeypatch.setenv("PYJJ_HOME", str(tmp_path))
+    monkeypatch.setattr("pyjj.database.migrate", migrate)
+    with pytest.raises(click.ClickException, match="no such tokenizer"):
+        PyjjConfig().open_db("broken")
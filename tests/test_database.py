@@ -0,0 +1,442 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pyjj.database import Database, split_tags
+from pyjj.profiler import Tracer
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(division="test", path=str(tmp_path))
+    database.setup()
+    yield database
+    database.close()
+
+
+def test_split_tags():
+    assert split_tags(None) == []
+    assert split_tags("") == []
+    assert split_tags("a\x1fb,c") == ["a", "b,c"]
+
+
+def test_list_urls(db):
+    db.add_url("http://a.com", tags=["python", "perf"])
+    db.add_url("http://b.com", tags=["python"])
+    db.add_url("http://c.com")
+
+    status, urls = db.list_urls()
+    assert status
+    assert [url[1] for url, _ in urls] == [
+        "http://a.com",
+        "http://b.com",
+        "http://c.com",
+    ]
+    assert sorted(urls[0][1]) == ["perf", "python"]
+    assert urls[1][1] == ["python"]
+    assert urls[2][1] == []
+    assert len(urls[0][0]) == 4
+
+    status, urls = db.list_urls(tag="python")
+    assert status
+    assert [url[1] for url, _ in urls] == ["http://a.com", "http://b.com"]
+    # tags of a filtered url are not limited to the filtering tag
+    assert sorted(urls[0][1]) == ["perf", "python"]
+
+    assert db.list_urls(tag="missing") == (True, [])
+
+
+def test_tags_with_commas(db):
+    db.add_url("http://a.com", tags=["c,d", "e"])
+    assert sorted(db.list_urls()[1][0][1]) == ["c,d", "e"]
+
+
+def test_list_urls_constant_queries(db):
+    for i in range(50):
+        db.add_url(f"http://{i}.com", tags=["a", "b"])
+
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    status, urls = db.list_urls(tag="a")
+    db.connection.set_trace_callback(None)
+
+    assert status and len(urls) == 50
+    assert len(statements) == 2  # tag lookup + aggregated select
+
+
+def test_iter_urls_pagination(db):
+    for i in range(1, 11):
+        db.add_url(f"http://{i}.com", tags=["even" if i % 2 == 0 else "odd"])
+
+    def ids(**kwargs):
+        return [url[0] for url, _ in db.iter_urls(batch_size=3, **kwargs)]
+
+    assert ids() == list(range(1, 11))
+    assert ids(limit=3) == [1, 2, 3]
+    assert ids(limit=3, after=3) == [4, 5, 6]
+    assert ids(limit=3, before=8) == [5, 6, 7]
+    assert ids(before=3) == [1, 2]
+    assert ids(after=2, before=6) == [3, 4, 5]
+    assert ids(tag="even", limit=2, after=4) == [6, 8]
+    assert ids(tag="odd", limit=2, before=9) == [5, 7]
+    assert ids(tag="missing") == []
+
+    status, urls = db.list_urls(limit=2, after=8)
+    assert status
+    assert [url[0] for url, _ in urls] == [9, 10]
+
+
+def test_bulk_add_urls(db):
+    db.add_url("http://exists.com", tags=["old"])
+    entries = [
+        {"url": "a.com", "tags": ["x", "y"], "created_at": "2020-01-01 00:00:00"},
+        {"url": "http://exists.com", "tags": [], "created_at": None},
+        {"url": "", "tags": [], "created_at": None},
+        {"url": "b.com", "tags": ["old", "x", "x"], "created_at": None},
+        {"url": "a.com", "tags": [], "created_at": None},
+    ]
+    status, report = db.bulk_add_urls(iter(entries), batch_size=2)
+    assert status
+    assert report["added"] == 2
+    assert report["duplicates"] == ["http://exists.com", "http://a.com"]
+    assert [url for url, _ in report["invalid"]] == [""]
+
+    urls = {url[1]: (url, sorted(tags)) for url, tags in db.iter_urls()}
+    assert urls["http://a.com"] == (
+        (2, "http://a.com", "2020-01-01 00:00:00", None),
+        ["x", "y"],
+    )
+    assert urls["http://b.com"][1] == ["old", "x"]
+    assert len(db.list_tags()[1]) == 3
+
+
+def test_sample_urls(db):
+    assert db.sample_urls(3) == (True, [])
+    assert db.get_random_url()[0] is False
+
+    for i in range(1, 21):
+        db.add_url(f"http://{i}.com", tags=["even" if i % 2 == 0 else "odd"])
+    # leave gaps in ids
+    for id in range(1, 16):
+        db.remove_url(id)
+
+    status, urls = db.sample_urls(3)
+    assert status
+    ids = [url[0] for url, _ in urls]
+    assert len(set(ids)) == 3 and all(16 <= id <= 20 for id in ids)
+
+    status, urls = db.sample_urls(10)
+    assert sorted(url[0] for url, _ in urls) == [16, 17, 18, 19, 20]
+
+    status, urls = db.sample_urls(10, tag="even")
+    assert sorted(url[0] for url, _ in urls) == [16, 18, 20]
+    assert all(tags == ["even"] for _, tags in urls)
+    assert db.sample_urls(1, tag="missing") == (True, [])
+
+    status, (url, tags) = db.get_random_url("odd")
+    assert status and url[0] % 2 == 1 and tags == ["odd"]
+
+
+def test_search_urls(db):
+    db.add_url("https://docs.python.org/3/library/sqlite3.html", tags=["python"])
+    db.add_url("https://sqlite.org/fts5.html", tags=["database", "search"])
+    db.add_url("https://example.com/python-tips")
+
+    def search(query):
+        return [url[1] for url, _ in db.search_urls(query)]
+
+    assert set(search("sqlite")) == {
+        "https://docs.python.org/3/library/sqlite3.html",
+        "https://sqlite.org/fts5.html",
+    }
+    # tags are weighted over urls
+    assert search("python")[0] == "https://docs.python.org/3/library/sqlite3.html"
+    assert search("sea") == ["https://sqlite.org/fts5.html"]
+    assert search('da"ta') == []
+
+    # the index follows edits, tag changes and removals
+    db.edit_url(3, "https://example.com/rust-tips")
+    db.add_tags(3, ["search"])
+    assert set(search("search")) == {"https://sqlite.org/fts5.html", search("rust")[0]}
+    db.remove_url_tag(2, "search")
+    db.remove_url(1)
+    assert search("search") == ["https://example.com/rust-tips"]
+    assert search("python") == []
+
+    db.connection.execute("DELETE FROM pyjj_test_search")
+    assert search("rust") == []
+    assert db.rebuild_search_index() == (True, "Rebuilt search index! urls: 2")
+    assert search("rust") == ["https://example.com/rust-tips"]
+
+
+def test_connection_settings(tmp_path):
+    db = Database(division="test", path=str(tmp_path), settings={"busy_timeout": 42})
+
+    def pragma(name):
+        return db.connection.execute(f"PRAGMA {name}").fetchone()[0]
+
+    assert pragma("journal_mode") == "wal"
+    assert pragma("busy_timeout") == 42
+    assert pragma("foreign_keys") == 1
+
+    with pytest.raises(ValueError):
+        Database(division="test", path=str(tmp_path), settings={"synchronous": "1;"})
+
+
+def test_remove_url_cascades(db):
+    db.add_url("http://a.com", tags=["x"])
+    db.remove_url(1)
+    count = db.connection.execute("SELECT COUNT(*) FROM pyjj_test_url_tags")
+    assert count.fetchone()[0] == 0
+
+
+def test_concurrent_writers(db, tmp_path):
+    def write(n):
+        writer = Database(division="test", path=str(tmp_path))
+        results = [writer.add_url(f"http://{n}-{i}.com", tags=["x"]) for i in range(30)]
+        writer.close()
+        return results
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = [r for rs in executor.map(write, range(4)) for r in rs]
+
+    assert all(status for status, _ in results)
+    assert len(db.list_urls(tag="x")[1]) == 120
+
+
+def test_tag_expressions(db):
+    db.add_url("http://1.com", tags=["python", "perf"])
+    db.add_url("http://2.com", tags=["python", "perf", "archived"])
+    db.add_url("http://3.com", tags=["python", "ml"])
+    db.add_url("http://4.com", tags=["ml"])
+    db.add_url("http://5.com")
+
+    def ids(**filters):
+        return [url[0] for url, _ in db.iter_urls(**filters)]
+
+    assert ids(tags=["python", "perf"]) == [1, 2]
+    assert ids(tag="python", tags=["perf"], not_tags=["archived"]) == [1]
+    assert ids(any_tags=["perf", "ml", "missing"]) == [1, 2, 3, 4]
+    expression = {"tags": ["python"], "any_tags": ["perf", "ml"]}
+    assert ids(not_tags=["archived"], **expression) == [1, 3]
+    assert ids(not_tags=["python", "missing"]) == [4, 5]
+    assert ids(tags=["python", "missing"]) == []
+    assert ids(any_tags=["missing"]) == []
+    assert ids(tags=["python", "python"]) == [1, 2, 3]
+
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    db.list_urls(tags=["python", "perf"], any_tags=["ml"], not_tags=["archived"])
+    db.connection.set_trace_callback(None)
+    assert len(statements) == 2  # tag lookup + filtered select
+
+    for _ in range(10):
+        status, urls = db.sample_urls(2, tags=["python"], not_tags=["archived"])
+        assert status and sorted(url[0] for url, _ in urls) == [1, 3]
+    assert db.sample_urls(1, any_tags=["missing"]) == (True, [])
+    status, (url, _) = db.get_random_url(any_tags=["ml"], not_tags=["python"])
+    assert url[0] == 4
+
+
+def test_canonical_duplicates(db):
+    assert db.add_url("https://www.x.com/a/?b=2&a=1&utm_source=feed", tags=["x"])[0]
+    assert db.add_url("http://x.com/a?a=1&b=2") == (
+        False,
+        "Given url already exists! id: 1",
+    )
+    assert db.add_url("http://y.com")[0]
+    assert db.edit_url(2, "http://X.com:80/a?b=2&a=1")[0] is False
+    assert db.edit_url(1, "http://x.com/a?a=1&b=2")[0]
+
+    status, report = db.bulk_add_urls(
+        [
+            {"url": "x.com/a/?b=2&a=1", "tags": [], "created_at": None},
+            {"url": "z.com/?fbclid=1", "tags": ["z"], "created_at": None},
+            {"url": "https://z.com", "tags": [], "created_at": None},
+        ]
+    )
+    assert report["added"] == 1
+    assert sorted(report["duplicates"]) == ["http://x.com/a/?b=2&a=1", "https://z.com"]
+
+    # duplicates left by other tracking parameters are merged on demand
+    db.tracking_params = ()
+    db.bulk_add_urls([{"url": "z.com/?fbclid=2", "tags": ["y"], "created_at": None}])
+    db.tracking_params = ("fbclid",)
+    assert db.find_duplicates() == (True, [])
+    assert db.rehash_urls() == (True, "Rehashed successfully! urls: 4")
+    assert db.find_duplicates() == (
+        True,
+        [((3, "http://z.com/?fbclid=1"), [(4, "http://z.com/?fbclid=2")])],
+    )
+    assert db.merge_duplicates() == (True, "Merged successfully! duplicates: 1")
+    assert [(url[0], sorted(tags)) for url, tags in db.iter_urls()] == [
+        (1, ["x"]),
+        (2, []),
+        (3, ["y", "z"]),
+    ]
+    assert db.find_duplicates() == (True, [])
+
+
+def test_tag_usage_counts(db):
+    db.add_url("http://a.com", tags=["x", "y"])
+    db.add_url("http://b.com", tags=["x"])
+    db.add_url("http://c.com", tags=["x", "z"])
+    db.add_tags(2, ["x"])  # ignored as the url has it already
+
+    counts = {tag: count for _, tag, _, count in db.list_tags()[1]}
+    assert counts == {"x": 3, "y": 1, "z": 1}
+    assert [tag[1] for tag in db.list_tags(sort="count")[1]] == ["x", "y", "z"]
+    assert [tag[1] for tag in db.list_tags(sort="recent")[1]] == ["z", "y", "x"]
+    assert [tag[1] for tag in db.list_tags(min_count=2)[1]] == ["x"]
+
+    # removing tags of urls and urls themselves, which cascades, both count
+    db.remove_url_tag(1, "y")
+    db.remove_url(3)
+    counts = {tag: count for _, tag, _, count in db.list_tags()[1]}
+    assert counts == {"x": 2, "y": 0, "z": 0}
+    assert db.prune_tags() == (True, "Pruned successfully! tags: 2")
+    assert [(tag[1], tag[3]) for tag in db.list_tags()[1]] == [("x", 2)]
+
+
+def test_bulk_operations(db):
+    db.bulk_add_urls(
+        {"url": f"http://{i}.com", "tags": ["x"] if i % 2 else [], "created_at": date}
+        for i, date in enumerate(["2020-01-01", "2020-02-01", "2020-03-01"] * 3, 1)
+    )
+    assert db.tag_urls(["y", "z"], ids=[1, 2], ranges=[(8, 20)]) == (True, 8)
+    assert db.tag_urls(["y"], ids=[1]) == (True, 0)
+    assert db.untag_urls(["z"], tags=["x"], dry_run=True) == (True, 2)
+    assert db.untag_urls(["z"], tags=["x"]) == (True, 2)
+    assert db.untag_urls(["missing"], ids=[1]) == (True, 0)
+
+    # a rename into an existing tag merges them
+    assert db.merge_tags(["z"], "w") == (True, 2)
+    assert db.merge_tags(["y", "w"], "x") == (True, 4)
+    assert db.merge_tags(["y"], "x")[0] is False
+    counts = {tag: count for _, tag, _, count in db.list_tags()[1]}
+    assert counts == {"x": 7}
+
+    february = {"since": "2020-02-01", "until": "2020-03-01"}
+    assert db.remove_urls(dry_run=True, **february) == (True, 3)
+    assert db.remove_urls(not_tags=["x"], ranges=[(1, 3)]) == (True, 0)
+    assert db.remove_urls(**february) == (True, 3)
+    assert db.remove_urls(tags=["x"], ids=[1, 3, 9]) == (True, 3)
+    assert [url[0] for url, _ in db.iter_urls()] == [4, 6, 7]
+    assert db.remove_urls()[0] is False  # nothing selected is not everything
+    assert db.list_tags()[1][0][3] == 1
+
+
+def test_tag_id_cache(tmp_path):
+    tracer = Tracer()
+    db = Database(division="test", path=str(tmp_path), tracer=tracer)
+    db.setup()
+    db.add_url("http://a.com", tags=["x", "y"])
+    db.add_url("http://b.com")
+    del tracer.statements[:]
+    assert db.add_tags(2, ["x", "y", "z"])[0]
+    # a data version check, a lookup, an insert and a lookup of the missing tag,
+    # the pairs and a commit, however many tags are given
+    assert len(tracer.statements) == 6
+    del tracer.statements[:]
+    assert db.check_tag("z") == (True, 3)
+    assert [statement.sql for statement in tracer.statements] == [
+        "PRAGMA data_version"
+    ]
+
+    # tags that exist are not inserted again, which would use their ids up
+    other = Database(division="test", path=str(tmp_path))
+    assert other.add_tags(1, ["x", "y", "v"])[0]
+    assert other.check_tag("v") == (True, 4)
+    other.remove_url_tag(1, "v")
+    other.close()
+
+    # renamed, merged and pruned tags are not resolved to their old ids
+    assert db.merge_tags(["z"], "w") == (True, 1)
+    assert db.check_tag("z") == (False, -1)
+    db.remove_url_tag(2, "w")
+    db.prune_tags()
+    assert db.check_tag("w") == (False, -1)
+
+    # so are tags removed by another connection
+    assert db.check_tag("y") == (True, 2)
+    other = Database(division="test", path=str(tmp_path))
+    other.merge_tags(["y"], "x")
+    other.close()
+    assert db.check_tag("y") == (False, -1)
+    assert db.add_tags(1, ["y"])[0]
+    assert [sorted(tags) for _, tags in db.iter_urls()] == [["x", "y"], ["x"]]
+    db.close()
+
+
+def test_parameterized_statements(tmp_path):
+    tracer = Tracer()
+    db = Database(division="test", path=str(tmp_path), tracer=tracer)
+    db.setup()
+    quoted = "http://a.com/it's?q=\"x\""
+    assert db.add_url(quoted, tags=["it's"]) == (True, "Added successfully! id: 1")
+    assert db.get_url(1)[1][1] == quoted
+    assert db.check_tag("it's") == (True, 1)
+    assert db.remove_url_tag(1, "it's")[0]
+    assert db.remove_url("1 OR 1=1")[0]
+    assert db.get_url(1)[0]
+
+    # the text of statements doesn't depend on values, so compiled ones are reused
+    del tracer.statements[:]
+    for i in range(3):
+        db.add_url(f"http://b.com/{i}", tags=["x", f"y{i}"])
+        db.get_url(i + 2)
+    for host, n in (("c.com", 3), ("d.com", 5)):
+        urls = [f"http://{host}/{i}" for i in range(n)]
+        status, report = db.bulk_add_urls(
+            {"url": url, "tags": ["x"], "created_at": None} for url in urls
+        )
+        assert report["added"] == n
+    sqls = [statement.sql for statement in tracer.statements]
+    assert len(sqls) > 3 * len(set(sqls))
+    db.close()
+
+
+def test_find_urls(db):
+    db.add_url("https://github.com/ach0o/pyjj?tab=readme", tags=["python"])
+    db.add_url("https://docs.python.org/3/library/sqlite3.html")
+    db.add_url("https://gitlab.com/ach0o/notes#github")
+
+    def find(query, **kwargs):
+        return [url[1] for url, _ in db.find_urls(query, **kwargs)]
+
+    # hosts and paths contain every word, newest first; queries are not indexed
+    assert find("ach0o") == [
+        "https://gitlab.com/ach0o/notes#github",
+        "https://github.com/ach0o/pyjj?tab=readme",
+    ]
+    assert find("GITHUB") == ["https://github.com/ach0o/pyjj?tab=readme"]
+    assert find("ach0o notes") == ["https://gitlab.com/ach0o/notes#github"]
+    assert find("readme") == find("https") == []
+    with pytest.raises(ValueError):
+        find("py")
+
+    # typos still match, closest first
+    github = "https://github.com/ach0o/pyjj?tab=readme"
+    assert find("githbu pyj", fuzzy=True)[0] == github
+    assert find("sqlite libary", fuzzy=True)[0].startswith("https://docs.python")
+    assert find("zzzzzz", fuzzy=True) == []
+
+    # the index follows edits and removals
+    db.edit_url(1, "https://codeberg.org/ach0o/pyjj")
+    db.remove_url(3)
+    assert find("ach0o") == ["https://codeberg.org/ach0o/pyjj"]
+    assert db.rebuild_search_index()[0]
+    assert find("codeberg") == ["https://codeberg.org/ach0o/pyjj"]
+
+
+def test_suggest_tags(db):
+    db.add_url("http://a.com", tags=["python", "javascript", "rust"])
+    assert db.suggest_tags("pythn") == (True, ["python"])
+    assert db.suggest_tags("javscript") == (True, ["javascript"])
+    assert db.suggest_tags("go") == (True, [])
+
+    # renamed and removed tags are suggested by their new names
+    db.merge_tags(["python"], "python3")
+    db.merge_tags(["rust"], "javascript")
+    assert db.suggest_tags("pythn") == (True, ["python3"])
+    assert db.suggest_tags("rust") == (True, [])
@@ -0,0 +1,73 @@
+import pytest
+
+from pyjj.database import Database, list_divisions
+from pyjj.divisions import iter_all_urls, sample_all_urls, search_all_urls
+
+URLS = {
+    "work": [("a.com/sqlite", "2020-01-01"), ("b.com", "2020-01-03")],
+    "home": [("c.com/sqlite", "2020-01-02"), ("d.com", "2020-01-04")],
+}
+
+
+@pytest.fixture
+def open_db(tmp_path):
+    def open_db(division):
+        db = Database(division=division, path=str(tmp_path))
+        db.setup()
+        return db
+
+    for division, urls in URLS.items():
+        db = open_db(division)
+        entries = [{"url": u, "tags": [division], "created_at": d} for u, d in urls]
+        db.bulk_add_urls(entries)
+        db.close()
+    open_db.path = str(tmp_path)
+    return open_db
+
+
+def test_list_divisions(open_db, tmp_path):
+    assert list_divisions(open_db.path) == ["home", "work"]
+    assert list_divisions(str(tmp_path / "missing")) == []
+
+
+def test_iter_all_urls(open_db):
+    divisions = list_divisions(open_db.path)
+    urls = [(d, url[1]) for d, url, _ in iter_all_urls(divisions, open_db)]
+    assert urls == [
+        ("work", "http://a.com/sqlite"),
+        ("home", "http://c.com/sqlite"),
+        ("work", "http://b.com"),
+        ("home", "http://d.com"),
+    ]
+    urls = iter_all_urls(divisions, open_db, limit=3, tags=("home",))
+    assert [url[1] for _, url, _ in urls] == ["http://c.com/sqlite", "http://d.com"]
+
+    # closed early, every division is closed as well
+    urls = iter_all_urls(divisions, open_db)
+    assert next(urls)[0] == "work"
+    urls.close()
+
+    with pytest.raises(Exception):
+        list(iter_all_urls(["work", "bad name"], open_db))
+
+
+def test_search_all_urls(open_db):
+    urls = search_all_urls(list_divisions(open_db.path), open_db, "sqlite", 10)
+    assert sorted(url[1] for _, url, _ in urls) == [
+        "http://a.com/sqlite",
+        "http://c.com/sqlite",
+    ]
+
+
+def test_sample_all_urls(open_db):
+    divisions = list_divisions(open_db.path)
+    urls = sample_all_urls(divisions, open_db, 10)
+    assert sorted(url[1] for _, url, _ in urls) == [
+        "http://a.com/sqlite",
+        "http://b.com",
+        "http://c.com/sqlite",
+        "http://d.com",
+    ]
+    urls = sample_all_urls(divisions, open_db, 1, tags=("work",))
+    assert len(urls) == 1 and urls[0][0] == "work"
+    assert sample_all_urls(divisions, open_db, 3, tags=("none",)) == []
@@ -0,0 +1,108 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pyjj.database import Database
+from pyjj.enricher import HEAD_LIMIT, enrich_urls, fetch_all
+
+PAGE = b"""<!DOCTYPE html><html><head>
+<meta charset="utf-8"><title> Fast  SQLite &amp; you </title>
+<meta name="description" content="Tuning tips">
+</head><body>"""
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections alive
+
+    def do_GET(self):
+        self.server.requests.append((self.client_address, self.path))
+        if self.path == "/moved":
+            return self.reply(301, b"", Location="/page")
+        if self.path == "/etag" and self.headers.get("If-None-Match") == '"v1"':
+            return self.reply(304, b"", ETag='"v1"')
+        if self.path == "/big":
+            # a head followed by a body far larger than what is ever read
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(PAGE) + 100 * HEAD_LIMIT))
+            self.end_headers()
+            self.wfile.write(PAGE)
+            self.wfile.write(b"x" * HEAD_LIMIT * 2)
+            return
+        if self.path == "/og":
+            body = b'<head><meta property="og:title" content="OG"></head>'
+            return self.reply(200, body)
+        if self.path in ("/page", "/etag"):
+            return self.reply(200, PAGE + b"</body></html>", ETag='"v1"')
+        self.reply(404, b"not found", **{"Content-Type": "text/plain"})
+
+    def reply(self, status, body, **headers):
+        self.send_response(status)
+        headers.setdefault("Content-Type", "text/html; charset=utf-8")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_all(server):
+    base = f"http://127.0.0.1:{server.server_port}"
+    paths = ["/page", "/moved", "/og", "/missing", "/big", "/page"]
+    rows = [(i, f"{base}{path}", None, None) for i, path in enumerate(paths, 1)]
+    pages = [page[:6] for page in fetch_all(rows, 5)]
+    assert pages == [
+        (1, 200, "Fast SQLite & you", "Tuning tips", '"v1"', None),
+        (2, 200, "Fast SQLite & you", "Tuning tips", '"v1"', None),
+        (3, 200, "OG", None, None, None),
+        (4, 404, None, None, None, None),
+        (5, 200, "Fast SQLite & you", "Tuning tips", None, None),
+        (6, 200, "Fast SQLite & you", "Tuning tips", '"v1"', None),
+    ]
+    # one connection until the big page, which is not read out
+    clients = [client for client, _ in server.requests]
+    assert len(set(clients[:6])) == 1 and clients[6] != clients[0]
+
+    assert fetch_all([(1, "ftp://a.com", None, None)], 5)[0][1:4] == (None,) * 3
+
+
+def test_enrich_urls(server, tmp_path):
+    base = f"http://127.0.0.1:{server.server_port}"
+    db = Database(division="test", path=str(tmp_path))
+    db.setup()
+    for path in ("/etag", "/og", "/missing"):
+        db.add_url(f"{base}{path}")
+
+    def save(pages):
+        assert db.save_metadata(pages)[0]
+
+    rows = db.iter_urls_to_enrich(max_age=30, batch_size=2)
+    assert enrich_urls(rows, save, concurrency=2, batch_size=2) == 3
+    titles = [url[3] for url, _ in db.iter_urls()]
+    assert titles == ["Fast SQLite & you", "OG", None]
+    assert [url[1] for url, _ in db.search_urls("tuning")] == [f"{base}/etag"]
+    assert list(db.iter_urls_to_enrich(max_age=30)) == []
+
+    # a page not modified since the last fetch is kept as it is
+    server.requests.clear()
+    rows = list(db.iter_urls_to_enrich(urls=[f"{base}/etag"]))
+    assert rows == [(1, f"{base}/etag", '"v1"', None)]
+    assert enrich_urls(rows, save) == 1
+    assert [url[3] for url, _ in db.iter_urls()][0] == "Fast SQLite & you"
+    assert [path for _, path in server.requests] == ["/etag"]
+    db.close()
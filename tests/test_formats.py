@@ -0,0 +1,86 @@
+import io
+
+import pytest
+
+from pyjj.formats import (
+    guess_format,
+    open_text,
+    parse_tags,
+    read_bookmarks,
+    read_html,
+    write_bookmarks,
+)
+
+
+def test_guess_format():
+    assert guess_format("bookmarks.html") == "html"
+    assert guess_format("export.CSV") == "csv"
+    assert guess_format("dump.jsonl.gz") == "jsonl"
+    with pytest.raises(ValueError):
+        guess_format("dump.txt")
+
+
+def test_read_html():
+    html = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+    <DL><p>
+        <DT><H3>Folder</H3>
+        <DL><p>
+            <DT><A HREF="https://a.com" ADD_DATE="0" TAGS="python,perf">A</A>
+            <DT><A HREF="https://b.com">B</A>
+        </DL><p>
+    </DL><p>"""
+    entries = list(read_bookmarks(io.StringIO(html), "html"))
+    assert [entry["url"] for entry in entries] == ["https://a.com", "https://b.com"]
+    assert entries[0]["tags"] == ["python", "perf"]
+    assert entries[0]["created_at"] is not None
+    assert entries[1] == {"url": "https://b.com", "tags": [], "created_at": None}
+
+    # a tiny chunk size splits tags across feeds
+    assert list(read_html(io.StringIO(html), chunk_size=7)) == entries
+
+
+def test_read_csv_and_jsonl(tmp_path):
+    csv_content = "url,tags,created_at\na.com,\"x, y\",\nb.com,,2020-01-01 00:00:00\n"
+    entries = list(read_bookmarks(io.StringIO(csv_content), "csv"))
+    assert entries == [
+        {"url": "a.com", "tags": ["x", "y"], "created_at": None},
+        {"url": "b.com", "tags": [], "created_at": "2020-01-01 00:00:00"},
+    ]
+
+    path = str(tmp_path / "dump.jsonl.gz")
+    with open_text(path, "w") as f:
+        f.write('{"url": "a.com", "tags": ["x"]}\n\n{"url": "b.com", "tags": "y,z"}\n')
+    with open_text(path) as f:
+        entries = list(read_bookmarks(f, "jsonl"))
+    assert [entry["tags"] for entry in entries] == [["x"], ["y", "z"]]
+
+
+@pytest.mark.parametrize("fmt", ["html", "csv", "jsonl"])
+def test_write_and_read_back(tmp_path, fmt):
+    urls = [
+        ((1, "http://a.com/?q=\"x\"&y=1", "2020-01-01 00:00:00"), ["x", "c,d"]),
+        ((2, "http://b.com", "2020-01-02 00:00:00"), []),
+    ]
+    path = str(tmp_path / f"export.{fmt}.gz")
+    skipped = []
+    with open_text(path, "w") as f:
+        assert write_bookmarks(f, iter(urls), fmt, skipped) == 2
+    with open_text(path) as f:
+        entries = list(read_bookmarks(f, guess_format(path)))
+
+    if fmt == "html":
+        # TAGS of html is comma-separated, so a tag with a comma is reported
+        assert skipped == [("http://a.com/?q=\"x\"&y=1", "c,d")]
+        urls[0] = (urls[0][0], ["x"])
+    else:
+        assert skipped == []
+    assert entries == [
+        {"url": url[1], "tags": tags, "created_at": url[2]} for url, tags in urls
+    ]
+
+
+def test_parse_tags():
+    assert parse_tags('["c,d", " e ", 1, ""]') == ["c,d", "e"]
+    assert parse_tags("[]") == []
+    assert parse_tags("[x, y") == ["[x", "y"]
+    assert parse_tags(["a", " "]) == ["a"]
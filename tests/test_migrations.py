@@ -0,0 +1,69 @@
+import sqlite3
+
+from pyjj.database import Database
+from pyjj.migrations import SCHEMA_VERSION, create_tables, get_version, migrate
+
+
+def test_migrate_legacy_division(tmp_path):
+    # a division created before versioning: user_version 0 and duplicate pairs
+    connection = sqlite3.connect(str(tmp_path / "old_pyjj.db"))
+    create_tables(connection.cursor(), "old")
+    connection.execute("INSERT INTO pyjj_old_urls (url) VALUES ('http://a.com')")
+    connection.execute("INSERT INTO pyjj_old_tags (tag) VALUES ('x')")
+    connection.executemany(
+        "INSERT INTO pyjj_old_url_tags (url_id, tag_id) VALUES (?, ?)",
+        [(1, 1), (1, 1), (2, 1)],
+    )
+    connection.commit()
+
+    assert get_version(connection) == 0
+    assert migrate(connection, "old") == SCHEMA_VERSION
+    assert get_version(connection) == SCHEMA_VERSION
+    assert connection.execute("SELECT * FROM pyjj_old_url_tags").fetchall() == [(1, 1)]
+    rows = connection.execute("SELECT name FROM sqlite_master WHERE type='index'")
+    indexes = {row[0] for row in rows}
+    assert {
+        "pyjj_old_url_tags_pair",
+        "pyjj_old_url_tags_tag_id",
+        "pyjj_old_urls_created_at",
+    } <= indexes
+    connection.close()
+
+    db = Database(division="old", path=str(tmp_path))
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    db.setup()
+    assert statements == ["PRAGMA user_version"]
+
+    # duplicate pairs are ignored from now on
+    assert db.add_tags(1, ["x"])[0]
+    status, urls = db.list_urls(tag="x")
+    assert urls == [((1, "http://a.com", urls[0][0][2], None), ["x"])]
+    assert [url[1] for url, _ in db.search_urls("x")] == ["http://a.com"]
+    # usage counts are filled in for tags that existed before they were kept
+    assert [tag[3] for tag in db.list_tags()[1]] == [1]
+    # and urls are indexed by trigrams
+    assert [url[1] for url, _ in db.find_urls("a.co")] == ["http://a.com"]
+    # and logged as changes, for a first sync
+    assert [change["url"] for change in db.iter_changes()] == ["http://a.com"] * 2
+
+
+def test_sqlite_without_trigram_tokenizer(tmp_path, monkeypatch):
+    monkeypatch.setattr("pyjj.migrations.TRIGRAM_SQLITE", (99, 0, 0))
+    db = Database(division="test", path=str(tmp_path))
+    assert db.setup() is None
+    assert not db.fuzzy_index
+    db.add_url("http://a.com/100%_done", tags=["python"])
+    db.add_url("http://b.com/100x-done")
+
+    # lookups scan urls and tags instead
+    assert [url[1] for url, _ in db.find_urls("100%_d")] == ["http://a.com/100%_done"]
+    assert len(list(db.find_urls("done", fuzzy=True))) == 2
+    assert db.suggest_tags("pythn") == (True, ["python"])
+
+    # and the indexes are created by a rebuild once SQLite has the tokenizer
+    monkeypatch.undo()
+    assert db.rebuild_search_index()[0]
+    assert db.fuzzy_index
+    assert [url[1] for url, _ in db.find_urls("100x")] == ["http://b.com/100x-done"]
+    db.close()
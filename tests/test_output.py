@@ -0,0 +1,54 @@
+import io
+import json
+
+from click.testing import CliRunner
+
+from pyjj import pyjj
+from pyjj.output import format_urls, record_lines, write_lines
+
+URLS = [
+    ((1, "http://a.com", "2020-01-01", "A\ttitle"), ["x", "y"]),
+    ((2, "http://b.com", "2020-01-02", None), []),
+]
+
+
+def test_record_lines():
+    assert json.loads("".join(format_urls(URLS, "json")))[0] == {
+        "id": 1,
+        "url": "http://a.com",
+        "tags": ["x", "y"],
+        "created_at": "2020-01-01",
+        "title": "A\ttitle",
+    }
+    assert json.loads("".join(format_urls([], "json"))) == []
+    lines = [json.loads(line) for line in format_urls(URLS, "jsonl")]
+    assert [line["id"] for line in lines] == [1, 2]
+    assert list(format_urls(URLS, "tsv")) == [
+        "id\turl\ttags\tcreated_at\ttitle\n",
+        "1\thttp://a.com\tx,y\t2020-01-01\tA title\n",
+        "2\thttp://b.com\t\t2020-01-02\t\n",
+    ]
+    divisions = [("work", *URLS[0])]
+    assert next(format_urls(divisions, "tsv", divisions=True)).startswith("division")
+    assert list(record_lines([], "jsonl", ())) == []
+
+
+def test_write_lines():
+    stream = io.StringIO()
+    write_lines(stream, (f"{i}\n" for i in range(3000)))
+    assert stream.getvalue().splitlines() == [str(i) for i in range(3000)]
+
+
+def test_output_format(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYJJ_HOME", str(tmp_path))
+    monkeypatch.setenv("PYJJ_NO_DAEMON", "1")
+    runner = CliRunner()
+    runner.invoke(pyjj, ["add", "http://a.com", "-t", "x"])
+
+    # neither colors nor the banner are written into piped output
+    result = runner.invoke(pyjj, ["list", "-f", "json"])
+    assert [url["url"] for url in json.loads(result.stdout)] == ["http://a.com"]
+    result = runner.invoke(pyjj, ["tags", "-f", "tsv"])
+    assert result.stdout.splitlines()[1].startswith("1\tx\t")
+    result = runner.invoke(pyjj, ["list"])
+    assert "http://a.com" in result.stdout and "\u001b" not in result.stdout
@@ -0,0 +1,52 @@
+import json
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+
+from pyjj import pyjj
+from pyjj.database import Database
+from pyjj.profiler import Tracer
+
+
+def test_tracer(tmp_path):
+    tracer = Tracer("test")
+    db = Database(division="test", path=str(tmp_path), tracer=tracer)
+    db.setup()
+    db.add_url("http://a.com", tags=["x"])
+    db.add_url("http://b.com")
+    assert len(db.list_urls()[1]) == 2
+    db.close()
+
+    assert tracer.commits == 4  # a migration, two urls and tags of one
+    assert all(statement.division == "test" for statement in tracer.statements)
+    rows = [s.rows for s in tracer.statements if s.sql.startswith("SELECT A.id")]
+    assert rows == [2]
+    slowest = tracer.slowest(100)
+    assert sum(group["calls"] for group in slowest) == len(tracer.statements)
+    assert slowest == sorted(slowest, key=lambda g: g["time"], reverse=True)
+
+    # rows are counted as they are fetched, and failures are recorded
+    db = Database(division="test", path=str(tmp_path), tracer=tracer)
+    db.cursor.execute("SELECT 1")
+    assert tracer.statements[-1].rows == 0
+    assert next(db.cursor) == (1,) and tracer.statements[-1].rows == 1
+    with pytest.raises(sqlite3.OperationalError):
+        db.cursor.execute("SELECT * FROM missing")
+    assert "no such table" in tracer.statements[-1].error
+    db.close()
+
+
+def test_profile_command(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYJJ_HOME", str(tmp_path))
+    monkeypatch.setenv("PYJJ_TRACE", str(tmp_path / "trace.jsonl"))
+    runner = CliRunner()
+    runner.invoke(pyjj, ["add", "http://a.com"])
+    result = runner.invoke(pyjj, ["--profile", "list"])
+    assert "http://a.com" in result.output
+    assert "list:" in result.output and "1 statements" not in result.output
+
+    traces = [json.loads(line) for line in open(tmp_path / "trace.jsonl")]
+    assert [trace["command"] for trace in traces] == ["add", "list"]
+    assert traces[0]["commits"] == 2  # a migration and the url
+    assert any("INSERT INTO" in s["sql"] for s in traces[0]["statements"])
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from pyjj.database import Database
+from pyjj.remote import RemoteDatabase, connect_database, socket_path
+from pyjj.server import Handler, Server
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYJJ_HOME", str(tmp_path))
+    monkeypatch.delenv("PYJJ_NO_DAEMON", raising=False)
+    return tmp_path
+
+
+@pytest.fixture
+def server(home):
+    server = Server(socket_path(), db_path=str(home / ".db"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def direct(home, division="test"):
+    def fallback():
+        db = Database(division=division, path=str(home / ".db"))
+        db.setup()
+        return db
+
+    return fallback
+
+
+def test_fallback_without_daemon(home):
+    db = connect_database("test", direct(home))
+    assert isinstance(db, Database)
+    db.close()
+
+    # a socket left by a daemon that is gone
+    (home / ".pyjj.sock").write_text("")
+    db = connect_database("test", direct(home))
+    assert isinstance(db, Database)
+    db.close()
+
+
+def test_remote_database(home, server, monkeypatch):
+    db = connect_database("test", direct(home))
+    assert isinstance(db, RemoteDatabase)
+
+    assert db.add_url("http://a.com", tags=["x"]) == (True, "Added successfully! id: 1")
+    assert db.add_url("http://b.com")[0]
+    assert [url[1] for url, _ in db.iter_urls(tags=("x",))] == ["http://a.com"]
+    status, (url, tags) = db.get_random_url(tag="x")
+    assert url[1] == "http://a.com" and tags == ["x"]
+    assert db.get_url(3) == (False, "Given id does not exist! id: 3")
+    with pytest.raises(RuntimeError):
+        list(db.iter_urls(tag=1, unknown=True))
+
+    # an abandoned stream doesn't leak rows into the next response
+    next(iter(db.iter_urls()))
+    assert len(db.list_urls()[1]) == 2
+
+    # methods that are not exposed run on a direct connection
+    assert db.bulk_add_urls([{"url": "c.com", "tags": [], "created_at": None}])[0]
+    assert db._local is not None
+    assert [url[0] for url, _ in db.search_urls("c.com")] == [3]
+    assert list(server.databases) == ["test"]
+
+    monkeypatch.setenv("PYJJ_NO_DAEMON", "1")
+    assert isinstance(connect_database("test", direct(home)), Database)
+    db.close()
+
+
+def test_idle_connection_reconnects(home, server, monkeypatch):
+    monkeypatch.setattr(Handler, "timeout", 0.1)
+    db = connect_database("test", direct(home))
+    assert db.add_url("http://a.com")[0]
+    time.sleep(0.3)  # dropped by the daemon meanwhile
+    assert db.get_url(1)[1][1] == "http://a.com"
+    db.close()
+
+
+def test_results_match_direct_connection(home, server):
+    local = direct(home)()
+    db = connect_database("test", direct(home))
+    db.add_url("http://a.com", tags=["x", "y"])
+    db.add_url("http://b.com", tags=["y"])
+    for method, args in [
+        ("get_url", (1,)),
+        ("get_url", (9,)),
+        ("get_random_url", ("x",)),
+        ("list_tags", ()),
+        ("list_urls", ()),
+        ("check_tag", ("y",)),
+        ("suggest_tags", ("xy",)),
+    ]:
+        assert getattr(db, method)(*args) == getattr(local, method)(*args)
+    assert list(db.iter_urls()) == list(local.iter_urls())
+    assert list(db.find_urls("a.com")) == list(local.find_urls("a.com"))
+    local.close()
+    db.close()
+
+
+def test_slow_stream_reader(home, server, monkeypatch):
+    monkeypatch.setattr(Handler, "timeout", 0.2)
+    local = direct(home)()
+    path = "x" * 100  # rows enough to fill buffers of the socket
+    urls = (f"http://{i}.com/{path}" for i in range(20000))
+    local.bulk_add_urls({"url": url, "tags": ["t"]} for url in urls)
+    local.close()
+
+    reader = connect_database("test", direct(home))
+    rows = reader.iter_urls()
+    next(rows)
+    # other clients are answered while the stream waits for its reader
+    other = connect_database("test", direct(home))
+    start = time.perf_counter()
+    assert other.check_tag("t") == (True, 1)
+    assert time.perf_counter() - start < 0.2
+    time.sleep(0.5)
+    # and the stream is not cut off
+    assert len(list(rows)) == 19999
+    other.close()
+    reader.close()
@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules only some commands need; importing them on startup slows every command
+LAZY_MODULES = [
+    "yaml",
+    "sqlite3",
+    "pyjj.database",
+    "pyjj.formats",
+    "pyjj.checker",
+    "pyjj.enricher",
+    "pyjj.divisions",
+    "pyjj.profiler",
+    "pyjj.sync",
+    "pyjj.aio",
+]
+
+
+def loaded_modules(home, *args):
+    code = (
+        "import sys\nfrom pyjj import pyjj\ntry:\n    pyjj()\nexcept SystemExit:\n"
+        f"    print(__import__('json').dumps([m for m in {LAZY_MODULES!r} "
+        "if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code, *args],
+        env={**os.environ, "PYJJ_HOME": str(home), "PYTHONPATH": ROOT},
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(result.stdout.decode().splitlines()[-1])
+
+
+def test_lazy_imports(tmp_path):
+    assert loaded_modules(tmp_path, "--help") == []
+    # config.yaml is parsed by yaml once, then read from the json cache
+    assert loaded_modules(tmp_path, "tags", "--help") == ["yaml"]
+    assert loaded_modules(tmp_path, "tags", "--help") == []
+    assert loaded_modules(tmp_path, "use", "other") == ["yaml"]
+    assert not (tmp_path / ".db").exists()
+    assert loaded_modules(tmp_path, "tags") == ["sqlite3", "pyjj.database"]
@@ -0,0 +1,119 @@
+import pytest
+
+from pyjj.database import Database
+from pyjj.sync import read_delta, write_delta
+
+
+def open_db(tmp_path, name):
+    db = Database(division="test", path=str(tmp_path / name))
+    db.setup()
+    return db
+
+
+def sync(source, target, since, path):
+    """Moves changes of source since a sequence number to target through a file"""
+    seq = source.last_change()
+    with open(path, "w") as f:
+        write_delta(f, source.division, since, seq, source.iter_changes(since, seq))
+    with open(path) as f:
+        header, changes = read_delta(f)
+        status, report = target.apply_changes(changes)
+    assert status and header["seq"] == seq
+    return seq, report
+
+
+def state(db):
+    return sorted((url[1], sorted(tags)) for url, tags in db.iter_urls())
+
+
+def test_sync_divisions(tmp_path):
+    laptop, server = open_db(tmp_path, "laptop"), open_db(tmp_path, "server")
+    delta = str(tmp_path / "delta.jsonl")
+    laptop.add_url("http://a.com", tags=["x", "y"])
+    laptop.add_url("http://b.com", tags=["y"])
+    laptop_seq, report = sync(laptop, server, 0, delta)
+    assert report == {
+        "added": 2,
+        "updated": 0,
+        "removed": 0,
+        "tagged": 3,
+        "untagged": 0,
+    }
+    assert state(server) == state(laptop)
+
+    # concurrent edits on both sides are merged
+    laptop.remove_url(2)
+    laptop.merge_tags(["x"], "z")
+    laptop.save_metadata([(1, 200, "A", None, None, None, "2020-01-01 00:00:00")])
+    server.add_url("http://c.com", tags=["y"])
+    server.add_tags(1, ["w"])
+    server_seq = server.last_change()
+    laptop_seq, report = sync(laptop, server, laptop_seq, delta)
+    assert report == {
+        "added": 0,
+        "updated": 1,
+        "removed": 1,
+        "tagged": 1,
+        "untagged": 1,
+    }
+    _, report = sync(server, laptop, 0, delta)
+    assert state(server) == state(laptop) == [
+        ("http://a.com", ["w", "y", "z"]),
+        ("http://c.com", ["y"]),
+    ]
+    assert laptop.get_url(1)[1][3] == "A" == server.get_url(1)[1][3]
+
+    # deltas overlap safely, and changes applied are not logged back
+    laptop_seq = laptop.last_change()
+    _, report = sync(server, laptop, server_seq, delta)
+    assert not any(report.values())
+    assert laptop.last_change() == laptop_seq
+    assert state(server) == state(laptop)
+    laptop.close()
+    server.close()
+
+
+def test_export_follows_changes(tmp_path):
+    db = open_db(tmp_path, "db")
+    db.add_url("http://a.com", tags=["x"])
+    db.add_url("http://c.com", tags=["y"])
+    since = db.last_change()
+    assert list(db.iter_changes(since)) == []
+
+    # an edited url is removed under its old url, along with its tags
+    db.edit_url(1, "http://b.com")
+    assert list(db.iter_changes(since)) == [
+        {"url": "http://a.com", "deleted": True},
+        {"url": "http://b.com", "created_at": db.get_url(1)[1][2]},
+        {"url": "http://b.com", "tag": "x"},
+    ]
+
+    # a url merged into its duplicate is not removed elsewhere, but its tags move
+    since = db.last_change()
+    db.connection.execute(
+        "INSERT INTO pyjj_test_urls (url, url_hash) VALUES (?, 0)",
+        ("http://b.com/?utm_source=x",),
+    )
+    db.add_tags(3, ["m"])
+    db.rehash_urls()
+    assert db.merge_duplicates()[0]
+    assert list(db.iter_changes(since)) == [{"url": "http://b.com", "tag": "m"}]
+
+    # renamed tags are changes of every url with them, changed or not once each
+    since = db.last_change()
+    db.merge_tags(["x"], "z")
+    db.merge_tags(["z"], "w")
+    assert list(db.iter_changes(since)) == [
+        {"url": "http://b.com", "tag": "x", "deleted": True},
+        {"url": "http://b.com", "tag": "z", "deleted": True},
+        {"url": "http://b.com", "tag": "w"},
+    ]
+    db.close()
+
+
+def test_read_delta(tmp_path):
+    path = tmp_path / "delta.jsonl"
+    path.write_text('{"url": "http://a.com"}\n')
+    with pytest.raises(ValueError):
+        with open(path) as f:
+            read_delta(f)
@@ -0,0 +1,35 @@
+import pytest
+
+from pyjj.utils import canonicalize_url, parse_ids, url_hash
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://www.x.com/a/",
+        "http://x.com/a",
+        "HTTP://X.COM:80/a",
+        "https://x.com:443/a/#section",
+        "x.com/a?utm_source=feed&utm_medium=rss",
+    ],
+)
+def test_canonicalize_url(url):
+    assert canonicalize_url(url) == "x.com/a"
+    assert url_hash(url) == url_hash("x.com/a")
+
+
+def test_canonicalize_url_keeps_meaningful_parts():
+    assert canonicalize_url("x.com/a?b=2&a=1&fbclid=3") == "x.com/a?a=1&b=2"
+    assert canonicalize_url("x.com/a?fbclid=3", tracking_params=()) == (
+        "x.com/a?fbclid=3"
+    )
+    assert canonicalize_url("http://x.com:8080/A") == "x.com:8080/A"
+    assert url_hash("x.com/a") != url_hash("x.com/b")
+    assert -(2 ** 63) <= url_hash("x.com/a") < 2 ** 63
+
+
+def test_parse_ids():
+    assert parse_ids(["3", "1-10,12", "4,"]) == ([3, 12, 4], [(1, 10)])
+    for value in ("a", "1-", "-3", "1-b"):
+        with pytest.raises(ValueError):
+            parse_ids([value])